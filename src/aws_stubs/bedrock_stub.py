@@ -1,54 +1,78 @@
 """
-AWS Bedrock Integration Stub - For Future Cloud Migration
+AWS Bedrock Integration (Optional) - Requires boto3 and AWS credentials
 Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
 MIT License - See LICENSE file
 
-TODO: This is a stub showing how to integrate with AWS Bedrock.
-Uncomment and configure when ready to use AWS services.
+Uses the Bedrock Converse streaming API, so any chat model enabled in
+the account works (set BEDROCK_MODEL_ID). Credentials come from the
+standard boto3 chain (environment, ~/.aws, instance role).
 """
 
 import os
-import json
-from typing import Optional, Dict
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 
-# TODO: Uncomment to enable AWS integration
-# import boto3
-# from botocore.config import Config
+try:
+    import boto3
+    from botocore.config import Config
+except ImportError:  # Optional: pip install boto3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
 
 class BedrockAdapter:
     """
     AWS Bedrock integration for IT diagnostics using foundation models.
-    
-    TODO: Configure AWS credentials and region before enabling.
+
+    One bedrock-runtime client is shared by every call for the adapter's
+    lifetime; call aclose() at shutdown. boto3 is blocking, so calls run
+    on a dedicated thread pool of BEDROCK_MAX_CONCURRENCY threads (the
+    client's connection pool has the same size) and streamed tokens are
+    handed back to the event loop as they arrive. Throttling and
+    transient errors are retried by botocore's adaptive retry mode,
+    which also rate-limits the client after throttling responses.
+
     See: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/credentials.html
     """
-    
-    def __init__(self):
+
+    def __init__(self, client: Optional[Any] = None):
         """
-        Initialize Bedrock client and configure prompt templates.
-        
-        TODO: Uncomment and configure:
-        1. Set up AWS credentials
-        2. Choose your AWS region
-        3. Select foundation model
-        4. Adjust prompt templates
+        Args:
+            client: Pre-built bedrock-runtime client (tests, custom sessions);
+                by default one is created on first use
         """
         # Verify AWS credentials are configured
-        if not self._check_aws_config():
+        if client is None and not self._check_aws_config():
             raise ValueError(
-                "AWS credentials not configured. Please set up credentials and region. "
-                "For testing/demo, use MockLLM instead."
+                "AWS credentials not configured. Please install boto3 and set up "
+                "credentials and region. For testing/demo, use MockLLM instead."
             )
-            
-        # Prompt templates for first and second turn
-        self.first_turn_template = """
-Human: You are an expert IT support technician. Analyze this issue:
 
-{user_input}
+        self.region = os.getenv("BEDROCK_REGION") or os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
+        self.model_id = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+        # e.g. http://localhost:4566 to test against a local mock server
+        self.endpoint_url = os.getenv("BEDROCK_ENDPOINT_URL") or None
+
+        # Concurrency, timeout and retry settings
+        self.max_concurrency = max(1, int(os.getenv("BEDROCK_MAX_CONCURRENCY", "8")))
+        self.timeout = float(os.getenv("BEDROCK_TIMEOUT", "60"))
+        self.max_attempts = max(1, int(os.getenv("BEDROCK_MAX_ATTEMPTS", "5")))
+        self.max_tokens = int(os.getenv("BEDROCK_MAX_TOKENS", "500"))
+
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # System prompts for first and second turn
+        self.first_turn_template = """
+You are an expert IT support technician. Analyze the issue described in the user's message.
 
 Provide a structured response with:
 1. Issue category
-2. ONE diagnostic command to run (start with COMMAND:)
+2. One to three diagnostic commands to run, each on its own line starting with COMMAND:
 3. Likely cause and recommended fix
 
 Only suggest commands from this safe list:
@@ -64,15 +88,10 @@ Category: <category>
 COMMAND: <safe command>
 Likely cause: <brief explanation>
 """
-        
-        self.second_turn_template = """
-Human: Based on the diagnostic results, provide a final analysis:
-
-Initial assessment:
-{initial_response}
 
-Command output:
-{command_output}
+        self.second_turn_template = """
+Analyze the diagnostic results in the user's message, which contains the
+initial assessment and the diagnostic command output.
 
 Provide a final diagnosis and specific fix steps.
 
@@ -80,69 +99,134 @@ Format:
 Diagnosis: <clear explanation>
 Fix: <numbered steps>
 """
-        
-        # Initialize Bedrock runtime client when ready
-        """
-        self.client = boto3.client(
-            service_name='bedrock-runtime',
-            region_name='us-east-1',  # TODO: Change to your region
-            config=Config(
-                retries = dict(
-                    max_attempts = 3
-                )
+
+    def _check_aws_config(self) -> bool:
+        """Check boto3 is installed and finds credentials and a region."""
+        if boto3 is None:
+            return False
+        session = boto3.Session()
+        region = os.getenv("BEDROCK_REGION") or session.region_name
+        return region is not None and session.get_credentials() is not None
+
+    @property
+    def client(self) -> Any:
+        """Shared bedrock-runtime client, created on first use (thread-safe)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = boto3.client(
+                        service_name="bedrock-runtime",
+                        region_name=self.region,
+                        endpoint_url=self.endpoint_url,
+                        config=Config(
+                            retries={"max_attempts": self.max_attempts, "mode": "adaptive"},
+                            max_pool_connections=self.max_concurrency,
+                            connect_timeout=min(self.timeout, 5.0),
+                            read_timeout=self.timeout,
+                            tcp_keepalive=True
+                        )
+                    )
+        return self._client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Threads that run the blocking boto3 calls."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix="bedrock"
             )
-        )
-        
-        # Select foundation model
-        self.model_id = 'anthropic.claude-v2'  # or amazon.titan-text-express-v1
+        return self._executor
+
+    async def aclose(self) -> None:
+        """Close the client and stop the thread pool."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        client, self._client = self._client, None
+        close = getattr(client, "close", None)
+        if close is not None:
+            close()
+
+    def _request(self, prompt: str) -> Dict:
+        """ConverseStream arguments for a first- or second-turn prompt."""
+        if "output:" in prompt.lower():
+            system_prompt = self.second_turn_template
+        else:
+            system_prompt = self.first_turn_template
+        return {
+            "modelId": self.model_id,
+            "system": [{"text": system_prompt}],
+            "messages": [{"role": "user", "content": [{"text": prompt}]}],
+            "inferenceConfig": {"maxTokens": self.max_tokens, "temperature": 0.7},
+        }
+
+    async def _events(self, prompt: str) -> AsyncIterator[Tuple[str, Any]]:
         """
-    
-    def _check_aws_config(self) -> bool:
-        """Check if AWS credentials are configured."""
-        # TODO: Implement proper AWS credentials check
-        return False
-        
+        Stream one call, yielding ("text", delta) then ("error", exc) on failure.
+
+        A pool thread iterates the blocking event stream and posts each
+        delta to the loop; if the consumer stops early the thread closes
+        the stream at the next event.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def post(kind: str, value: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+            except RuntimeError:
+                stopped.set()  # Event loop already closed
+
+        def produce() -> None:
+            try:
+                events = self.client.converse_stream(**self._request(prompt))["stream"]
+                try:
+                    for event in events:
+                        if stopped.is_set():
+                            break
+                        text = event.get("contentBlockDelta", {}).get("delta", {}).get("text")
+                        if text:
+                            post("text", text)
+                finally:
+                    close = getattr(events, "close", None)
+                    if close is not None:
+                        close()
+                post("done", None)
+            except Exception as e:
+                post("error", e)
+
+        loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "done":
+                    return
+                yield kind, value
+                if kind == "error":
+                    return
+        finally:
+            stopped.set()
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield the reply as text deltas arrive from Bedrock."""
+        async for kind, value in self._events(prompt):
+            if kind == "error":
+                logger.warning("Bedrock stream failed: %s", value)
+                yield f"Error calling AWS Bedrock: {value}"
+            else:
+                yield value
+
     async def query(self, prompt: str) -> str:
         """
         Send query to AWS Bedrock and return structured response.
-        
-        TODO: Implement when ready to use AWS Bedrock
-        """
-        raise NotImplementedError(
-            "AWS Bedrock integration is disabled by default. "
-            "Uncomment the code and configure AWS credentials to enable."
-        )
-        
+
+        Returns:
+            The model's reply, or an error message if the call failed
         """
-        try:
-            # Determine which template to use
-            if "Command output:" in prompt:
-                template = self.second_turn_template
-            else:
-                template = self.first_turn_template
-                
-            # Prepare request body for Claude model
-            request_body = {
-                "prompt": template.format(user_input=prompt),
-                "max_tokens_to_sample": 500,
-                "temperature": 0.7,
-                "top_k": 250,
-                "anthropic_version": "bedrock-2023-05-31"
-            }
-            
-            # Invoke model
-            response = self.client.invoke_model(
-                body=json.dumps(request_body),
-                modelId=self.model_id,
-                accept='application/json',
-                contentType='application/json'
-            )
-            
-            # Parse response
-            response_body = json.loads(response.get('body').read())
-            return response_body.get('completion', 
-                "Error: Unable to get response from model")
-                
-        except Exception as e:
-            return f"Error calling AWS Bedrock: {str(e)}"
-        """
\ No newline at end of file
+        parts = []
+        async for kind, value in self._events(prompt):
+            if kind == "error":
+                return f"Error calling AWS Bedrock: {value}"
+            parts.append(value)
+        return "".join(parts)
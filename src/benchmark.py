@@ -0,0 +1,396 @@
+"""
+Benchmark Harness - Load-tests the diagnose pipeline
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+
+Usage:
+    python -m src.benchmark --requests 500 --concurrency 20
+    python -m src.benchmark --url http://127.0.0.1:8000 --save-baseline bench.json
+    python -m src.benchmark --baseline bench.json --tolerance 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+
+from .simulation import SimulatedLLMBackend, SimulationProfile
+
+# Share of generated tickets per MockLLM category ("unknown" matches none)
+DEFAULT_MIX = {"network": 0.4, "printer": 0.3, "performance": 0.2, "unknown": 0.1}
+
+# Issues no MockLLM trigger matches, exercising the default path
+UNKNOWN_ISSUES = [
+    "Outlook keeps asking for my password",
+    "My screen resolution changed on its own",
+    "The badge reader at the front door rejects my card",
+]
+
+STAGES = ("ticket_create", "llm_turn1", "command_run", "llm_turn2", "ticket_update")
+
+def build_issues(templates: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """One realistic issue text per trigger of each MockLLM category."""
+    issues = {
+        category: [f"Help, {trigger} since this morning" for trigger in template["triggers"]]
+        for category, template in templates.items()
+    }
+    issues["unknown"] = list(UNKNOWN_ISSUES)
+    return issues
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse a mix such as "network=4,printer=1" into normalized weights."""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError(f"Issue mix has no positive weights: {spec}")
+    return {name: weight / total for name, weight in weights.items()}
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile (q in 0..100) of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> float:
+    """
+    Estimate a quantile (q in 0..1) from cumulative histogram buckets,
+    interpolating inside the bucket like Prometheus' histogram_quantile.
+    """
+    if not buckets or buckets[-1][1] <= 0:
+        return 0.0
+    target = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= target:
+            if bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (target - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+def parse_stage_buckets(text: str) -> Dict[str, Dict[float, float]]:
+    """Read helpdesk_stage_duration_seconds buckets from a /metrics scrape."""
+    stages: Dict[str, Dict[float, float]] = {}
+    prefix = "helpdesk_stage_duration_seconds_bucket{"
+    for line in text.splitlines():
+        if not line.startswith(prefix):
+            continue
+        labels, _, value = line[len(prefix):].partition("} ")
+        fields = dict(part.split("=", 1) for part in labels.split(","))
+        stage = fields["stage"].strip('"')
+        le = fields["le"].strip('"')
+        bound = float("inf") if le == "+Inf" else float(le)
+        stages.setdefault(stage, {})[bound] = float(value)
+    return stages
+
+def stage_quantiles(
+    before: Dict[str, Dict[float, float]],
+    after: Dict[str, Dict[float, float]]
+) -> Dict[str, Dict[str, float]]:
+    """Per-stage count and p50/p95/p99 (ms) of the observations between two scrapes."""
+    report = {}
+    for stage, buckets in after.items():
+        previous = before.get(stage, {})
+        delta = sorted((bound, count - previous.get(bound, 0)) for bound, count in buckets.items())
+        if not delta or delta[-1][1] <= 0:
+            continue
+        report[stage] = {
+            "count": int(delta[-1][1]),
+            **{
+                f"p{q}": round(histogram_quantile(q / 100, delta) * 1000, 3)
+                for q in (50, 95, 99)
+            }
+        }
+    return report
+
+def latency_profile(llm_latency_ms: float = 0, command_latency_ms: float = 0) -> SimulationProfile:
+    """Simulation profile with fixed LLM and command latencies."""
+    return SimulationProfile({
+        "llm": {"default": {"latency_ms": llm_latency_ms}},
+        "commands": {"default": {"latency_ms": command_latency_ms}},
+    })
+
+@asynccontextmanager
+async def in_process_app(
+    profile: Optional[SimulationProfile] = None,
+    command_cache: bool = True,
+    coalesce: bool = False
+) -> AsyncIterator[Any]:
+    """
+    Yield src.main's app configured for benchmarking, then restore it.
+
+    Tickets go to a throwaway database, commands are simulated and the
+    profile's latencies and faults are injected with asyncio.sleep so
+    concurrency is exercised as it would be against real backends.
+    """
+    from . import main
+    from .db import TicketStore
+    from .diagnostics import CommandCache
+
+    diagnostics = main.diagnostics
+    saved = (main.db, main.llm, diagnostics.force_simulation, diagnostics.cache,
+             diagnostics.simulation, main.COALESCE_PIPELINES)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        main.db = TicketStore(data_dir)
+        if profile is not None:
+            backend_name = os.getenv("LLM_BACKEND", "mock").lower()
+            main.llm = SimulatedLLMBackend(main.llm, profile, backend_name)
+            diagnostics.simulation = profile
+        diagnostics.force_simulation = True
+        if not command_cache:
+            diagnostics.cache = CommandCache(0)
+        main.COALESCE_PIPELINES = coalesce
+        await main.db.open()
+        try:
+            yield main.app
+        finally:
+            await main.db.close()
+            (main.db, main.llm, diagnostics.force_simulation, diagnostics.cache,
+             diagnostics.simulation, main.COALESCE_PIPELINES) = saved
+
+async def run_benchmark(
+    requests: int = 200,
+    concurrency: int = 10,
+    mix: Optional[Dict[str, float]] = None,
+    url: Optional[str] = None,
+    endpoint: str = "/diagnose",
+    llm_latency_ms: float = 0,
+    command_latency_ms: float = 0,
+    command_cache: bool = True,
+    coalesce: bool = False,
+    profile_path: Optional[str] = None,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Drive the diagnose pipeline and report throughput and latency.
+
+    Args:
+        requests: Total requests to send
+        concurrency: Requests in flight at once
+        mix: Weights per category (see DEFAULT_MIX)
+        url: Server base URL; in-process (ASGI) when omitted
+        endpoint: "/diagnose" or "/diagnose/stream"
+        llm_latency_ms: Delay injected per LLM turn (in-process only)
+        command_latency_ms: Delay injected per simulated command (in-process only)
+        command_cache: Keep the command result cache on (in-process only)
+        coalesce: Let identical concurrent issues share a pipeline (in-process only)
+        profile_path: Simulation profile replacing the fixed latencies (in-process only)
+        seed: Seed for the issue sequence, so runs are reproducible
+
+    Returns:
+        Report dict with config, throughput, end-to-end and per-stage percentiles
+    """
+    from .mock_llm import MockLLM
+
+    mix = mix or DEFAULT_MIX
+    issues = build_issues(MockLLM().templates)
+    unknown = set(mix) - set(issues)
+    if unknown:
+        raise ValueError(f"Unknown categories in mix: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(seed)
+    categories = rng.choices(list(mix), weights=list(mix.values()), k=requests)
+    payloads = [
+        {"username": f"bench{i}", "issue": rng.choice(issues[category])}
+        for i, category in enumerate(categories)
+    ]
+
+    config = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "mix": mix,
+        "target": url or "in-process",
+        "endpoint": endpoint,
+        "llm_latency_ms": llm_latency_ms,
+        "command_latency_ms": command_latency_ms,
+        "command_cache": command_cache,
+        "coalesce": coalesce,
+        "profile": profile_path,
+        "seed": seed,
+    }
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+            return await _drive(client, payloads, concurrency, endpoint, config)
+
+    if profile_path:
+        profile = SimulationProfile.from_file(profile_path)
+    elif llm_latency_ms or command_latency_ms:
+        profile = latency_profile(llm_latency_ms, command_latency_ms)
+    else:
+        profile = None
+
+    async with in_process_app(profile, command_cache, coalesce) as app:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await _drive(client, payloads, concurrency, endpoint, config)
+
+async def _drive(
+    client: httpx.AsyncClient,
+    payloads: List[Dict],
+    concurrency: int,
+    endpoint: str,
+    config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Send payloads with bounded concurrency, timing each request."""
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+
+    async def worker() -> None:
+        nonlocal errors
+        while not queue.empty():
+            payload = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=payload)
+                ok = response.status_code == 200 and '"event": "error"' not in response.text
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    before = parse_stage_buckets((await client.get("/metrics")).text)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    duration = time.perf_counter() - started
+    after = parse_stage_buckets((await client.get("/metrics")).text)
+
+    return {
+        "config": config,
+        "completed": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            **{f"p{q}": round(percentile(latencies, q) * 1000, 3) for q in (50, 95, 99)},
+            "max": round(max(latencies, default=0) * 1000, 3),
+        },
+        "stages_ms": stage_quantiles(before, after),
+    }
+
+def compare_to_baseline(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.2
+) -> List[str]:
+    """
+    List regressions of report against a saved baseline.
+
+    Throughput may drop, and end-to-end or per-stage p95 may grow, by at
+    most tolerance (a fraction) before it counts as a regression.
+    """
+    regressions = []
+    old_rps, new_rps = baseline["throughput_rps"], report["throughput_rps"]
+    if new_rps < old_rps * (1 - tolerance):
+        regressions.append(f"throughput {new_rps} rps < baseline {old_rps} rps")
+
+    pairs = [("end_to_end", baseline["latency_ms"], report["latency_ms"])]
+    pairs += [
+        (stage, baseline["stages_ms"][stage], report["stages_ms"][stage])
+        for stage in STAGES
+        if stage in baseline.get("stages_ms", {}) and stage in report["stages_ms"]
+    ]
+    for name, old, new in pairs:
+        # Ignore sub-millisecond noise on near-instant stages
+        if new["p95"] > max(old["p95"] * (1 + tolerance), old["p95"] + 1):
+            regressions.append(f"{name} p95 {new['p95']} ms > baseline {old['p95']} ms")
+
+    if report["errors"] > baseline["errors"]:
+        regressions.append(f"errors {report['errors']} > baseline {baseline['errors']}")
+    return regressions
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Human-readable summary table."""
+    latency = report["latency_ms"]
+    lines = [
+        f"target={report['config']['target']} endpoint={report['config']['endpoint']} "
+        f"requests={report['config']['requests']} concurrency={report['config']['concurrency']}",
+        f"completed={report['completed']} errors={report['errors']} "
+        f"duration={report['duration_s']}s throughput={report['throughput_rps']} req/s",
+        "",
+        f"{'stage':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+        f"{'end_to_end':<14}{report['completed']:>8}"
+        f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}",
+    ]
+    for stage in STAGES:
+        stats = report["stages_ms"].get(stage)
+        if stats:
+            lines.append(
+                f"{stage:<14}{stats['count']:>8}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}"
+            )
+    return "\n".join(lines)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the diagnose pipeline")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--mix", default="", help='Category weights, e.g. "network=4,printer=3,unknown=1"')
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--endpoint", default="/diagnose", choices=["/diagnose", "/diagnose/stream"])
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--command-latency-ms", type=float, default=0)
+    parser.add_argument("--no-command-cache", action="store_true")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Let identical concurrent issues share one pipeline run")
+    parser.add_argument("--profile", help="Simulation profile (JSON/YAML) for in-process runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Fail on regressions against this report")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(
+        requests=args.requests,
+        concurrency=args.concurrency,
+        mix=parse_mix(args.mix) if args.mix else None,
+        url=args.url,
+        endpoint=args.endpoint,
+        llm_latency_ms=args.llm_latency_ms,
+        command_latency_ms=args.command_latency_ms,
+        command_cache=not args.no_command_cache,
+        coalesce=args.coalesce,
+        profile_path=args.profile,
+        seed=args.seed
+    ))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+Issue Classifier - TF-IDF naive Bayes trained on ticket history
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+
+Learns issue text -> (category, command plan) from resolved tickets so
+confident issues can skip the first LLM turn:
+
+    python -m src.classifier train --data-dir data --output data/classifier.json
+    python -m src.classifier predict "printer says offline"
+
+Then set DIAGNOSE_CLASSIFIER_PATH=data/classifier.json.
+"""
+
+import os
+import sys
+import json
+import math
+import asyncio
+import argparse
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # Optional: pip install numpy (vectorized batch scoring)
+    np = None
+
+from .llm_cache import normalize_prompt
+
+MODEL_VERSION = 1
+
+class Prediction(NamedTuple):
+    category: str
+    command: str
+    confidence: float
+
+def features(text: str) -> Counter:
+    """Word unigram and bigram counts of a normalized text."""
+    words = normalize_prompt(text).split()
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+class IssueClassifier:
+    """
+    Multinomial naive Bayes over sublinear TF-IDF features.
+
+    Labels are (category, command) pairs, where command is the ticket's
+    full plan ("a; b" for several commands). Confidence is the softmax
+    of the class scores, or 0 when fewer than min_features of the
+    issue's features are in the vocabulary: the scores would then be
+    (nearly) the class priors, which say nothing about the issue.
+    Models are stored as JSON, not pickles, so a model file is safe to
+    load.
+    """
+
+    def __init__(
+        self,
+        vocabulary: List[str],
+        idf: List[float],
+        labels: List[Tuple[str, str]],
+        class_log_prior: List[float],
+        feature_log_prob: List[List[float]],
+        samples: int = 0,
+        min_features: int = 2
+    ):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.labels = [tuple(label) for label in labels]
+        self.class_log_prior = class_log_prior
+        self.feature_log_prob = feature_log_prob
+        self.samples = samples
+        self.min_features = min_features
+
+        self._index = {token: i for i, token in enumerate(vocabulary)}
+        # token -> log probability per class, for sparse scoring
+        self._columns = {
+            token: [row[i] for row in feature_log_prob] for token, i in self._index.items()
+        }
+        if np is not None:
+            self._matrix = np.array(feature_log_prob, dtype=np.float64).T
+            self._prior = np.array(class_log_prior, dtype=np.float64)
+
+    @classmethod
+    def fit(
+        cls,
+        issues: Sequence[str],
+        labels: Sequence[Tuple[str, str]],
+        alpha: float = 0.1,
+        max_features: int = 5000,
+        min_samples: int = 3
+    ) -> "IssueClassifier":
+        """
+        Train on issue texts and their (category, command) labels.
+
+        Labels seen fewer than min_samples times are left out; at least
+        two labels must remain.
+        """
+        label_counts = Counter(labels)
+        kept = sorted(label for label, count in label_counts.items() if count >= min_samples)
+        if len(kept) < 2:
+            raise ValueError(
+                f"Need at least two labels with {min_samples}+ tickets each, found {len(kept)}"
+            )
+        label_index = {label: i for i, label in enumerate(kept)}
+        docs = [
+            (features(issue), label_index[label])
+            for issue, label in zip(issues, labels) if label in label_index
+        ]
+        n = len(docs)
+
+        document_frequency: Counter = Counter()
+        for counts, _ in docs:
+            document_frequency.update(counts.keys())
+        vocabulary = sorted(
+            sorted(document_frequency, key=lambda token: (-document_frequency[token], token))[:max_features]
+        )
+        index = {token: i for i, token in enumerate(vocabulary)}
+        idf = [math.log((1 + n) / (1 + document_frequency[token])) + 1 for token in vocabulary]
+
+        weights = [[0.0] * len(vocabulary) for _ in kept]
+        for counts, label in docs:
+            row = weights[label]
+            for token, count in counts.items():
+                i = index.get(token)
+                if i is not None:
+                    row[i] += (1 + math.log(count)) * idf[i]
+
+        feature_log_prob = []
+        for row in weights:
+            total = sum(row) + alpha * len(vocabulary)
+            feature_log_prob.append([math.log((weight + alpha) / total) for weight in row])
+        class_sizes = Counter(label for _, label in docs)
+        class_log_prior = [math.log(class_sizes[i] / n) for i in range(len(kept))]
+
+        return cls(vocabulary, idf, kept, class_log_prior, feature_log_prob, samples=n)
+
+    def _vector(self, text: str) -> Dict[int, float]:
+        """Sparse TF-IDF vector (index -> weight) of a text."""
+        vector = {}
+        for token, count in features(text).items():
+            i = self._index.get(token)
+            if i is not None:
+                vector[i] = (1 + math.log(count)) * self.idf[i]
+        return vector
+
+    def _prediction(self, scores: Sequence[float], matched: int) -> Prediction:
+        best = max(range(len(scores)), key=scores.__getitem__)
+        category, command = self.labels[best]
+        if matched < self.min_features:
+            return Prediction(category, command, 0.0)
+        top = scores[best]
+        confidence = 1 / sum(math.exp(score - top) for score in scores)
+        return Prediction(category, command, confidence)
+
+    def predict(self, issue: str) -> Prediction:
+        """Most likely (category, command) for one issue, with confidence."""
+        scores = list(self.class_log_prior)
+        matched = 0
+        for token, count in features(issue).items():
+            column = self._columns.get(token)
+            if column is not None:
+                matched += 1
+                weight = (1 + math.log(count)) * self.idf[self._index[token]]
+                for c, log_prob in enumerate(column):
+                    scores[c] += weight * log_prob
+        return self._prediction(scores, matched)
+
+    def predict_batch(self, issues: Iterable[str]) -> List[Prediction]:
+        """Score many issues at once (one matrix product with NumPy)."""
+        issues = list(issues)
+        if np is None or not issues:
+            return [self.predict(issue) for issue in issues]
+
+        X = np.zeros((len(issues), len(self.vocabulary)))
+        matched = []
+        for row, issue in enumerate(issues):
+            vector = self._vector(issue)
+            matched.append(len(vector))
+            for i, weight in vector.items():
+                X[row, i] = weight
+        scores = X @ self._matrix + self._prior
+        return [self._prediction(row.tolist(), n) for row, n in zip(scores, matched)]
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": MODEL_VERSION,
+            "samples": self.samples,
+            "vocabulary": self.vocabulary,
+            "idf": self.idf,
+            "labels": [list(label) for label in self.labels],
+            "class_log_prior": self.class_log_prior,
+            "feature_log_prob": self.feature_log_prob,
+        }
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write the model as JSON (atomically replacing any old model)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(self.to_dict()))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "IssueClassifier":
+        """Read a model written by save()."""
+        data = json.loads(Path(path).read_text())
+        if data.get("version") != MODEL_VERSION:
+            raise ValueError(f"Unsupported classifier model version: {data.get('version')}")
+        return cls(
+            data["vocabulary"], data["idf"], data["labels"],
+            data["class_log_prior"], data["feature_log_prob"], samples=data.get("samples", 0)
+        )
+
+def load_classifier() -> Optional[IssueClassifier]:
+    """Model from DIAGNOSE_CLASSIFIER_PATH, or None when not set."""
+    path = os.getenv("DIAGNOSE_CLASSIFIER_PATH", "").strip()
+    if not path:
+        return None
+    model = IssueClassifier.load(path)
+    model.min_features = int(os.getenv("DIAGNOSE_CLASSIFIER_MIN_FEATURES", "2"))
+    return model
+
+async def training_rows(store, page_size: int = 500) -> List[Tuple[str, Tuple[str, str]]]:
+    """(issue, (category, command)) for every diagnosed ticket in a TicketStore."""
+    rows = []
+    cursor = None
+    while True:
+        tickets, cursor = await store.list_tickets(
+            before_id=cursor, limit=page_size, columns=["issue", "category", "command"]
+        )
+        for ticket in tickets:
+            if ticket.get("category") and ticket.get("command"):
+                rows.append((ticket["issue"], (ticket["category"], ticket["command"])))
+        if cursor is None:
+            return rows
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Train or query the ticket classifier")
+    commands = parser.add_subparsers(dest="action", required=True)
+    train = commands.add_parser("train", help="Train from the ticket history")
+    train.add_argument("--data-dir", default="data")
+    train.add_argument("--output", default="data/classifier.json")
+    train.add_argument("--min-samples", type=int, default=3)
+    train.add_argument("--max-features", type=int, default=5000)
+    train.add_argument("--alpha", type=float, default=0.1)
+    predict = commands.add_parser("predict", help="Classify issue texts")
+    predict.add_argument("--model", default="data/classifier.json")
+    predict.add_argument("issues", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.action == "predict":
+        model = IssueClassifier.load(args.model)
+        for issue, prediction in zip(args.issues, model.predict_batch(args.issues)):
+            print(f"{prediction.confidence:.3f}  {prediction.category} | {prediction.command}  <- {issue}")
+        return 0
+
+    from .db import TicketStore
+    store = TicketStore(data_dir=args.data_dir)
+
+    async def load() -> List[Tuple[str, Tuple[str, str]]]:
+        try:
+            return await training_rows(store)
+        finally:
+            await store.close()
+
+    rows = asyncio.run(load())
+    try:
+        model = IssueClassifier.fit(
+            [issue for issue, _ in rows], [label for _, label in rows],
+            alpha=args.alpha, max_features=args.max_features, min_samples=args.min_samples
+        )
+    except ValueError as e:
+        print(f"Training failed: {e}", file=sys.stderr)
+        return 1
+    model.save(args.output)
+
+    labels = set(model.labels)
+    known = [(issue, label) for issue, label in rows if label in labels]
+    correct = sum(
+        (prediction.category, prediction.command) == label
+        for prediction, (_, label) in zip(model.predict_batch(issue for issue, _ in known), known)
+    )
+    print(f"Trained on {model.samples} tickets: {len(model.labels)} labels, "
+          f"{len(model.vocabulary)} features, training accuracy {correct / max(1, len(known)):.1%}")
+    print(f"Saved to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,38 +5,427 @@ MIT License - See LICENSE file
 """
 
 import os
+import re
 import json
+import zlib
+import asyncio
+import hashlib
+import logging
 import sqlite3
+import threading
 import aiosqlite
-from datetime import datetime
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+from .metrics import JSON_FALLBACK, SQLITE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Allowed values for PRAGMA synchronous (validated before interpolation)
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# Codecs for command output blobs (DB_OUTPUT_COMPRESSION)
+OUTPUT_CODECS = {"zstd", "zlib", "none"}
+
+# Columns list_tickets may project (validated before interpolation)
+TICKET_COLUMNS = (
+    "id", "username", "issue", "category", "diagnosis", "command",
+    "output", "output_summary", "fix", "created_at", "updated_at"
+)
+
+# Default projection for listings: everything except the large output
+LIST_COLUMNS = tuple(column for column in TICKET_COLUMNS if column != "output")
+
+# Secondary indexes serving the list_tickets filters, newest first
+TICKET_INDEXES = {
+    "idx_tickets_username": "tickets (username, id)",
+    "idx_tickets_category": "tickets (category, id)",
+    "idx_tickets_diagnosis": "tickets (diagnosis, id)",
+    "idx_tickets_created_at": "tickets (created_at, id)",
+    "idx_tickets_output_hash": "tickets (output_hash)",
+}
+
+# Output blobs left behind by replaced outputs or deleted tickets
+PRUNE_OUTPUTS_SQL = (
+    "DELETE FROM command_outputs WHERE hash NOT IN "
+    "(SELECT output_hash FROM tickets WHERE output_hash IS NOT NULL)"
+)
+
+# External-content FTS5 index over the free-text columns, kept in sync by triggers
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+        issue, diagnosis, fix, content='tickets', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tickets_fts_insert AFTER INSERT ON tickets BEGIN
+        INSERT INTO tickets_fts (rowid, issue, diagnosis, fix)
+        VALUES (new.id, new.issue, new.diagnosis, new.fix);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tickets_fts_delete AFTER DELETE ON tickets BEGIN
+        INSERT INTO tickets_fts (tickets_fts, rowid, issue, diagnosis, fix)
+        VALUES ('delete', old.id, old.issue, old.diagnosis, old.fix);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tickets_fts_update AFTER UPDATE OF issue, diagnosis, fix ON tickets BEGIN
+        INSERT INTO tickets_fts (tickets_fts, rowid, issue, diagnosis, fix)
+        VALUES ('delete', old.id, old.issue, old.diagnosis, old.fix);
+        INSERT INTO tickets_fts (rowid, issue, diagnosis, fix)
+        VALUES (new.id, new.issue, new.diagnosis, new.fix);
+    END
+    """,
+]
+
+def _encode_output(output: str, codec: str) -> Tuple[str, int, bytes]:
+    """Return (sha256 hex, raw size, compressed bytes) for a command output."""
+    raw = output.encode("utf-8")
+    if codec == "zstd":
+        data = zstandard.ZstdCompressor(level=3).compress(raw)
+    elif codec == "zlib":
+        data = zlib.compress(raw, 6)
+    else:
+        data = raw
+    return hashlib.sha256(raw).hexdigest(), len(raw), data
+
+def _decode_output(codec: str, data: bytes) -> str:
+    """Inverse of _encode_output for a stored blob."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed output")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        raw = zlib.decompress(data)
+    else:
+        raw = data
+    return raw.decode("utf-8")
+
+# Messages of SQLite errors caused by the search text rather than the database
+QUERY_ERRORS = ("fts5:", "syntax error", "malformed match")
+
+def _fts_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query matching all of its words.
+    Returns "" for text without words, which must not be matched.
+    """
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+def _sql_timestamp(value: datetime) -> str:
+    """Format a datetime like SQLite's CURRENT_TIMESTAMP (naive means UTC)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def _utc(value: Optional[datetime], naive_tz: Optional[timezone] = timezone.utc) -> Optional[datetime]:
+    """
+    Convert to an aware UTC datetime.
+
+    Naive values are taken to be in naive_tz: UTC for filter arguments
+    (as in _sql_timestamp), or None for local time, which is how the
+    JSON journal stores its timestamps.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None and naive_tz is not None:
+        value = value.replace(tzinfo=naive_tz)
+    return value.astimezone(timezone.utc)
+
+def _lock_file(f) -> None:
+    """Take an exclusive, blocking lock on an open file."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock_file(f) -> None:
+    """Release a lock taken with _lock_file."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class TicketJournal:
+    """
+    Append-only JSON-lines ticket log used when SQLite is unavailable.
+
+    Every create or update appends the ticket's full current state as one
+    line, so a write costs one append instead of rewriting the whole file.
+    An in-memory index maps each ticket ID to the offset of its latest
+    line; it is rebuilt by scanning the file on startup and caught up
+    incrementally when other workers append. A lock file serializes
+    access across worker processes (and a thread lock across threads of
+    one process), and superseded lines are dropped by compaction once
+    they outnumber live tickets.
+
+    All methods block on file I/O and the lock; TicketStore calls them
+    from worker threads, never on the event loop.
+    """
+
+    def __init__(self, path: Path, compact_min_lines: int = 1000):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self.compact_min_lines = compact_min_lines
+
+        self._index: Dict[int, int] = {}
+        self._max_id = 0
+        self._lines = 0
+        self._end = 0
+        self._inode: Optional[int] = None
+        self._thread_lock = threading.RLock()
+
+        # Build the index from whatever is already on disk
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the cross-process lock with the index caught up to disk."""
+        with self._thread_lock, open(self.lock_path, "a+b") as lock_file:
+            _lock_file(lock_file)
+            try:
+                self._refresh()
+                yield
+            finally:
+                _unlock_file(lock_file)
+
+    def _reset(self) -> None:
+        """Forget the in-memory index."""
+        self._index.clear()
+        self._max_id = 0
+        self._lines = 0
+        self._end = 0
+        self._inode = None
+
+    def _refresh(self) -> None:
+        """Catch the index up with lines appended or compacted by others."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+
+        # A different inode or a shorter file means another worker compacted
+        if stat.st_ino != self._inode or stat.st_size < self._end:
+            self._reset()
+            self._inode = stat.st_ino
+
+        if stat.st_size > self._end:
+            self._scan()
+
+    def _scan(self) -> None:
+        """Index complete lines from the current end offset onwards."""
+        with open(self.path, "rb") as f:
+            f.seek(self._end)
+            offset = self._end
+            for line in f:
+                # Stop at a partially written trailing line
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    ticket_id = int(json.loads(line)["id"])
+                except (ValueError, KeyError, TypeError):
+                    ticket_id = None
+                if ticket_id is not None:
+                    self._index[ticket_id] = offset
+                    self._max_id = max(self._max_id, ticket_id)
+                offset += len(line)
+                self._lines += 1
+            self._end = offset
+
+    def _read(self, offset: int) -> Dict:
+        """Read the ticket line stored at an offset."""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _append(self, ticket: Dict) -> None:
+        """Append one ticket line and point the index at it."""
+        data = (json.dumps(ticket) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(data)
+            self._inode = os.fstat(f.fileno()).st_ino
+
+        self._index[ticket["id"]] = self._end
+        self._max_id = max(self._max_id, ticket["id"])
+        self._end += len(data)
+        self._lines += 1
+
+        if self._lines > max(self.compact_min_lines, 2 * len(self._index)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the journal keeping only the latest line per ticket."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            for ticket_id in sorted(self._index):
+                src.seek(self._index[ticket_id])
+                dst.write(src.readline())
+        os.replace(tmp_path, self.path)
+
+        self._reset()
+        self._refresh()
+
+    def compact(self) -> None:
+        """Drop superseded lines from the journal."""
+        with self._locked():
+            if self._index:
+                self._compact()
+
+    def put(self, ticket: Dict) -> None:
+        """Store a full ticket record, replacing any earlier version."""
+        with self._locked():
+            self._append(ticket)
+
+    def create(self, username: str, issue: str, ticket_id: Optional[int] = None) -> int:
+        """Append a new ticket and return its ID."""
+        with self._locked():
+            if ticket_id is None:
+                ticket_id = self._max_id + 1
+            now = datetime.now().isoformat()
+            self._append({
+                "id": ticket_id,
+                "username": username,
+                "issue": issue,
+                "created_at": now,
+                "updated_at": now
+            })
+            return ticket_id
+
+    def update(self, ticket_id: int, **fields: Optional[str]) -> bool:
+        """Append a new version of a ticket with the given fields set."""
+        with self._locked():
+            offset = self._index.get(ticket_id)
+            if offset is None:
+                return False
+            ticket = self._read(offset)
+            ticket.update({key: value for key, value in fields.items() if value})
+            ticket["updated_at"] = datetime.now().isoformat()
+            self._append(ticket)
+            return True
+
+    def get(self, ticket_id: int) -> Optional[Dict]:
+        """Return the latest version of a ticket."""
+        with self._locked():
+            offset = self._index.get(ticket_id)
+            if offset is None:
+                return None
+            return self._read(offset)
+
+    def scan(self, before_id: Optional[int] = None) -> Iterator[Dict]:
+        """Yield the latest version of each ticket, newest ID first."""
+        with self._locked():
+            offsets = sorted(self._index.items(), reverse=True)
+        for ticket_id, offset in offsets:
+            if before_id is not None and ticket_id >= before_id:
+                continue
+            try:
+                yield self._read(offset)
+            except (OSError, ValueError):
+                # Compacted by another worker since the snapshot
+                ticket = self.get(ticket_id)
+                if ticket is not None:
+                    yield ticket
+
 
 class TicketStore:
     """
     Manages IT support tickets using SQLite with JSON fallback.
     Handles both storage methods transparently.
+
+    SQLite access goes through a small pool of long-lived connections:
+    one writer (serialized by a lock) and a bounded set of readers. The
+    pool is opened at application startup via open() and released at
+    shutdown via close(); it is also opened lazily on first use.
+
+    With DB_WRITE_BEHIND enabled, creates and updates are queued and
+    committed by a background task in batched transactions. Ticket IDs
+    are pre-allocated so create_ticket can still return one immediately.
+
+    The JSON fallback journal takes a blocking file lock, so its calls
+    run in worker threads (asyncio.to_thread) to keep the loop free
+    while another process holds the lock or compacts the journal.
     """
     
-    def __init__(self):
+    def __init__(self, data_dir: Union[str, Path] = "data"):
         # Ensure data directory exists
-        self.data_dir = Path("data")
+        self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
         
         self.db_path = self.data_dir / "tickets.db"
-        self.json_path = self.data_dir / "diagnostics_log.json"
+        self.json_path = self.data_dir / "diagnostics_log.jsonl"
+        self.legacy_json_path = self.data_dir / "diagnostics_log.json"
+        self.journal_compact_min_lines = int(os.getenv("JOURNAL_COMPACT_MIN_LINES", "1000"))
+        self._journal: Optional[TicketJournal] = None
+        self._journal_lock = threading.Lock()
+
+        # Connection pool tuning
+        self.reader_pool_size = max(1, int(os.getenv("DB_READER_POOL_SIZE", "4")))
+        self.busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+        self.synchronous = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid DB_SYNCHRONOUS value: {self.synchronous}")
+
+        # Write-behind batching: DB_WRITE_DURABILITY is "flush" (callers
+        # wait for the batch commit) or "async" (fire-and-forget)
+        self.write_behind = os.getenv("DB_WRITE_BEHIND", "").lower() == "true"
+        self.flush_interval_ms = int(os.getenv("DB_FLUSH_INTERVAL_MS", "20"))
+        self.flush_max_rows = max(1, int(os.getenv("DB_FLUSH_MAX_ROWS", "100")))
+        self.write_durability = os.getenv("DB_WRITE_DURABILITY", "flush").lower()
+        if self.write_durability not in ("flush", "async"):
+            raise ValueError(f"Invalid DB_WRITE_DURABILITY value: {self.write_durability}")
+
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._writer_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._id_lock = asyncio.Lock()
+        self._next_id = 0
+        self._id_block_end = 0
+        self.fts_enabled = False
+
+        # Command output lives compressed in a deduplicated side table
+        self.output_codec = os.getenv(
+            "DB_OUTPUT_COMPRESSION", "zstd" if zstandard is not None else "zlib"
+        ).lower()
+        if self.output_codec not in OUTPUT_CODECS:
+            raise ValueError(f"Invalid DB_OUTPUT_COMPRESSION value: {self.output_codec}")
+        if self.output_codec == "zstd" and zstandard is None:
+            raise ValueError("DB_OUTPUT_COMPRESSION=zstd requires the zstandard package")
         
         # Try SQLite first, fall back to JSON if needed
         self.use_sqlite = True
         try:
             self._init_db()
         except sqlite3.Error:
-            print("Warning: SQLite initialization failed. Using JSON fallback.")
+            logger.warning("SQLite initialization failed. Using JSON fallback.")
+            SQLITE_ERRORS.inc()
             self.use_sqlite = False
             
     def _init_db(self):
         """Initialize SQLite database schema."""
         with sqlite3.connect(self.db_path) as conn:
+            # WAL is persistent in the database file, so set it once here
+            conn.execute("PRAGMA journal_mode = WAL")
             conn.execute("""
             CREATE TABLE IF NOT EXISTS tickets (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -50,12 +439,395 @@ class TicketStore:
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """)
+
+            # Command outputs, content-addressed by SHA-256 of the raw text
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS command_outputs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            )
+            """)
+
+            # Migrate databases created before these columns existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tickets)")}
+            if "category" not in columns:
+                conn.execute("ALTER TABLE tickets ADD COLUMN category TEXT")
+            if "output_hash" not in columns:
+                conn.execute("ALTER TABLE tickets ADD COLUMN output_hash TEXT")
+            if "output_summary" not in columns:
+                conn.execute("ALTER TABLE tickets ADD COLUMN output_summary TEXT")
+            self._migrate_inline_outputs(conn)
+
+            for name, target in TICKET_INDEXES.items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+            conn.execute(PRUNE_OUTPUTS_SQL)
+
+            # Full-text search needs SQLite built with FTS5; LIKE is the fallback
+            try:
+                had_fts = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'tickets_fts'"
+                ).fetchone() is not None
+                for statement in FTS_SCHEMA:
+                    conn.execute(statement)
+                if not had_fts:
+                    conn.execute("INSERT INTO tickets_fts (tickets_fts) VALUES ('rebuild')")
+                self.fts_enabled = True
+            except sqlite3.OperationalError as e:
+                logger.warning("FTS5 unavailable, text search will scan: %s", e)
+
+    def _migrate_inline_outputs(self, conn: sqlite3.Connection, batch_size: int = 500) -> None:
+        """Move outputs stored inline in tickets.output into command_outputs."""
+        while True:
+            rows = conn.execute(
+                "SELECT id, output FROM tickets WHERE output IS NOT NULL LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                return
+            for ticket_id, output in rows:
+                digest, size, data = _encode_output(output, self.output_codec)
+                conn.execute(
+                    "INSERT OR IGNORE INTO command_outputs (hash, codec, size, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (digest, self.output_codec, size, data)
+                )
+                conn.execute(
+                    "UPDATE tickets SET output = NULL, output_hash = ? WHERE id = ?",
+                    (digest, ticket_id)
+                )
+            conn.commit()
+
+    async def open(self) -> None:
+        """Open the connection pool and start the write-behind flusher."""
+        await self._open_pool()
+        if self.write_behind and self._writer is not None and self._flusher is None:
+            self._write_queue = asyncio.Queue()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _open_pool(self) -> None:
+        """Open the writer and reader connections if not already open."""
+        if not self.use_sqlite or self._writer is not None:
+            return
+
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            try:
+                writer = await self._connect()
+                readers: asyncio.Queue = asyncio.Queue()
+                for _ in range(self.reader_pool_size):
+                    conn = await self._connect()
+                    await conn.execute("PRAGMA query_only = ON")
+                    readers.put_nowait(conn)
+            except Exception as e:
+                self._sqlite_failed(e)
+                return
+            self._readers = readers
+            self._writer = writer
+
+    async def close(self) -> None:
+        """Flush queued writes and close all pooled connections."""
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None and not flusher.done():
+            self._write_queue.put_nowait(("stop", None, None))
+            await flusher
+
+        async with self._writer_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+        readers, self._readers = self._readers, None
+        while readers is not None and not readers.empty():
+            await readers.get_nowait().close()
+
+    def _sqlite_failed(self, error: Exception) -> None:
+        """Record a SQLite error and switch to the JSON fallback."""
+        logger.warning("SQLite error, using JSON fallback: %s", error)
+        SQLITE_ERRORS.inc()
+        self.use_sqlite = False
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Open one connection with the pool's per-connection pragmas."""
+        conn = await aiosqlite.connect(self.db_path)
+        await conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        await conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        return conn
+
+    @asynccontextmanager
+    async def _write_conn(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Hold the single writer connection for one transaction."""
+        await self._open_pool()
+        if self._writer is None:
+            raise sqlite3.OperationalError("SQLite connection pool is not available")
+
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def _read_conn(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Check a reader connection out of the pool."""
+        await self._open_pool()
+        readers = self._readers
+        if readers is None:
+            raise sqlite3.OperationalError("SQLite connection pool is not available")
+
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            if self._readers is readers:
+                readers.put_nowait(conn)
+            else:
+                # Pool was closed while this reader was checked out
+                await conn.close()
+            
+    async def flush(self) -> None:
+        """Wait until every queued write-behind operation is committed."""
+        if not self._write_behind_active():
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait(("flush", None, future))
+        await future
+
+    def _write_behind_active(self) -> bool:
+        """Whether the flusher task is running on the current event loop."""
+        return (
+            self._flusher is not None
+            and not self._flusher.done()
+            and self._flusher.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def _allocate_id(self) -> int:
+        """
+        Hand out a ticket ID from a block reserved in sqlite_sequence.
+
+        Reserving whole blocks keeps IDs unique across worker processes
+        while letting write-behind inserts return their ID immediately.
+        """
+        async with self._id_lock:
+            if self._next_id >= self._id_block_end:
+                async with self._write_conn() as db:
+                    await db.execute("BEGIN IMMEDIATE")
+                    async with db.execute(
+                        "SELECT seq FROM sqlite_sequence WHERE name = 'tickets'"
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                    if row is None:
+                        async with db.execute(
+                            "SELECT COALESCE(MAX(id), 0) FROM tickets"
+                        ) as cursor:
+                            start = (await cursor.fetchone())[0]
+                        await db.execute(
+                            "INSERT INTO sqlite_sequence (name, seq) VALUES ('tickets', ?)",
+                            (start + self.flush_max_rows,)
+                        )
+                    else:
+                        start = row[0]
+                        await db.execute(
+                            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'tickets'",
+                            (start + self.flush_max_rows,)
+                        )
+                    await db.commit()
+                self._next_id = start + 1
+                self._id_block_end = start + self.flush_max_rows + 1
+
+            ticket_id = self._next_id
+            self._next_id += 1
+            return ticket_id
+
+    async def _enqueue_write(self, kind: str, fields: Dict) -> None:
+        """Queue a write for the flusher; wait for its commit in flush mode."""
+        future = None
+        if self.write_durability == "flush":
+            future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((kind, fields, future))
+        if future is not None:
+            await future
+
+    async def _flush_loop(self) -> None:
+        """Background task committing queued writes in batched transactions."""
+        loop = asyncio.get_running_loop()
+        queue = self._write_queue
+        stopping = False
+
+        while not stopping:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.flush_interval_ms / 1000
+
+            # Collect until the interval elapses, the batch is full, or a
+            # flush/stop request asks for an immediate commit
+            while batch[-1][0] in ("create", "update"):
+                if len(batch) >= self.flush_max_rows:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            if batch[-1][0] == "stop":
+                # Flush-on-shutdown: drain everything still queued
+                stopping = True
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+
+            error = None
+            try:
+                await self._write_batch(
+                    [item for item in batch if item[0] in ("create", "update")]
+                )
+            except Exception as e:
+                logger.error("Error flushing ticket writes: %s", e)
+                error = e
+
+            for _, _, future in batch:
+                if future is None or future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def _write_batch(self, ops: List[Tuple[str, Dict, Optional[asyncio.Future]]]) -> None:
+        """Commit a batch of queued writes in a single transaction."""
+        if not ops:
+            return
+
+        if self.use_sqlite:
+            try:
+                async with self._write_conn() as db:
+                    for kind, fields, _ in ops:
+                        if kind == "create":
+                            await db.execute(
+                                "INSERT INTO tickets (id, username, issue) VALUES (?, ?, ?)",
+                                (fields["ticket_id"], fields["username"], fields["issue"])
+                            )
+                        else:
+                            await self._apply_update(db, fields)
+                    await db.commit()
+                    return
+            except Exception as e:
+                self._sqlite_failed(e)
+
+        # Replay the batch against the JSON fallback
+        def replay() -> None:
+            for kind, fields, _ in ops:
+                if kind == "create":
+                    self._json_create_ticket(**fields)
+                else:
+                    self._json_update_ticket(**fields)
+
+        await asyncio.to_thread(replay)
+
+    async def _apply_update(self, db: aiosqlite.Connection, fields: Dict) -> None:
+        """Store the output blob (once per distinct output) and update the ticket."""
+        fields = dict(fields)
+        output = fields.pop("output", None)
+        if output:
+            digest, size, data = _encode_output(output, self.output_codec)
+            await db.execute(
+                "INSERT OR IGNORE INTO command_outputs (hash, codec, size, data) "
+                "VALUES (?, ?, ?, ?)",
+                (digest, self.output_codec, size, data)
+            )
+            fields["output_hash"] = digest
+        await db.execute(*self._update_query(**fields))
+
+    async def prune_outputs(self) -> int:
+        """
+        Delete command output blobs no ticket references any more.
+
+        Runs at startup; long-running servers can call it periodically.
+
+        Returns:
+            Number of blobs deleted
+        """
+        if not self.use_sqlite:
+            return 0
+        await self.flush()
+        async with self._write_conn() as db:
+            cursor = await db.execute(PRUNE_OUTPUTS_SQL)
+            await db.commit()
+            return cursor.rowcount
+
+    async def _load_outputs(self, db: aiosqlite.Connection, rows: List[Dict]) -> None:
+        """Replace each row's output_hash with the decompressed output text."""
+        hashes = {row["output_hash"] for row in rows if row.get("output_hash")}
+        blobs = {}
+        if hashes:
+            placeholders = ", ".join("?" * len(hashes))
+            async with db.execute(
+                f"SELECT hash, codec, data FROM command_outputs WHERE hash IN ({placeholders})",
+                tuple(hashes)
+            ) as cursor:
+                for digest, codec, data in await cursor.fetchall():
+                    blobs[digest] = _decode_output(codec, data)
+        for row in rows:
+            digest = row.pop("output_hash", None)
+            if digest is not None:
+                row["output"] = blobs.get(digest)
+
+    @staticmethod
+    def _update_query(
+        ticket_id: int,
+        diagnosis: Optional[str] = None,
+        command: Optional[str] = None,
+        output_hash: Optional[str] = None,
+        fix: Optional[str] = None,
+        category: Optional[str] = None,
+        output_summary: Optional[str] = None
+    ) -> Tuple[str, List]:
+        """Build a dynamic UPDATE statement from the provided fields."""
+        fields = []
+        values = []
+        if category:
+            fields.append("category = ?")
+            values.append(category)
+        if diagnosis:
+            fields.append("diagnosis = ?")
+            values.append(diagnosis)
+        if command:
+            fields.append("command = ?")
+            values.append(command)
+        if output_hash:
+            fields.append("output_hash = ?")
+            values.append(output_hash)
+        if output_summary:
+            fields.append("output_summary = ?")
+            values.append(output_summary)
+        if fix:
+            fields.append("fix = ?")
+            values.append(fix)
+
+        fields.append("updated_at = CURRENT_TIMESTAMP")
+        values.append(ticket_id)
+
+        return f"UPDATE tickets SET {', '.join(fields)} WHERE id = ?", values
             
     async def create_ticket(self, username: str, issue: str) -> int:
         """Create a new support ticket and return its ID."""
         if self.use_sqlite:
             try:
-                async with aiosqlite.connect(self.db_path) as db:
+                if self._write_behind_active():
+                    ticket_id = await self._allocate_id()
+                    await self._enqueue_write("create", {
+                        "ticket_id": ticket_id,
+                        "username": username,
+                        "issue": issue
+                    })
+                    return ticket_id
+
+                async with self._write_conn() as db:
                     cursor = await db.execute(
                         "INSERT INTO tickets (username, issue) VALUES (?, ?)",
                         (username, issue)
@@ -63,35 +835,44 @@ class TicketStore:
                     await db.commit()
                     return cursor.lastrowid
             except Exception as e:
-                print(f"SQLite error: {e}")
-                self.use_sqlite = False
-                
-        # JSON fallback
-        try:
-            if self.json_path.exists():
-                with open(self.json_path) as f:
-                    tickets = json.load(f)
-                next_id = max(int(t["id"]) for t in tickets) + 1
-            else:
-                tickets = []
-                next_id = 1
-                
-            tickets.append({
-                "id": next_id,
-                "username": username,
-                "issue": issue,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            })
-            
-            with open(self.json_path, "w") as f:
-                json.dump(tickets, f, indent=2)
+                self._sqlite_failed(e)
                 
-            return next_id
+        return await asyncio.to_thread(self._json_create_ticket, username, issue)
             
-        except Exception as e:
-            print(f"Error creating ticket: {e}")
-            return -1
+    async def create_tickets(self, tickets: List[Tuple[str, str]]) -> List[int]:
+        """Create several (username, issue) tickets in one transaction."""
+        if self.use_sqlite:
+            try:
+                if self._write_behind_active():
+                    ids = []
+                    for username, issue in tickets:
+                        ids.append(await self._allocate_id())
+                    await asyncio.gather(*(
+                        self._enqueue_write("create", {
+                            "ticket_id": ticket_id,
+                            "username": username,
+                            "issue": issue
+                        })
+                        for ticket_id, (username, issue) in zip(ids, tickets)
+                    ))
+                    return ids
+
+                async with self._write_conn() as db:
+                    ids = []
+                    for username, issue in tickets:
+                        cursor = await db.execute(
+                            "INSERT INTO tickets (username, issue) VALUES (?, ?)",
+                            (username, issue)
+                        )
+                        ids.append(cursor.lastrowid)
+                    await db.commit()
+                    return ids
+            except Exception as e:
+                self._sqlite_failed(e)
+
+        return await asyncio.to_thread(
+            lambda: [self._json_create_ticket(username, issue) for username, issue in tickets]
+        )
             
     async def update_ticket(
         self,
@@ -99,103 +880,300 @@ class TicketStore:
         diagnosis: Optional[str] = None,
         command: Optional[str] = None,
         output: Optional[str] = None,
-        fix: Optional[str] = None
+        fix: Optional[str] = None,
+        category: Optional[str] = None,
+        output_summary: Optional[str] = None
     ) -> bool:
-        """Update an existing ticket with diagnostic results."""
+        """
+        Update an existing ticket with diagnostic results.
+
+        output is the raw command output (stored as a compressed blob);
+        output_summary its compact JSON summary from output_parsers.
+        """
+        fields = {
+            "ticket_id": ticket_id,
+            "diagnosis": diagnosis,
+            "command": command,
+            "output": output,
+            "fix": fix,
+            "category": category,
+            "output_summary": output_summary
+        }
+
         if self.use_sqlite:
             try:
-                async with aiosqlite.connect(self.db_path) as db:
-                    # Build dynamic update query based on provided fields
-                    fields = []
-                    values = []
-                    if diagnosis:
-                        fields.append("diagnosis = ?")
-                        values.append(diagnosis)
-                    if command:
-                        fields.append("command = ?")
-                        values.append(command)
-                    if output:
-                        fields.append("output = ?")
-                        values.append(output)
-                    if fix:
-                        fields.append("fix = ?")
-                        values.append(fix)
-                        
-                    fields.append("updated_at = CURRENT_TIMESTAMP")
-                    values.append(ticket_id)
-                    
-                    query = f"UPDATE tickets SET {', '.join(fields)} WHERE id = ?"
-                    await db.execute(query, values)
+                if self._write_behind_active():
+                    await self._enqueue_write("update", fields)
+                    return True
+
+                async with self._write_conn() as db:
+                    await self._apply_update(db, fields)
                     await db.commit()
                     return True
                     
             except Exception as e:
-                print(f"SQLite error: {e}")
-                self.use_sqlite = False
-                
-        # JSON fallback
-        try:
-            if not self.json_path.exists():
-                return False
-                
-            with open(self.json_path) as f:
-                tickets = json.load(f)
+                self._sqlite_failed(e)
                 
-            for ticket in tickets:
-                if ticket["id"] == ticket_id:
-                    if diagnosis:
-                        ticket["diagnosis"] = diagnosis
-                    if command:
-                        ticket["command"] = command
-                    if output:
-                        ticket["output"] = output
-                    if fix:
-                        ticket["fix"] = fix
-                    ticket["updated_at"] = datetime.now().isoformat()
-                    break
-                    
-            with open(self.json_path, "w") as f:
-                json.dump(tickets, f, indent=2)
-                
-            return True
-            
-        except Exception as e:
-            print(f"Error updating ticket: {e}")
-            return False
+        return await asyncio.to_thread(self._json_update_ticket, **fields)
             
-    async def get_ticket(self, ticket_id: int) -> Optional[Dict]:
-        """Retrieve a ticket by ID."""
+    async def get_ticket(self, ticket_id: int, include_output: bool = True) -> Optional[Dict]:
+        """
+        Retrieve a ticket by ID.
+
+        The command output is read from its compressed blob only when
+        include_output is set; otherwise the output key is left out.
+        """
+        # Read-your-writes: commit anything still queued first
+        await self.flush()
+
+        columns = list(TICKET_COLUMNS if include_output else LIST_COLUMNS)
+        if include_output:
+            columns.append("output_hash")
+
         if self.use_sqlite:
             try:
-                async with aiosqlite.connect(self.db_path) as db:
+                async with self._read_conn() as db:
                     async with db.execute(
-                        "SELECT * FROM tickets WHERE id = ?",
+                        f"SELECT {', '.join(columns)} FROM tickets WHERE id = ?",
                         (ticket_id,)
                     ) as cursor:
                         row = await cursor.fetchone()
-                        if row:
-                            columns = [desc[0] for desc in cursor.description]
-                            return dict(zip(columns, row))
+                    if row is None:
                         return None
+                    ticket = dict(zip(columns, row))
+                    if include_output:
+                        await self._load_outputs(db, [ticket])
+                    return ticket
                         
             except Exception as e:
-                print(f"SQLite error: {e}")
-                self.use_sqlite = False
+                self._sqlite_failed(e)
                 
-        # JSON fallback
+        return await asyncio.to_thread(self._json_get_ticket, ticket_id, include_output)
+
+    async def list_tickets(
+        self,
+        username: Optional[str] = None,
+        category: Optional[str] = None,
+        diagnosis: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        text: Optional[str] = None,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+        columns: Optional[List[str]] = None
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """
+        List tickets newest first, filtered and paginated by keyset.
+
+        Args:
+            username: Exact username
+            category: Exact category from the first LLM turn
+            diagnosis: Exact diagnosis
+            created_after: Only tickets created at or after this time (UTC)
+            created_before: Only tickets created before this time (UTC)
+            text: Words that must all appear in the issue, diagnosis or fix
+            before_id: Cursor from the previous page; only older tickets
+            limit: Page size
+            columns: Columns to return (default LIST_COLUMNS, without output)
+
+        Returns:
+            (tickets, next_cursor), where next_cursor is None on the last page
+
+        Raises:
+            ValueError: If an unknown column is requested or the search
+                text is rejected by the full-text index
+        """
+        columns = list(columns or LIST_COLUMNS)
+        unknown = set(columns) - set(TICKET_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown ticket columns: {', '.join(sorted(unknown))}")
+        if "id" not in columns:
+            columns.insert(0, "id")
+
+        await self.flush()
+
+        if self.use_sqlite:
+            conditions = []
+            params: List = []
+            for column, value in (
+                ("username", username), ("category", category), ("diagnosis", diagnosis)
+            ):
+                if value is not None:
+                    conditions.append(f"{column} = ?")
+                    params.append(value)
+            if created_after is not None:
+                conditions.append("created_at >= ?")
+                params.append(_sql_timestamp(created_after))
+            if created_before is not None:
+                conditions.append("created_at < ?")
+                params.append(_sql_timestamp(created_before))
+            if text:
+                if self.fts_enabled:
+                    # Text without any words filters nothing (as in the LIKE path)
+                    fts_query = _fts_query(text)
+                    if fts_query:
+                        conditions.append(
+                            "id IN (SELECT rowid FROM tickets_fts WHERE tickets_fts MATCH ?)"
+                        )
+                        params.append(fts_query)
+                else:
+                    for word in re.findall(r"\w+", text):
+                        conditions.append(
+                            "(issue LIKE ? OR diagnosis LIKE ? OR fix LIKE ?)"
+                        )
+                        params.extend([f"%{word}%"] * 3)
+            if before_id is not None:
+                conditions.append("id < ?")
+                params.append(before_id)
+
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            # Output blobs are only read when the output column is requested
+            selected = columns + (["output_hash"] if "output" in columns else [])
+            try:
+                async with self._read_conn() as db:
+                    async with db.execute(
+                        f"SELECT {', '.join(selected)} FROM tickets {where}"
+                        "ORDER BY id DESC LIMIT ?",
+                        (*params, limit + 1)
+                    ) as cursor:
+                        rows = [dict(zip(selected, row)) for row in await cursor.fetchall()]
+                    rows, next_cursor = self._page(rows, limit)
+                    if "output" in columns:
+                        await self._load_outputs(db, rows)
+                return rows, next_cursor
+            except sqlite3.OperationalError as e:
+                # A bad search must not switch the whole store to the fallback
+                if text and any(marker in str(e).lower() for marker in QUERY_ERRORS):
+                    raise ValueError(f"Invalid search text: {text}") from e
+                self._sqlite_failed(e)
+            except Exception as e:
+                self._sqlite_failed(e)
+
+        return await asyncio.to_thread(
+            self._json_list_tickets, username, category, diagnosis,
+            created_after, created_before, text, before_id, limit, columns
+        )
+
+    def _json_list_tickets(
+        self,
+        username: Optional[str],
+        category: Optional[str],
+        diagnosis: Optional[str],
+        created_after: Optional[datetime],
+        created_before: Optional[datetime],
+        text: Optional[str],
+        before_id: Optional[int],
+        limit: int,
+        columns: List[str]
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """Scan the JSON fallback journal newest first (see list_tickets)."""
+        JSON_FALLBACK.inc(operation="list")
+        words = [word.lower() for word in re.findall(r"\w+", text or "")]
+        created_after = _utc(created_after)
+        created_before = _utc(created_before)
+        rows = []
+        for ticket in self.journal.scan(before_id):
+            if username is not None and ticket.get("username") != username:
+                continue
+            if category is not None and ticket.get("category") != category:
+                continue
+            if diagnosis is not None and ticket.get("diagnosis") != diagnosis:
+                continue
+            created = (
+                _utc(datetime.fromisoformat(ticket["created_at"]), naive_tz=None)
+                if ticket.get("created_at") else None
+            )
+            if created_after is not None and (created is None or created < created_after):
+                continue
+            if created_before is not None and (created is None or created >= created_before):
+                continue
+            if words:
+                haystack = " ".join(
+                    ticket.get(field) or "" for field in ("issue", "diagnosis", "fix")
+                ).lower()
+                if not all(word in haystack for word in words):
+                    continue
+            rows.append({column: ticket.get(column) for column in columns})
+            if len(rows) > limit:
+                break
+        return self._page(rows, limit)
+
+    @staticmethod
+    def _page(rows: List[Dict], limit: int) -> Tuple[List[Dict], Optional[int]]:
+        """Trim a limit+1 fetch to one page and derive the next cursor."""
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1]["id"]
+        return rows, None
+
+    @property
+    def journal(self) -> TicketJournal:
+        """JSON-lines fallback store, opened (and migrated) on first use."""
+        with self._journal_lock:
+            if self._journal is None:
+                self._journal = TicketJournal(self.json_path, self.journal_compact_min_lines)
+                self._migrate_legacy_json()
+            return self._journal
+
+    def _migrate_legacy_json(self) -> None:
+        """Import tickets from the old whole-file JSON log, once."""
+        if not self.legacy_json_path.exists():
+            return
+        with open(self.legacy_json_path) as f:
+            tickets = json.load(f)
+        for ticket in tickets:
+            if self._journal.get(int(ticket["id"])) is None:
+                self._journal.put(ticket)
+        self.legacy_json_path.rename(self.legacy_json_path.with_suffix(".json.bak"))
+
+    def _json_get_ticket(self, ticket_id: int, include_output: bool = True) -> Optional[Dict]:
+        """Read a ticket from the JSON fallback journal."""
+        JSON_FALLBACK.inc(operation="get")
         try:
-            if not self.json_path.exists():
-                return None
-                
-            with open(self.json_path) as f:
-                tickets = json.load(f)
-                
-            for ticket in tickets:
-                if ticket["id"] == ticket_id:
-                    return ticket
-                    
+            ticket = self.journal.get(ticket_id)
+            if ticket is not None and not include_output:
+                ticket.pop("output", None)
+            return ticket
+        except Exception as e:
+            logger.error("Error retrieving ticket: %s", e)
             return None
-            
+
+    def _json_create_ticket(
+        self,
+        username: str,
+        issue: str,
+        ticket_id: Optional[int] = None
+    ) -> int:
+        """Append a ticket to the JSON fallback journal and return its ID."""
+        JSON_FALLBACK.inc(operation="create")
+        try:
+            return self.journal.create(username, issue, ticket_id)
         except Exception as e:
-            print(f"Error retrieving ticket: {e}")
-            return None
\ No newline at end of file
+            logger.error("Error creating ticket: %s", e)
+            return -1
+
+    def _json_update_ticket(
+        self,
+        ticket_id: int,
+        diagnosis: Optional[str] = None,
+        command: Optional[str] = None,
+        output: Optional[str] = None,
+        fix: Optional[str] = None,
+        category: Optional[str] = None,
+        output_summary: Optional[str] = None
+    ) -> bool:
+        """Update a ticket in the JSON fallback journal."""
+        JSON_FALLBACK.inc(operation="update")
+        try:
+            return self.journal.update(
+                ticket_id,
+                diagnosis=diagnosis,
+                command=command,
+                output=output,
+                fix=fix,
+                category=category,
+                output_summary=output_summary
+            )
+        except Exception as e:
+            logger.error("Error updating ticket: %s", e)
+            return False
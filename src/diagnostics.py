@@ -5,11 +5,16 @@ MIT License - See LICENSE file
 """
 
 import os
+import re
 import time
-import subprocess
+import asyncio
+import ipaddress
 import platform
-from typing import Dict, List, Union
-import shlex
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from .metrics import COMMAND_EXECUTIONS, COMMANDS_RUNNING
+from .simulation import SimulationProfile, load_simulation_profile
 
 # Whitelist of allowed diagnostic commands
 # SECURITY: Only add commands that are safe for automated execution
@@ -35,6 +40,116 @@ ALLOWED_COMMANDS = {
     "top": ["top -n 1", "top -b -n 1"],
 }
 
+# Argument grammars for commands that take a target, one template per
+# accepted shape. {host} is a hostname or IP address; {count} and {hops}
+# are bounded integers (see ARGUMENT_TYPES).
+COMMAND_ARGUMENTS = {
+    "ping": ["{host}", "-c {count} {host}", "-n {count} {host}"],
+    "traceroute": ["{host}", "-m {hops} {host}"],
+    "tracert": ["{host}", "-h {hops} {host}"],
+}
+
+# Options added when a command matches a grammar template without any:
+# a bare "ping <host>" never exits on Linux/macOS, so it gets a count
+COMMAND_DEFAULTS = {
+    "ping": ["-n", "4"] if platform.system() == "Windows" else ["-c", "4"],
+}
+
+# RFC 1123 hostname: dot-separated labels, no leading/trailing hyphen
+_HOSTNAME = re.compile(
+    r"(?=.{1,253}$)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?"
+    r"(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)*"
+)
+_INTEGER = re.compile(r"[0-9]{1,4}")
+
+def _host_argument(token: str) -> Optional[str]:
+    """Normalized IP address or lowercased hostname, or None if invalid."""
+    try:
+        return str(ipaddress.ip_address(token))
+    except ValueError:
+        pass
+    token = token.lower()
+    # An all-numeric last label is a malformed IP, not a hostname
+    if not _HOSTNAME.fullmatch(token) or token.rsplit(".", 1)[-1].isdigit():
+        return None
+    return token
+
+def _bounded_argument(low: int, high: int) -> Callable[[str], Optional[str]]:
+    """Validator for a decimal integer in [low, high]."""
+    def validate(token: str) -> Optional[str]:
+        if _INTEGER.fullmatch(token) and low <= int(token) <= high:
+            return str(int(token))
+        return None
+    return validate
+
+# Placeholder name -> validator returning the normalized token or None
+ARGUMENT_TYPES = {
+    "host": _host_argument,
+    "count": _bounded_argument(1, 10),
+    "hops": _bounded_argument(1, 30),
+}
+
+class CommandWhitelist:
+    """
+    Whitelist compiled once into hash lookups and argument matchers.
+
+    validate() accepts a command that is an exact whitelist entry or
+    matches an argument grammar, and returns its normalized argv tuple.
+    Commands are split on whitespace only: quotes, pipes, redirections
+    and other shell syntax never survive token validation, so no shell
+    parsing is needed. A normalized command is " ".join(argv).
+    Commands matching a template without options get the base command's
+    defaults (e.g. "ping host" becomes "ping -c 4 host").
+    """
+
+    def __init__(
+        self,
+        exact: Dict[str, List[str]],
+        arguments: Dict[str, List[str]],
+        defaults: Optional[Dict[str, List[str]]] = None
+    ):
+        self.exact: FrozenSet[Tuple[str, ...]] = frozenset(
+            tuple(command.split()) for variants in exact.values() for command in variants
+        )
+        # base command -> templates as tuples of literals and validators
+        self.patterns: Dict[str, List[Tuple[Union[str, Callable], ...]]] = {
+            base: [
+                tuple(
+                    ARGUMENT_TYPES[token[1:-1]] if token.startswith("{") else token
+                    for token in template.split()
+                )
+                for template in templates
+            ]
+            for base, templates in arguments.items()
+        }
+        self.defaults = defaults or {}
+
+    def validate(self, command: str) -> Optional[Tuple[str, ...]]:
+        """Normalized argv for an allowed command, or None."""
+        argv = tuple(command.split())
+        if argv in self.exact:
+            return argv
+        if not argv:
+            return None
+
+        for pattern in self.patterns.get(argv[0], ()):
+            if len(pattern) != len(argv) - 1:
+                continue
+            normalized = [argv[0]]
+            for expected, token in zip(pattern, argv[1:]):
+                if isinstance(expected, str):
+                    value = token if token == expected else None
+                else:
+                    value = expected(token)
+                if value is None:
+                    break
+                normalized.append(value)
+            else:
+                if not any(isinstance(expected, str) for expected in pattern):
+                    normalized[1:1] = self.defaults.get(argv[0], [])
+                return tuple(normalized)
+        return None
+
 # Platform-specific command simulations
 SIMULATED_OUTPUT = {
     "ping -c 4 google.com": """
@@ -61,80 +176,328 @@ Memory:                   16,384 MB RAM
 """,
 }
 
+# Seconds a command result may be reused, keyed by base command.
+# Fast-changing state (processes, sockets) gets short TTLs; 0 disables caching.
+COMMAND_CACHE_TTLS = {
+    "ping": 30,
+    "traceroute": 30,
+    "tracert": 30,
+    "ipconfig": 60,
+    "ifconfig": 60,
+    "netstat": 10,
+    "systeminfo": 300,
+    "hostname": 300,
+    "lpstat": 30,
+    "ps": 5,
+    "top": 5,
+}
+
+class CommandCache:
+    """
+    LRU cache of command results with per-entry TTLs.
+
+    Concurrent requests for a command that is already running share that
+    single execution (single-flight) instead of spawning another process.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_or_run(
+        self,
+        key: str,
+        ttl: float,
+        runner: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        """Return a fresh cached result for key, or run (once) to produce it."""
+        if ttl <= 0 or self.max_entries <= 0:
+            return await runner()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._run(key, ttl, runner))
+            self._inflight[key] = task
+
+        # Shield so one cancelled caller doesn't cancel the shared execution
+        return dict(await asyncio.shield(task))
+
+    async def _run(
+        self,
+        key: str,
+        ttl: float,
+        runner: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        """Execute runner and cache its result unless the command timed out."""
+        try:
+            result = await runner()
+            if result.get("returncode") != -1:
+                self._entries[key] = (time.monotonic() + ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return result
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def clear(self) -> None:
+        """Drop all cached results."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters for tuning TTLs."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+        }
+
+def _parse_cache_ttls(spec: str) -> Dict[str, float]:
+    """Parse DIAGNOSTICS_CACHE_TTLS overrides such as "ping=10,ps=0"."""
+    ttls = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, seconds = item.partition("=")
+        ttls[name.strip()] = float(seconds)
+    return ttls
+
 class DiagnosticsExecutor:
     """Safely executes whitelisted system diagnostic commands."""
     
     def __init__(self):
         self.force_simulation = os.getenv("FORCE_SIMULATION", "").lower() == "true"
         self.is_codespace = os.getenv("CODESPACES", "").lower() == "true"
-    
+
+        # Limit simultaneously running commands and captured output per stream
+        self.max_concurrency = max(1, int(os.getenv("DIAGNOSTICS_MAX_CONCURRENCY", "4")))
+        self.max_output_bytes = int(os.getenv("DIAGNOSTICS_MAX_OUTPUT_BYTES", "65536"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Result cache; DIAGNOSTICS_CACHE_SIZE=0 disables it
+        self.cache_ttls = dict(COMMAND_CACHE_TTLS)
+        self.cache_ttls.update(_parse_cache_ttls(os.getenv("DIAGNOSTICS_CACHE_TTLS", "")))
+        self.cache = CommandCache(int(os.getenv("DIAGNOSTICS_CACHE_SIZE", "256")))
+
+        # Latency/fault injection for simulated commands (SIMULATION_PROFILE)
+        self.simulation: Optional[SimulationProfile] = load_simulation_profile()
+
+        # Compiled from ALLOWED_COMMANDS and COMMAND_ARGUMENTS
+        self.whitelist = CommandWhitelist(ALLOWED_COMMANDS, COMMAND_ARGUMENTS, COMMAND_DEFAULTS)
+
+    def validate(self, command: str) -> Optional[Tuple[str, ...]]:
+        """
+        Normalized argv for a whitelisted command, or None if rejected.
+        SECURITY: Exact entries or argument grammars only.
+        """
+        return self.whitelist.validate(command)
+
     def is_allowed(self, command: str) -> bool:
         """
         Check if a command is in the whitelist.
         SECURITY: Strict matching against pre-approved commands only.
         """
-        cmd_parts = shlex.split(command)
-        base_cmd = cmd_parts[0]
-        
-        if base_cmd not in ALLOWED_COMMANDS:
-            return False
-            
-        # Check if exact command (with args) is allowed
-        return command in ALLOWED_COMMANDS[base_cmd]
+        return self.whitelist.validate(command) is not None
     
-    async def run_command(self, command: str, timeout: int = 10) -> Dict[str, str]:
+    async def run_command(
+        self,
+        command: str,
+        timeout: int = 10,
+        on_output: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, str]:
         """
         Execute a whitelisted command or return simulated output.
+
+        Commands run as asyncio subprocesses so the event loop keeps serving
+        other requests; at most max_concurrency run at once. Results are
+        cached per normalized command for its TTL in COMMAND_CACHE_TTLS,
+        and identical concurrent calls share one execution.
         
         Args:
             command: The command to execute
             timeout: Maximum execution time in seconds
+            on_output: Called with each stdout line as the command produces
+                it. Only the call that actually runs the command streams;
+                cached or shared results arrive complete in the return value.
             
         Returns:
-            Dict with cmd, stdout, stderr, returncode, and runtime_ms
+            Dict with cmd (normalized), stdout, stderr, returncode, and runtime_ms
         """
-        if not self.is_allowed(command):
+        argv = self.whitelist.validate(command)
+        if argv is None:
             raise ValueError(f"Command not allowed: {command}")
-            
+
+        command = " ".join(argv)
+        ttl = self.cache_ttls.get(argv[0], 0)
+        return await self.cache.get_or_run(
+            command, ttl, lambda: self._execute(command, timeout, on_output)
+        )
+
+    async def _execute(
+        self,
+        command: str,
+        timeout: int,
+        on_output: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, str]:
+        """Run (or simulate) an already validated command, bypassing the cache."""
         # Use simulation if forced or in Codespace
         if self.force_simulation or self.is_codespace:
-            return await self.simulate_command(command)
-            
+            COMMAND_EXECUTIONS.inc(mode="simulated")
+            with COMMANDS_RUNNING.track_inprogress():
+                return await self.simulate_command(command, timeout)
+
+        async with self._semaphore:
+            COMMAND_EXECUTIONS.inc(mode="real")
+            with COMMANDS_RUNNING.track_inprogress():
+                return await self._spawn(command, timeout, on_output)
+
+    async def _spawn(
+        self,
+        command: str,
+        timeout: int,
+        on_output: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, str]:
+        """Run a command as a subprocess with the output cap and timeout."""
+        start_time = time.time()
+
+        # SECURITY: exec (no shell); a normalized command is its argv joined
+        # by single spaces with no quoting, so split() recovers it exactly
+        process = await asyncio.create_subprocess_exec(
+            *command.split(),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        # Kept output so far, reported even if the command times out
+        stdout_chunks: List[bytes] = []
+        stderr_chunks: List[bytes] = []
         try:
-            start_time = time.time()
-            
-            # SECURITY: Use shlex.split to properly handle command arguments
-            result = subprocess.run(
-                shlex.split(command),
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                check=False  # Don't raise on non-zero exit
+            stdout, stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(
+                    self._read_capped(process.stdout, on_output, stdout_chunks),
+                    self._read_capped(process.stderr, chunks=stderr_chunks),
+                    process.wait()
+                ),
+                timeout=timeout
             )
-            
-            runtime_ms = int((time.time() - start_time) * 1000)
-            
-            return {
-                "cmd": command,
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-                "returncode": result.returncode,
-                "runtime_ms": runtime_ms
-            }
-            
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
+            if process.returncode is None:
+                process.kill()
+            # The process only counts as exited once its pipes hit EOF, which
+            # needs them read again if a full buffer paused reading
+            await asyncio.gather(
+                self._drain(process.stdout), self._drain(process.stderr), process.wait()
+            )
+            stderr = b"".join(stderr_chunks).decode(errors="replace").rstrip()
+            message = f"Command timed out after {timeout} seconds"
             return {
                 "cmd": command,
-                "stdout": "",
-                "stderr": f"Command timed out after {timeout} seconds",
+                "stdout": b"".join(stdout_chunks).decode(errors="replace"),
+                "stderr": f"{stderr}\n{message}" if stderr else message,
                 "returncode": -1,
                 "runtime_ms": timeout * 1000
             }
+        except BaseException:
+            # Don't leave the child running if the request is cancelled
+            if process.returncode is None:
+                process.kill()
+            raise
+
+        runtime_ms = int((time.time() - start_time) * 1000)
+
+        return {
+            "cmd": command,
+            "stdout": stdout,
+            "stderr": stderr,
+            "returncode": returncode,
+            "runtime_ms": runtime_ms
+        }
+
+    @staticmethod
+    async def _drain(stream: asyncio.StreamReader) -> None:
+        """Discard a process stream until EOF."""
+        while await stream.read(65536):
+            pass
+
+    async def _read_capped(
+        self,
+        stream: asyncio.StreamReader,
+        on_line: Optional[Callable[[str], None]] = None,
+        chunks: Optional[List[bytes]] = None
+    ) -> str:
+        """
+        Read a process stream to EOF, keeping at most max_output_bytes.
+
+        The remainder is still drained so the child never blocks on a
+        full pipe. Kept lines are passed to on_line as they complete, and
+        kept bytes are appended to chunks as they arrive (so a caller can
+        still use them if the read is cancelled).
+        """
+        chunks = [] if chunks is None else chunks
+        size = 0
+        pending = b""
+        while True:
+            chunk = await stream.read(4096)
+            if not chunk:
+                break
+            if size < self.max_output_bytes:
+                kept = chunk[:self.max_output_bytes - size]
+                chunks.append(kept)
+                if on_line is not None:
+                    *lines, pending = (pending + kept).split(b"\n")
+                    for line in lines:
+                        on_line(line.decode(errors="replace"))
+            size += len(chunk)
+
+        if on_line is not None and pending:
+            on_line(pending.decode(errors="replace"))
+
+        text = b"".join(chunks).decode(errors="replace")
+        if size > self.max_output_bytes:
+            text += f"\n[output truncated at {self.max_output_bytes} bytes]"
+        return text
     
-    async def simulate_command(self, command: str) -> Dict[str, str]:
+    async def simulate_command(
+        self,
+        command: str,
+        timeout: Optional[float] = None
+    ) -> Dict[str, str]:
         """
         Return pre-defined simulation output for demo/test commands.
+
+        With a simulation profile the result is delayed by a sampled
+        latency (reported as runtime_ms) and may fail or time out.
         """
+        result = self._simulated_result(command)
+        if self.simulation is None:
+            return result
+        return await self.simulation.apply_command(command, result, timeout)
+
+    def _simulated_result(self, command: str) -> Dict[str, str]:
+        """Canned output for a command."""
         # Return pre-defined output if available
         if command in SIMULATED_OUTPUT:
             return {
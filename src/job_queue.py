@@ -0,0 +1,193 @@
+"""
+Job Queue - SQLite-backed queue of /diagnose jobs for background workers
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+"""
+
+import json
+import time
+import asyncio
+import aiosqlite
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+# Job lifecycle: queued -> running -> done | failed
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+class JobQueue:
+    """
+    Durable job queue shared by the web process and worker processes.
+
+    Workers claim a job by taking a lease on it inside a BEGIN IMMEDIATE
+    transaction, so each job is handed to exactly one worker even across
+    processes. A job whose lease expires (its worker died) is handed out
+    again, up to max_attempts claims, and then marked failed.
+    """
+
+    def __init__(
+        self,
+        db_path: Union[str, Path] = "data/jobs.db",
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        busy_timeout_ms: int = 5000
+    ):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        """Open the queue database, creating the schema if needed."""
+        if self._conn is not None:
+            return
+        async with self._open_lock:
+            if self._conn is not None:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = await aiosqlite.connect(self.db_path)
+            await conn.execute("PRAGMA journal_mode = WAL")
+            await conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                error TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ticket ON jobs (ticket_id, id)")
+            await conn.commit()
+            self._conn = conn
+
+    async def close(self) -> None:
+        """Close the queue database."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def enqueue(self, ticket_id: int, payload: Dict) -> int:
+        """Queue a job for a ticket and return the job ID."""
+        await self.open()
+        now = time.time()
+        async with self._lock:
+            cursor = await self._conn.execute(
+                "INSERT INTO jobs (ticket_id, payload, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (ticket_id, json.dumps(payload), now, now)
+            )
+            await self._conn.commit()
+        return cursor.lastrowid
+
+    async def claim(self, worker: str) -> Optional[Dict]:
+        """
+        Lease the oldest runnable job to worker.
+
+        Returns the job (id, ticket_id, payload, attempts), or None when
+        nothing is queued.
+        """
+        await self.open()
+        now = time.time()
+        async with self._lock:
+            await self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose workers died too often are given up on
+                await self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                    "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                    (f"Lease expired after {self.max_attempts} attempts", now, now, self.max_attempts)
+                )
+                async with self._conn.execute(
+                    "SELECT id, ticket_id, payload, attempts FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    await self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                        "worker = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row[0])
+                    )
+                await self._conn.commit()
+            except BaseException:
+                await self._conn.rollback()
+                raise
+
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "ticket_id": row[1],
+            "payload": json.loads(row[2]),
+            "attempts": row[3] + 1,
+        }
+
+    async def complete(self, job_id: int) -> None:
+        """Mark a claimed job as done."""
+        await self._finish(job_id, "done", None)
+
+    async def fail(self, job_id: int, error: str) -> None:
+        """Mark a claimed job as failed with its error."""
+        await self._finish(job_id, "failed", error)
+
+    async def _finish(self, job_id: int, status: str, error: Optional[str]) -> None:
+        await self.open()
+        async with self._lock:
+            await self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+            await self._conn.commit()
+
+    async def status(self, ticket_id: int) -> Optional[Dict]:
+        """Latest job for a ticket (id, status, attempts, error), or None."""
+        await self.open()
+        async with self._conn.execute(
+            "SELECT id, status, attempts, error FROM jobs WHERE ticket_id = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (ticket_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "status": row[1], "attempts": row[2], "error": row[3]}
+
+    async def wait(
+        self,
+        ticket_id: int,
+        timeout: float,
+        poll_interval: float = 0.2
+    ) -> Optional[Dict]:
+        """
+        Poll until the ticket's job is done or failed, or timeout passes.
+
+        Workers run in other processes, so completion is observed by
+        polling the shared database. Returns the last job status seen.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.status(ticket_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            await asyncio.sleep(min(poll_interval, remaining))
+
+    async def counts(self) -> Dict[str, int]:
+        """Number of jobs in each status."""
+        await self.open()
+        async with self._conn.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ) as cursor:
+            rows = dict(await cursor.fetchall())
+        return {status: rows.get(status, 0) for status in JOB_STATUSES}
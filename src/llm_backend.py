@@ -0,0 +1,130 @@
+"""
+LLM Backend Interface - Common async API over Mock, OpenAI and Bedrock
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+"""
+
+import os
+import asyncio
+import inspect
+from typing import Any, AsyncIterator, Optional, Protocol, runtime_checkable
+
+from .simulation import SimulatedLLMBackend, load_simulation_profile
+
+@runtime_checkable
+class LLMBackend(Protocol):
+    """
+    Interface the diagnose pipeline uses to talk to any LLM.
+
+    Backends may also offer stream(prompt), an async iterator of reply
+    text chunks; the pipeline uses it to act on a reply while it is
+    still being generated.
+    """
+
+    async def query(self, prompt: str) -> str:
+        """Return the model's reply to a prompt."""
+        ...
+
+    async def aclose(self) -> None:
+        """Release long-lived resources (HTTP clients, threads)."""
+        ...
+
+class LLMBackendAdapter:
+    """
+    Gives any backend the async LLMBackend interface.
+
+    Synchronous backends such as MockLLM run in a worker thread so a
+    slow query never blocks the event loop. Other attributes (e.g.
+    MockLLM.templates) are passed through to the wrapped backend.
+    """
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+        self._is_async = inspect.iscoroutinefunction(backend.query)
+
+    async def query(self, prompt: str) -> str:
+        """Await the backend, off the event loop if it is synchronous."""
+        if self._is_async:
+            return await self.backend.query(prompt)
+        return await asyncio.to_thread(self.backend.query, prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream from the backend if it can, else yield the whole reply."""
+        stream = getattr(self.backend, "stream", None)
+        if stream is None:
+            yield await self.query(prompt)
+            return
+        async for chunk in stream(prompt):
+            yield chunk
+
+    async def aclose(self) -> None:
+        """Close the backend if it has anything to close."""
+        close = getattr(self.backend, "aclose", None) or getattr(self.backend, "close", None)
+        if close is None:
+            return
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.backend, name)
+
+def as_llm_backend(backend: Any) -> LLMBackend:
+    """Return backend itself if it already satisfies LLMBackend, else wrap it."""
+    if (
+        isinstance(backend, LLMBackend)
+        and inspect.iscoroutinefunction(backend.query)
+        and inspect.iscoroutinefunction(backend.aclose)
+    ):
+        return backend
+    return LLMBackendAdapter(backend)
+
+def create_llm_backend(name: Optional[str] = None) -> LLMBackend:
+    """
+    Build the LLM backend selected by name or the LLM_BACKEND variable.
+
+    With SIMULATION_PROFILE set, the profile's latency and faults for
+    this backend are injected (see src/simulation.py). With
+    LLM_CACHE=true the backend is wrapped in a CachedLLMBackend
+    (see LLM_CACHE_TTL, LLM_CACHE_SIZE and LLM_CACHE_MAX_DISTANCE).
+
+    Args:
+        name: "mock" (default), "openai" or "bedrock"
+
+    Returns:
+        An async LLMBackend
+
+    Raises:
+        ValueError: If the backend is unknown or not configured
+    """
+    name = (name or os.getenv("LLM_BACKEND", "mock")).lower()
+
+    if name == "mock":
+        from .mock_llm import MockLLM
+        backend = MockLLM()
+    elif name == "openai":
+        from .openai_adapter import OpenAIAdapter
+        backend = OpenAIAdapter()
+    elif name == "bedrock":
+        from .aws_stubs.bedrock_stub import BedrockAdapter
+        backend = BedrockAdapter()
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND: {name}. Use mock, openai or bedrock.")
+
+    backend = as_llm_backend(backend)
+
+    profile = load_simulation_profile()
+    if profile is not None and profile.llm_settings(name):
+        backend = SimulatedLLMBackend(backend, profile, name)
+
+    if os.getenv("LLM_CACHE", "").lower() == "true":
+        from .llm_cache import CachedLLMBackend
+        backend = CachedLLMBackend(
+            backend,
+            db_path=os.getenv("LLM_CACHE_PATH", "data/llm_cache.db"),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("LLM_CACHE_SIZE", "1000")),
+            max_distance=int(os.getenv("LLM_CACHE_MAX_DISTANCE", "0"))
+        )
+
+    return backend
@@ -0,0 +1,266 @@
+"""
+LLM Response Cache - Reuses answers for repeated helpdesk prompts
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+"""
+
+import re
+import time
+import hashlib
+import asyncio
+import logging
+import aiosqlite
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# The reporting user does not change the diagnosis, so it is left out of keys
+_USER_PREFIX = re.compile(r"^User '.*?' reports issue:", re.DOTALL)
+# Second-turn prompts quote command output, where a changed status or
+# return code must change the diagnosis
+_COMMAND_OUTPUT = re.compile(r"^Command '.*' output:$", re.MULTILINE)
+
+def normalize_prompt(prompt: str) -> str:
+    """Casefold, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", prompt.casefold()).split())
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash over word unigrams and bigrams of a normalized text.
+    Near-duplicate texts produce hashes a few bits apart.
+    """
+    words = text.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    weights = [0] * 64
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+class CachedLLMBackend:
+    """
+    LLMBackend wrapper that answers repeated prompts from a cache.
+
+    Prompts are keyed on their normalized text, without the reporting
+    user's name. With max_distance > 0 a miss also accepts a cached
+    prompt whose SimHash is within that many bits (near-duplicate match);
+    prompts quoting command output always need an exact match. SimHashes
+    are only computed in that mode, and are indexed in max_distance + 1 bands: two hashes within
+    max_distance bits agree exactly on at least one band, so a lookup
+    only compares the entries sharing a band with the prompt.
+    Entries expire after ttl seconds, the
+    least recently used are evicted beyond max_entries, and everything
+    is persisted to SQLite so the cache survives restarts.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        db_path: Union[str, Path] = "data/llm_cache.db",
+        ttl: float = 3600,
+        max_entries: int = 1000,
+        max_distance: int = 0
+    ):
+        self.backend = backend
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+
+        # key -> (expires_at, simhash or None, response), oldest use first
+        self._entries: "OrderedDict[str, Tuple[float, Optional[int], str]]" = OrderedDict()
+        # (band number, band value) -> keys of entries with that band
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        bands = max_distance + 1 if max_distance > 0 else 0
+        self._bands = [
+            (64 * i // bands, (1 << (64 * (i + 1) // bands - 64 * i // bands)) - 1)
+            for i in range(bands)
+        ]
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    async def open(self) -> None:
+        """Open the cache database and load unexpired entries."""
+        if self._conn is not None:
+            return
+        async with self._open_lock:
+            if self._conn is not None:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = await aiosqlite.connect(self.db_path)
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                simhash TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+            await conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            await conn.commit()
+            async with conn.execute(
+                "SELECT key, simhash, response, expires_at FROM llm_cache "
+                "ORDER BY last_used DESC LIMIT ?",
+                (self.max_entries,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for key, hash_hex, response, expires_at in reversed(rows):
+                # Entries stored with near-duplicate matching off have no SimHash
+                prompt_hash = int(hash_hex, 16) if hash_hex else None
+                self._entries[key] = (expires_at, prompt_hash, response)
+                self._index(key, prompt_hash)
+            self._conn = conn
+
+    async def aclose(self) -> None:
+        """Close the cache database and the wrapped backend."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        await self.backend.aclose()
+
+    def _band_keys(self, prompt_hash: int) -> List[Tuple[int, int]]:
+        """Bucket keys of a SimHash, one per band."""
+        return [(shift, prompt_hash >> shift & mask) for shift, mask in self._bands]
+
+    def _index(self, key: str, prompt_hash: Optional[int]) -> None:
+        """Add an entry to the band buckets."""
+        if prompt_hash is not None:
+            for band in self._band_keys(prompt_hash):
+                self._buckets.setdefault(band, set()).add(key)
+
+    def _unindex(self, key: str, prompt_hash: Optional[int]) -> None:
+        """Remove an entry from the band buckets."""
+        if prompt_hash is not None:
+            for band in self._band_keys(prompt_hash):
+                bucket = self._buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band]
+
+    def _lookup(self, key: str, prompt_hash: Optional[int]) -> Optional[str]:
+        """Find a fresh exact or near-duplicate entry."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            if entry[1] is None and prompt_hash is not None:
+                # Stored while near-duplicate matching was off
+                self._entries[key] = (entry[0], prompt_hash, entry[2])
+                self._index(key, prompt_hash)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+        if prompt_hash is not None:
+            candidates = set()
+            for band in self._band_keys(prompt_hash):
+                candidates.update(self._buckets.get(band, ()))
+            for other_key in candidates:
+                expires_at, other_hash, response = self._entries[other_key]
+                if expires_at > now and (prompt_hash ^ other_hash).bit_count() <= self.max_distance:
+                    self._entries.move_to_end(other_key)
+                    self.near_hits += 1
+                    return response
+        return None
+
+    def _keys(self, prompt: str) -> Tuple[str, Optional[int]]:
+        """Exact-match key and (for near-duplicate matching) SimHash of a prompt."""
+        normalized = normalize_prompt(_USER_PREFIX.sub("User reports issue:", prompt, count=1))
+        key = hashlib.sha256(normalized.encode()).hexdigest()
+        if not self._bands or _COMMAND_OUTPUT.search(prompt):
+            return key, None
+        return key, simhash(normalized)
+
+    async def query(self, prompt: str) -> str:
+        """Return a cached reply, or query the backend and cache its reply."""
+        await self.open()
+        key, prompt_hash = self._keys(prompt)
+
+        cached = self._lookup(key, prompt_hash)
+        if cached is not None:
+            return cached
+
+        self.misses += 1
+        response = await self.backend.query(prompt)
+        # Adapters report failures as "Error calling ..." text; never cache those
+        if not response.startswith("Error"):
+            await self._store(key, prompt_hash, response)
+        return response
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Yield a cached reply whole, or stream the backend's reply.
+
+        A streamed reply is cached only if it was consumed to the end.
+        """
+        await self.open()
+        key, prompt_hash = self._keys(prompt)
+
+        cached = self._lookup(key, prompt_hash)
+        if cached is not None:
+            yield cached
+            return
+
+        self.misses += 1
+        stream = getattr(self.backend, "stream", None)
+        if stream is None:
+            response = await self.backend.query(prompt)
+            yield response
+        else:
+            parts = []
+            async for chunk in stream(prompt):
+                parts.append(chunk)
+                yield chunk
+            response = "".join(parts)
+        if not response.startswith("Error"):
+            await self._store(key, prompt_hash, response)
+
+    async def _store(self, key: str, prompt_hash: Optional[int], response: str) -> None:
+        """Insert an entry in memory and on disk, evicting the LRU overflow."""
+        now = time.time()
+        old = self._entries.get(key)
+        if old is not None:
+            self._unindex(key, old[1])
+        self._entries[key] = (now + self.ttl, prompt_hash, response)
+        self._entries.move_to_end(key)
+        self._index(key, prompt_hash)
+
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            evicted_key, (_, evicted_hash, _) = self._entries.popitem(last=False)
+            self._unindex(evicted_key, evicted_hash)
+            evicted.append(evicted_key)
+
+        hash_hex = format(prompt_hash, "x") if prompt_hash is not None else ""
+        try:
+            await self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, hash_hex, response, now + self.ttl, now)
+            )
+            if evicted:
+                await self._conn.executemany(
+                    "DELETE FROM llm_cache WHERE key = ?", [(k,) for k in evicted]
+                )
+            await self._conn.commit()
+        except Exception as e:
+            logger.warning("LLM cache write error: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters."""
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.backend, name)
@@ -5,21 +5,48 @@ MIT License - See LICENSE file
 """
 
 import os
-from typing import Optional
-from fastapi import FastAPI, HTTPException
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
-from .mock_llm import MockLLM
+from .llm_backend import create_llm_backend
 from .diagnostics import DiagnosticsExecutor
 from .db import TicketStore
+from .job_queue import JobQueue
+from .output_parsers import combine_summaries, format_summary, summarize_output
+from .metrics import (
+    CLASSIFIER_DECISIONS, EARLY_COMMAND_STARTS, LLM_EARLY_STOPS, PIPELINES_COALESCED, REGISTRY,
+    REQUESTS_IN_FLIGHT, SPECULATIONS, STAGE_SECONDS, CallbackMetric
+)
+from .llm_cache import normalize_prompt
+from .speculation import TriggerClassifier
+from .classifier import Prediction, load_classifier
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open long-lived resources at startup and release them at shutdown."""
+    await db.open()
+    if DIAGNOSE_QUEUE:
+        await job_queue.open()
+    yield
+    await llm.aclose()
+    await job_queue.close()
+    await db.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="IT Helpdesk Auto-Responder",
     description="Automated IT issue diagnostics and resolution",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS for frontend
@@ -35,10 +62,46 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="src/frontend"), name="static")
 
 # Initialize components
-llm = MockLLM()  # Can be swapped for OpenAI or Bedrock
+llm = create_llm_backend()  # Select with LLM_BACKEND=mock|openai|bedrock
 diagnostics = DiagnosticsExecutor()
 db = TicketStore()
 
+# Optional job queue: with DIAGNOSE_QUEUE=true, /diagnose only enqueues and
+# worker processes (python -m src.worker) run the pipeline
+DIAGNOSE_QUEUE = os.getenv("DIAGNOSE_QUEUE", "").lower() == "true"
+job_queue = JobQueue(
+    os.getenv("JOB_QUEUE_PATH", str(db.data_dir / "jobs.db")),
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "300")),
+    max_attempts=max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3")))
+)
+
+# Cache counters are read from their owners at scrape time
+_COMMAND_CACHE_COUNTERS = ("hits", "misses", "coalesced", "evictions")
+REGISTRY.register(CallbackMetric(
+    "helpdesk_command_cache_total",
+    "Diagnostic command cache lookups and evictions, by result.",
+    "counter",
+    ["result"],
+    lambda: {(name,): diagnostics.cache.stats()[name] for name in _COMMAND_CACHE_COUNTERS}
+))
+REGISTRY.register(CallbackMetric(
+    "helpdesk_command_cache_entries",
+    "Diagnostic command results currently cached.",
+    "gauge",
+    [],
+    lambda: {(): diagnostics.cache.stats()["entries"]}
+))
+if callable(getattr(llm, "stats", None)):
+    REGISTRY.register(CallbackMetric(
+        "helpdesk_llm_cache_total",
+        "LLM response cache lookups, by result.",
+        "counter",
+        ["result"],
+        lambda: {
+            (name,): value for name, value in llm.stats().items() if name != "entries"
+        }
+    ))
+
 class DiagnosisRequest(BaseModel):
     username: str
     issue: str
@@ -49,81 +112,667 @@ class DiagnosisResponse(BaseModel):
     executed_command: Optional[str]
     command_output: Optional[str]
     suggested_fix: str
+    output_summary: Optional[Dict[str, Any]] = None
 
-@app.post("/diagnose", response_model=DiagnosisResponse)
-async def diagnose_issue(request: DiagnosisRequest):
+class DiagnosisQueuedResponse(BaseModel):
+    ticket_id: int
+    job_id: int
+    status: str
+
+class DiagnosisBatchRequest(BaseModel):
+    requests: List[DiagnosisRequest]
+
+class DiagnosisBatchItem(BaseModel):
+    result: Optional[DiagnosisResponse] = None
+    error: Optional[str] = None
+
+class DiagnosisBatchResponse(BaseModel):
+    results: List[DiagnosisBatchItem]
+
+class TicketListResponse(BaseModel):
+    tickets: List[Dict[str, Any]]
+    next_cursor: Optional[int] = None
+
+# Pipelines run concurrently per /diagnose/batch call
+BATCH_CONCURRENCY = max(1, int(os.getenv("DIAGNOSE_BATCH_CONCURRENCY", "8")))
+
+# Diagnostic plan: commands taken from the first LLM turn, run concurrently
+# and given one shared deadline (seconds) to finish
+MAX_PLAN_COMMANDS = max(1, int(os.getenv("DIAGNOSE_MAX_COMMANDS", "3")))
+PLAN_DEADLINE = float(os.getenv("DIAGNOSE_COMMAND_DEADLINE", "10"))
+
+# Optional speculation: a local classifier predicts the likely command,
+# which starts alongside the first LLM turn and is kept if the LLM agrees
+speculator = TriggerClassifier() if os.getenv("DIAGNOSE_SPECULATE", "").lower() == "true" else None
+
+# Optional trained classifier (python -m src.classifier train): confident
+# predictions replace the first LLM turn
+classifier = load_classifier()
+CLASSIFIER_THRESHOLD = float(os.getenv("DIAGNOSE_CLASSIFIER_THRESHOLD", "0.9"))
+
+# Optional coalescing: /diagnose requests with the same normalized issue
+# text share one in-flight pipeline (and its failure); each still gets
+# its own ticket
+COALESCE_PIPELINES = os.getenv("DIAGNOSE_COALESCE", "").lower() == "true"
+_pipelines: Dict[str, asyncio.Task] = {}
+
+async def diagnose_events(
+    request: DiagnosisRequest,
+    stream_output: bool = False,
+    ticket_id: Optional[int] = None,
+    command_runner: Optional[Callable[[str], Awaitable[Dict]]] = None,
+    prediction: Optional[Prediction] = None
+) -> AsyncIterator[Dict]:
     """
-    Process an IT help request:
-    1. Store initial ticket
-    2. Get LLM analysis and command suggestion
-    3. Execute safe diagnostic command
-    4. Get final LLM diagnosis
-    5. Store and return results
+    Run the diagnose pipeline, yielding an event as each stage completes.
+
+    A batch passes ticket_id when the ticket was already created, a
+    command_runner that shares identical commands across the batch, and
+    the classifier's prediction when the batch was scored up front.
+
+    When the classifier predicts the issue with at least
+    CLASSIFIER_THRESHOLD confidence, its category and command plan
+    replace the first LLM turn.
+
+    The first LLM turn is streamed when the backend supports it: each
+    safe command starts as soon as its COMMAND: line is complete, and
+    generation stops once the plan is full and the category is known.
+    With a speculator, its predicted command starts before the first
+    turn; it joins the plan if the LLM suggests it and is discarded
+    otherwise. Its output lines are held back until it joins the plan,
+    so a discarded command never reaches the client.
+
+    Events, in order:
+    - {"event": "ticket", "ticket_id"}
+    - {"event": "analysis", "category", "command", "commands"}
+    - {"event": "output", "command", "line"} per command output line (stream_output only)
+    - {"event": "diagnosis", ...DiagnosisResponse fields}
     """
+    # Create ticket
+    if ticket_id is None:
+        with STAGE_SECONDS.time(stage="ticket_create"):
+            ticket_id = await db.create_ticket(request.username, request.issue)
+    yield {"event": "ticket", "ticket_id": ticket_id}
+
+    # Get initial LLM analysis, extracting category and the command plan
+    # line by line and starting each safe command as soon as it appears
+    category = None
+    commands: List[str] = []
+    started: Dict[str, asyncio.Future] = {}
+    lines: asyncio.Queue = asyncio.Queue()
+    command_output = None
+    summary = None
+
+    if prediction is None and classifier is not None:
+        prediction = classifier.predict(request.issue)
+    skip_llm = prediction is not None and prediction.confidence >= CLASSIFIER_THRESHOLD
+    if prediction is not None:
+        CLASSIFIER_DECISIONS.inc(result="skipped_llm" if skip_llm else "below_threshold")
+
+    # Start the locally predicted command alongside the first LLM turn
+    speculative: Optional[asyncio.Future] = None
+    predicted_argv = None
+    held_lines: List[str] = []
+    adopted_as: Optional[str] = None
+
+    def hold_line(line: str) -> None:
+        # Speculative output waits until the plan adopts the command
+        if adopted_as is None:
+            held_lines.append(line)
+        else:
+            lines.put_nowait((adopted_as, line))
+
+    def adopt(command: str) -> None:
+        nonlocal adopted_as
+        adopted_as = command
+        for line in held_lines:
+            lines.put_nowait((command, line))
+        held_lines.clear()
+
+    if speculator is not None and not skip_llm:
+        speculation = speculator.predict(request.issue)
+        predicted_argv = diagnostics.validate(speculation[1]) if speculation else None
+        if predicted_argv is None:
+            SPECULATIONS.inc(result="skipped")
+        else:
+            speculative = _start_command(
+                " ".join(predicted_argv), command_runner=command_runner,
+                on_output=hold_line if stream_output else None
+            )
+
+    def take(line: str) -> None:
+        nonlocal category
+        if line.startswith("Category:") and category is None:
+            category = line.replace("Category:", "").strip()
+        elif line.startswith("COMMAND:"):
+            command = line.replace("COMMAND:", "").strip()
+            if command and command not in commands and len(commands) < MAX_PLAN_COMMANDS:
+                commands.append(command)
+                argv = diagnostics.validate(command)
+                if argv is None:
+                    return
+                if argv == predicted_argv and speculative not in started.values():
+                    started[command] = speculative
+                    adopt(command)
+                else:
+                    started[command] = _start_command(
+                        command, lines if stream_output else None, command_runner
+                    )
+
     try:
-        # Create ticket
-        ticket_id = await db.create_ticket(request.username, request.issue)
+        with STAGE_SECONDS.time(stage="classify" if skip_llm else "llm_turn1"):
+            if skip_llm:
+                chunks = _predicted_analysis(prediction)
+            else:
+                chunks = _llm_stream(
+                    f"User '{request.username}' reports issue: {request.issue}\n"
+                    f"Analyze the issue and suggest up to {MAX_PLAN_COMMANDS} safe diagnostic "
+                    "commands, one per COMMAND: line.\n"
+                    "Format: Category: <category>\nCOMMAND: <command>\nLikely cause: <cause>"
+                )
+            parts = []
+            pending = ""
+            early_starts = 0
+            try:
+                async for chunk in chunks:
+                    # Commands started from earlier chunks overlapped generation
+                    early_starts = len(started)
+                    parts.append(chunk)
+                    *complete, pending = (pending + chunk).split("\n")
+                    for line in complete:
+                        take(line)
+                    if len(commands) >= MAX_PLAN_COMMANDS and category is not None:
+                        # Nothing else in the reply is needed: stop generating
+                        LLM_EARLY_STOPS.inc()
+                        early_starts = len(started)
+                        pending = ""
+                        break
+            finally:
+                await chunks.aclose()
+            take(pending)
+            initial_response = "".join(parts)
+        EARLY_COMMAND_STARTS.inc(early_starts)
+        if speculative is not None:
+            if speculative in started.values():
+                SPECULATIONS.inc(result="hit")
+            else:
+                speculative.cancel()
+                SPECULATIONS.inc(result="miss")
 
-        # Get initial LLM analysis
-        initial_response = llm.query(
-            f"User '{request.username}' reports issue: {request.issue}\n"
-            "Analyze the issue and suggest ONE safe diagnostic command.\n"
-            "Format: Category: <category>\nCOMMAND: <command>\nLikely cause: <cause>"
-        )
+        command = "; ".join(commands) or None
+        yield {
+            "event": "analysis",
+            "category": category,
+            "command": commands[0] if commands else None,
+            "commands": commands
+        }
 
-        # Extract command if present
-        command = None
-        command_output = None
-        for line in initial_response.split("\n"):
-            if line.startswith("COMMAND:"):
-                command = line.replace("COMMAND:", "").strip()
-                break
+        # Wait for the safe commands of the plan, which run concurrently
+        plan = [c for c in commands if c in started]
+        summaries = []
+        if plan:
+            command_started = time.perf_counter()
+            streamed = set()
+            async for kind, value in _run_plan(
+                plan, stream_output, command_runner, started=started, lines=lines
+            ):
+                if kind == "line":
+                    streamed.add(value[0])
+                    yield {"event": "output", "command": value[0], "line": value[1]}
+                else:
+                    results = value
+    finally:
+        # The pipeline failed or was abandoned before the plan finished
+        for task in [*started.values(), speculative]:
+            if task is not None:
+                task.cancel()
 
-        # Execute command if safe
-        if command and diagnostics.is_allowed(command):
-            result = await diagnostics.run_command(command)
-            command_output = result["stdout"] + "\n" + result["stderr"]
-
-        # Get final diagnosis with command output context
-        context = f"Initial analysis: {initial_response}\n"
-        if command_output:
-            context += f"Command '{command}' output:\n{command_output}\n"
-        
-        final_response = llm.query(
+    if plan:
+        if stream_output:
+            # Cached or simulated results arrive complete
+            for planned, result in zip(plan, results):
+                if planned not in streamed:
+                    for line in result["stdout"].splitlines():
+                        yield {"event": "output", "command": planned, "line": line}
+        STAGE_SECONDS.observe(time.perf_counter() - command_started, stage="command_run")
+
+        outputs = [result["stdout"] + "\n" + result["stderr"] for result in results]
+        if len(plan) == 1:
+            command_output = outputs[0]
+        else:
+            command_output = "\n".join(f"$ {c}\n{output}" for c, output in zip(plan, outputs))
+        summaries = [summarize_output(c, result) for c, result in zip(plan, results)]
+        summary = combine_summaries(summaries)
+
+    # Get final diagnosis with the compact output summaries as context
+    context = f"Initial analysis: {initial_response}\n"
+    for planned, planned_summary in zip(plan, summaries):
+        context += f"Command '{planned}' output:\n{format_summary(planned_summary)}\n"
+    
+    with STAGE_SECONDS.time(stage="llm_turn2"):
+        final_response = await llm.query(
             f"{context}\n"
             "Based on this information, provide a final diagnosis and fix:\n"
             "Format: Diagnosis: <diagnosis>\nFix: <specific steps>"
         )
 
-        # Extract diagnosis and fix
-        diagnosis = "Unknown issue"
-        suggested_fix = "Please contact IT support"
-        for line in final_response.split("\n"):
-            if line.startswith("Diagnosis:"):
-                diagnosis = line.replace("Diagnosis:", "").strip()
-            elif line.startswith("Fix:"):
-                suggested_fix = line.replace("Fix:", "").strip()
+    # Extract diagnosis and fix
+    diagnosis = "Unknown issue"
+    suggested_fix = "Please contact IT support"
+    for line in final_response.split("\n"):
+        if line.startswith("Diagnosis:"):
+            diagnosis = line.replace("Diagnosis:", "").strip()
+        elif line.startswith("Fix:"):
+            suggested_fix = line.replace("Fix:", "").strip()
 
-        # Store results
+    # Store results
+    with STAGE_SECONDS.time(stage="ticket_update"):
         await db.update_ticket(
             ticket_id,
             diagnosis=diagnosis,
             command=command,
             output=command_output,
-            fix=suggested_fix
+            fix=suggested_fix,
+            category=category,
+            output_summary=json.dumps(summary) if summary else None
         )
 
-        return DiagnosisResponse(
-            ticket_id=ticket_id,
-            diagnosis=diagnosis,
-            executed_command=command,
-            command_output=command_output,
-            suggested_fix=suggested_fix
+    yield {
+        "event": "diagnosis",
+        "ticket_id": ticket_id,
+        "diagnosis": diagnosis,
+        "executed_command": command,
+        "command_output": command_output,
+        "suggested_fix": suggested_fix,
+        "output_summary": summary
+    }
+
+async def _llm_stream(prompt: str) -> AsyncIterator[str]:
+    """Reply chunks from the backend's stream(), or the whole query() reply."""
+    stream = getattr(llm, "stream", None)
+    if stream is None:
+        yield await llm.query(prompt)
+        return
+    chunks = stream(prompt)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # Closing early cancels generation in the backend
+        await chunks.aclose()
+
+async def _predicted_analysis(prediction: Prediction) -> AsyncIterator[str]:
+    """First-turn style analysis built from a classifier prediction."""
+    lines = [f"Category: {prediction.category}"]
+    lines += [f"COMMAND: {command}" for command in prediction.command.split("; ")]
+    lines.append(
+        f"Likely cause: matches earlier tickets of this kind "
+        f"(classifier confidence {prediction.confidence:.2f})"
+    )
+    yield "\n".join(lines)
+
+def _start_command(
+    command: str,
+    lines: Optional[asyncio.Queue] = None,
+    command_runner: Optional[Callable[[str], Awaitable[Dict]]] = None,
+    on_output: Optional[Callable[[str], None]] = None
+) -> asyncio.Future:
+    """
+    Start one plan command; its output lines go to lines (as (command,
+    line) pairs) if given, or to on_output.
+    """
+    if command_runner is not None:
+        return asyncio.ensure_future(command_runner(command))
+    if lines is not None:
+        on_output = lambda line: lines.put_nowait((command, line))
+    return asyncio.ensure_future(diagnostics.run_command(
+        command, timeout=PLAN_DEADLINE, on_output=on_output
+    ))
+
+def _failed_result(command: str, reason: str, returncode: int) -> Dict:
+    """Result for a plan command that raised or missed the deadline."""
+    return {"cmd": command, "stdout": "", "stderr": reason, "returncode": returncode,
+            "runtime_ms": int(PLAN_DEADLINE * 1000)}
+
+async def _run_plan(
+    commands: List[str],
+    stream_output: bool = False,
+    command_runner: Optional[Callable[[str], Awaitable[Dict]]] = None,
+    started: Optional[Dict[str, asyncio.Future]] = None,
+    lines: Optional[asyncio.Queue] = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Run a plan's commands concurrently under one shared deadline.
+
+    Commands in started are already running (started with lines as
+    their output queue); the rest are started here. Yields ("line",
+    (command, text)) as output arrives (stream_output only), then
+    ("results", [result per command]). Commands still running at
+    PLAN_DEADLINE, or that raised, get a failed result instead, so the
+    others' results are still used.
+    """
+    lines = lines if lines is not None else asyncio.Queue()
+    started = started or {}
+    tasks = [
+        started.get(command)
+        or _start_command(command, lines if stream_output else None, command_runner)
+        for command in commands
+    ]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PLAN_DEADLINE
+    try:
+        pending = set(tasks)
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            getter = asyncio.ensure_future(lines.get())
+            done, _ = await asyncio.wait(
+                pending | {getter}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter in done:
+                yield "line", getter.result()
+            else:
+                getter.cancel()
+            pending -= done
+        while not lines.empty():
+            yield "line", lines.get_nowait()
+
+        results = []
+        for command, task in zip(commands, tasks):
+            if not task.done():
+                results.append(_failed_result(
+                    command, f"Command did not finish within the {PLAN_DEADLINE:g}s deadline", -1
+                ))
+            elif task.exception() is not None:
+                results.append(_failed_result(command, f"Command failed: {task.exception()}", 1))
+            else:
+                results.append(task.result())
+        yield "results", results
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _stream_command(command: str) -> AsyncIterator[Tuple[str, Any]]:
+    """Run a command, yielding ("line", text) as output arrives, then ("result", dict)."""
+    async for kind, value in _run_plan([command], stream_output=True):
+        if kind == "line":
+            yield "line", value[1]
+        else:
+            yield "result", value[0]
+
+async def _diagnose(request: DiagnosisRequest) -> Tuple[Dict, Optional[str]]:
+    """Run the whole pipeline; return the diagnosis fields and the category."""
+    category = None
+    async for event in diagnose_events(request):
+        if event["event"] == "analysis":
+            category = event["category"]
+    event.pop("event")
+    return event, category
+
+async def _coalesced_diagnose(request: DiagnosisRequest) -> Dict:
+    """
+    Run the pipeline, or join an identical one already in flight.
+
+    The first request for an issue text (the leader) runs the pipeline
+    in its own task, so a disconnecting leader does not cancel it for
+    the others. Followers create their own ticket, wait for the leader's
+    result and store a copy of it on that ticket.
+    """
+    key = normalize_prompt(request.issue)
+    if not key:
+        result, _ = await _diagnose(request)
+        return result
+    task = _pipelines.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_diagnose(request))
+        _pipelines[key] = task
+
+        def release(done: asyncio.Task) -> None:
+            if _pipelines.get(key) is done:
+                del _pipelines[key]
+            if not done.cancelled():
+                done.exception()  # Retrieved here if the leader went away
+
+        task.add_done_callback(release)
+        result, _ = await asyncio.shield(task)
+        return dict(result)
+
+    PIPELINES_COALESCED.inc()
+    with STAGE_SECONDS.time(stage="ticket_create"):
+        ticket_id = await db.create_ticket(request.username, request.issue)
+    result, category = await asyncio.shield(task)
+    with STAGE_SECONDS.time(stage="ticket_update"):
+        await db.update_ticket(
+            ticket_id,
+            diagnosis=result["diagnosis"],
+            command=result["executed_command"],
+            output=result["command_output"],
+            fix=result["suggested_fix"],
+            category=category,
+            output_summary=json.dumps(result["output_summary"]) if result["output_summary"] else None
+        )
+    return {**result, "ticket_id": ticket_id}
+
+@app.post(
+    "/diagnose",
+    response_model=DiagnosisResponse,
+    responses={202: {"model": DiagnosisQueuedResponse, "description": "Queued (DIAGNOSE_QUEUE)"}}
+)
+async def diagnose_issue(request: DiagnosisRequest):
+    """
+    Process an IT help request:
+    1. Store initial ticket
+    2. Get LLM analysis and command suggestion
+    3. Execute safe diagnostic command
+    4. Get final LLM diagnosis
+    5. Store and return results
+
+    With DIAGNOSE_QUEUE enabled only step 1 runs here: the request is
+    queued for a worker and 202 {"ticket_id", "job_id", "status"} is
+    returned at once. Poll GET /tickets/{ticket_id}?wait=<seconds> for
+    the result. /diagnose/stream and /diagnose/batch are not queued.
+
+    With DIAGNOSE_COALESCE=true, concurrent requests with the same
+    normalized issue text share one pipeline run; each gets its own ticket.
+    """
+    if DIAGNOSE_QUEUE:
+        try:
+            ticket_id = await db.create_ticket(request.username, request.issue)
+            # Workers read the ticket from their own connections
+            await db.flush()
+            job_id = await job_queue.enqueue(
+                ticket_id, {"username": request.username, "issue": request.issue}
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return JSONResponse(
+            status_code=202,
+            content={"ticket_id": ticket_id, "job_id": job_id, "status": "queued"}
         )
 
+    try:
+        with REQUESTS_IN_FLIGHT.track_inprogress(endpoint="diagnose"):
+            if COALESCE_PIPELINES:
+                result = await _coalesced_diagnose(request)
+            else:
+                result, _ = await _diagnose(request)
+        return DiagnosisResponse(**result)
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/diagnose/stream")
+async def diagnose_issue_stream(request: DiagnosisRequest):
+    """
+    Streaming variant of /diagnose returning newline-delimited JSON.
+    Each pipeline stage is sent as soon as it completes (see
+    diagnose_events); a failure ends the stream with an "error" event.
+    """
+    async def ndjson() -> AsyncIterator[str]:
+        try:
+            with REQUESTS_IN_FLIGHT.track_inprogress(endpoint="diagnose_stream"):
+                async for event in diagnose_events(request, stream_output=True):
+                    yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+async def _diagnose_batch(requests: List[DiagnosisRequest]) -> List[asyncio.Task]:
+    """
+    Start the pipeline for every request of a batch.
+
+    Tickets are inserted in one transaction, at most BATCH_CONCURRENCY
+    pipelines run at once, each distinct command runs once for the whole
+    batch, and the classifier (if any) scores all issues in one call.
+    Returns one task per request, in input order, each
+    resolving to {"result": ..., "error": ...}.
+    """
+    ticket_ids = await db.create_tickets([(r.username, r.issue) for r in requests])
+    predictions = (
+        classifier.predict_batch(r.issue for r in requests) if classifier is not None
+        else [None] * len(requests)
+    )
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    command_tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_shared(command: str) -> Dict:
+        task = command_tasks.get(command)
+        if task is None:
+            task = command_tasks[command] = asyncio.ensure_future(
+                diagnostics.run_command(command)
+            )
+        return dict(await asyncio.shield(task))
+
+    async def run_one(
+        request: DiagnosisRequest,
+        ticket_id: int,
+        prediction: Optional[Prediction]
+    ) -> Dict:
+        async with semaphore:
+            try:
+                with REQUESTS_IN_FLIGHT.track_inprogress(endpoint="diagnose_batch"):
+                    async for event in diagnose_events(
+                        request, ticket_id=ticket_id, command_runner=run_shared,
+                        prediction=prediction
+                    ):
+                        pass
+                event.pop("event")
+                return {"result": event, "error": None}
+            except Exception as e:
+                return {"result": None, "error": str(e)}
+
+    return [
+        asyncio.ensure_future(run_one(request, ticket_id, prediction))
+        for request, ticket_id, prediction in zip(requests, ticket_ids, predictions)
+    ]
+
+@app.post("/diagnose/batch", response_model=DiagnosisBatchResponse)
+async def diagnose_batch(batch: DiagnosisBatchRequest, stream: bool = False):
+    """
+    Diagnose many issues at once (e.g. an email importer replay).
+
+    Results are returned in input order; each item holds either a result
+    or the error for that request. With ?stream=true they are sent as
+    newline-delimited JSON, in input order, as soon as each is ready.
+    """
+    try:
+        tasks = await _diagnose_batch(batch.requests)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not stream:
+        items = await asyncio.gather(*tasks)
+        return DiagnosisBatchResponse(results=[DiagnosisBatchItem(**item) for item in items])
+
+    async def ndjson() -> AsyncIterator[str]:
+        try:
+            for index, task in enumerate(tasks):
+                yield json.dumps({"index": index, **await task}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/tickets", response_model=TicketListResponse)
+async def list_tickets(
+    username: Optional[str] = None,
+    category: Optional[str] = None,
+    diagnosis: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    q: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: Optional[str] = None
+):
+    """
+    List tickets newest first for dashboards.
+
+    Filters combine with AND; q searches issue, diagnosis and fix text.
+    Pass next_cursor back as cursor for the next page. fields is a
+    comma-separated projection; output is only returned when asked for.
+    """
+    columns = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+    try:
+        tickets, next_cursor = await db.list_tickets(
+            username=username,
+            category=category,
+            diagnosis=diagnosis,
+            created_after=created_after,
+            created_before=created_before,
+            text=q,
+            before_id=cursor,
+            limit=limit,
+            columns=columns
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return TicketListResponse(tickets=tickets, next_cursor=next_cursor)
+
+@app.get("/tickets/{ticket_id}")
+async def get_ticket(
+    ticket_id: int,
+    include_output: bool = True,
+    wait: float = Query(0, ge=0, le=60)
+):
+    """
+    Ticket detail view. The command output is decompressed from its
+    blob only here; pass include_output=false to skip it.
+
+    With DIAGNOSE_QUEUE enabled the ticket carries its "job" status, and
+    wait=<seconds> long-polls until the job is done or failed.
+    """
+    job = None
+    if DIAGNOSE_QUEUE:
+        job = await (job_queue.wait(ticket_id, wait) if wait else job_queue.status(ticket_id))
+
+    ticket = await db.get_ticket(ticket_id, include_output=include_output)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail=f"Ticket {ticket_id} not found")
+    if job is not None:
+        ticket["job"] = job
+    return ticket
+
+@app.get("/diagnostics/cache")
+async def diagnostics_cache_stats():
+    """Report command result cache counters for TTL tuning."""
+    return diagnostics.cache.stats()
+
+@app.get("/jobs")
+async def job_counts():
+    """Queued, running, done and failed job counts (DIAGNOSE_QUEUE only)."""
+    if not DIAGNOSE_QUEUE:
+        raise HTTPException(status_code=404, detail="Job queue is not enabled")
+    return await job_queue.counts()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose stage latencies, counters and gauges in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     """Serve the frontend HTML"""
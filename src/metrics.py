@@ -0,0 +1,250 @@
+"""
+Metrics - Lightweight Prometheus-style counters, gauges and histograms
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+"""
+
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from cached lookups up to slow traceroutes/LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render {name="value",...}, or nothing when there are no labels."""
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    """Render integers without a trailing .0."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric(ABC):
+    """Base class: a named metric family with fixed label names."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines of the metric family in exposition format."""
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self.samples()
+        ]
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. requests in flight."""
+
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        """Increment for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class CallbackMetric(_Metric):
+    """Metric whose samples are read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        type_name: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[Tuple[str, ...], float]]
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.callback().items())
+        ]
+
+class Registry:
+    """Collection of metrics rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, replacing any earlier one with the same name."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "helpdesk_stage_duration_seconds",
+    "Time spent in each diagnose pipeline stage.",
+    ["stage"]
+))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "helpdesk_requests_in_flight",
+    "Diagnose pipelines currently running.",
+    ["endpoint"]
+))
+COMMANDS_RUNNING = REGISTRY.register(Gauge(
+    "helpdesk_commands_running",
+    "Diagnostic commands currently executing (real or simulated)."
+))
+COMMAND_EXECUTIONS = REGISTRY.register(Counter(
+    "helpdesk_command_executions_total",
+    "Diagnostic command executions that bypassed the cache, by mode.",
+    ["mode"]
+))
+EARLY_COMMAND_STARTS = REGISTRY.register(Counter(
+    "helpdesk_early_command_starts_total",
+    "Diagnostic commands started while the first LLM turn was still generating."
+))
+LLM_EARLY_STOPS = REGISTRY.register(Counter(
+    "helpdesk_llm_early_stops_total",
+    "First LLM turns cut short because the diagnostic plan was complete."
+))
+SPECULATIONS = REGISTRY.register(Counter(
+    "helpdesk_speculations_total",
+    "Commands predicted before the first LLM turn: hit (LLM planned it), "
+    "miss (discarded) or skipped (no safe prediction).",
+    ["result"]
+))
+REGISTRY.register(CallbackMetric(
+    "helpdesk_speculation_hit_ratio",
+    "Share of speculatively started commands the LLM also planned.",
+    "gauge",
+    [],
+    lambda: {(): SPECULATIONS.value(result="hit") / max(
+        1, SPECULATIONS.value(result="hit") + SPECULATIONS.value(result="miss")
+    )}
+))
+CLASSIFIER_DECISIONS = REGISTRY.register(Counter(
+    "helpdesk_classifier_decisions_total",
+    "Issues scored by the ticket classifier: skipped_llm (confident, first "
+    "LLM turn skipped) or below_threshold.",
+    ["result"]
+))
+PIPELINES_COALESCED = REGISTRY.register(Counter(
+    "helpdesk_pipelines_coalesced_total",
+    "/diagnose requests answered by an identical in-flight pipeline."
+))
+JSON_FALLBACK = REGISTRY.register(Counter(
+    "helpdesk_json_fallback_total",
+    "Ticket operations served by the JSON fallback store.",
+    ["operation"]
+))
+SQLITE_ERRORS = REGISTRY.register(Counter(
+    "helpdesk_sqlite_errors_total",
+    "SQLite errors that switched the ticket store to the JSON fallback."
+))
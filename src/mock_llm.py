@@ -4,20 +4,94 @@ Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
 MIT License - See LICENSE file
 """
 
+import os
 import re
-from typing import Dict, Optional
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+# Words in command output that mark a diagnostic as failed
+ERROR_KEYWORDS = ["error", "failure", "timeout", "not found", "offline"]
+
+def _trie_pattern(node: Dict) -> str:
+    """Render a character trie as a regex that prefers the longest word."""
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        # A word ends here; a longer continuation is optional (greedy)
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+class KeywordMatcher:
+    """
+    Finds the highest-priority group whose keywords occur in a text.
+
+    All keywords are compiled once into a single trie-shaped regex, so a
+    scan is one pass over the text whose per-position cost grows with
+    keyword length rather than the number of keywords. Groups are
+    prioritized in the order given, like the original nested loop.
+    """
+
+    def __init__(self, groups: Iterable[Tuple[str, Iterable[str]]]):
+        owners: Dict[str, Tuple[int, str]] = {}
+        for priority, (group, keywords) in enumerate(groups):
+            for keyword in keywords:
+                owners.setdefault(keyword.lower(), (priority, group))
+
+        # A match is the longest keyword at a position; keywords that are
+        # prefixes of it matched too, so resolve each to its best owner
+        self._best: Dict[str, Tuple[int, str, str]] = {}
+        for keyword in owners:
+            candidates = [
+                (*owners[keyword[:i]], keyword[:i])
+                for i in range(1, len(keyword) + 1)
+                if keyword[:i] in owners
+            ]
+            self._best[keyword] = min(candidates)
+
+        trie: Dict = {}
+        for keyword in owners:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        # Lookahead so matches starting inside an earlier match are seen
+        self._regex = re.compile("(?=(" + _trie_pattern(trie) + "))") if owners else None
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """Return (group, keyword) for the best group found in text, if any."""
+        if self._regex is None:
+            return None
+
+        best = None
+        for found in self._regex.finditer(text.lower()):
+            candidate = self._best[found.group(1)]
+            if best is None or candidate < best:
+                best = candidate
+                if best[0] == 0:
+                    break
+        return (best[1], best[2]) if best else None
 
 class MockLLM:
     """
     Mock LLM that returns pre-defined responses for common IT issues.
     Includes category, diagnostic command, and suggested fix.
+
+    Set MOCK_LLM_RULES to a JSON file with the same structure as
+    self.templates to replace the built-in categories.
     """
     
-    def __init__(self):
+    def __init__(self, rules_path: Optional[str] = None):
         self.templates = {
             # Network connectivity issues
             "network": {
-                "triggers": ["can't connect", "no internet", "wifi", "network", "slow connection"],
+                "triggers": ["can't connect", "no internet", "internet", "wifi", "network", "slow connection"],
                 "responses": [{
                     "first_turn": """
 Category: Network Connectivity
@@ -82,6 +156,25 @@ Fix: 1. Restart computer
                 }]
             }
         }
+
+        rules_path = rules_path or os.getenv("MOCK_LLM_RULES")
+        if rules_path:
+            with open(rules_path) as f:
+                self.templates = json.load(f)
+
+        # Compile trigger tables once
+        self._category_matcher = KeywordMatcher(
+            (category, template["triggers"])
+            for category, template in self.templates.items()
+        )
+        self._error_matcher = KeywordMatcher([("error", ERROR_KEYWORDS)])
+
+    def classify(self, text: str) -> Optional[Tuple[str, str]]:
+        """
+        Return the (category, matched trigger) for a text, or None.
+        Categories earlier in self.templates win when several match.
+        """
+        return self._category_matcher.match(text)
     
     def query(self, prompt: str) -> str:
         """
@@ -105,25 +198,22 @@ COMMAND: systeminfo
 Likely cause: Unknown - gathering system information"""
         
         # Find matching category based on keywords
-        prompt_lower = prompt.lower()
-        for category, template in self.templates.items():
-            if any(trigger in prompt_lower for trigger in template["triggers"]):
-                return template["responses"][0]["first_turn"].strip()
+        match = self.classify(prompt)
+        if match:
+            return self.templates[match[0]]["responses"][0]["first_turn"].strip()
         
         return default_response.strip()
     
     def _generate_second_turn(self, prompt: str) -> str:
         """Generate final diagnosis based on command output."""
         # Determine success/failure from command output
-        has_error = any(err in prompt.lower() for err in 
-            ["error", "failure", "timeout", "not found", "offline"])
+        has_error = self._error_matcher.match(prompt) is not None
         
         # Find matching category
-        prompt_lower = prompt.lower()
-        for category, template in self.templates.items():
-            if any(trigger in prompt_lower for trigger in template["triggers"]):
-                response = template["responses"][0]["second_turn"]
-                return (response["failure" if has_error else "success"]).strip()
+        match = self.classify(prompt)
+        if match:
+            response = self.templates[match[0]]["responses"][0]["second_turn"]
+            return (response["failure" if has_error else "success"]).strip()
         
         # Default response
         return """
@@ -5,6 +5,10 @@ MIT License - See LICENSE file
 """
 
 import os
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from typing import Dict, Optional
 import httpx
 from dotenv import load_dotenv
@@ -12,33 +16,59 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Responses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 class OpenAIAdapter:
     """
     OpenAI API integration for IT diagnostics.
     Requires OPENAI_API_KEY environment variable.
-    
-    TODO: Uncomment and configure to enable OpenAI integration
+
+    One pooled httpx.AsyncClient (HTTP/2 when available, keep-alive) is
+    shared by every call for the adapter's lifetime; call aclose() at
+    shutdown. Concurrent requests are capped by a semaphore, and 429/5xx
+    responses are retried with exponential backoff honoring Retry-After.
     """
-    
-    def __init__(self):
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError(
                 "OpenAI API key not found. Please set OPENAI_API_KEY environment variable. "
                 "For testing/demo, use MockLLM instead."
             )
-        
+
         # TODO: Configure your preferred model
-        self.model = "gpt-4-1106-preview"  # or "gpt-3.5-turbo" for lower cost
-        
-        self.prompt_template = """
-You are an expert IT support technician. Analyze the following issue:
+        self.model = os.getenv("OPENAI_MODEL", "gpt-4-1106-preview")  # or "gpt-3.5-turbo" for lower cost
+
+        # Connection pool, concurrency and retry settings
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        self.pool_size = max(1, int(os.getenv("OPENAI_POOL_SIZE", "10")))
+        self.max_concurrency = max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")))
+        self.timeout = float(os.getenv("OPENAI_TIMEOUT", "30"))
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+        self.http2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true" and _http2_available()
 
-{user_input}
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self.prompt_template = """
+You are an expert IT support technician. Analyze the issue described in the user's message.
 
 Provide a structured response with:
 1. Issue category
-2. ONE diagnostic command to run (start with COMMAND:)
+2. One to three diagnostic commands to run, each on its own line starting with COMMAND:
 3. Likely cause and recommended fix
 
 Only suggest commands from this safe list:
@@ -56,13 +86,8 @@ Likely cause: <brief explanation>
 """
 
         self.followup_template = """
-Analyze the diagnostic results:
-
-Initial assessment:
-{initial_response}
-
-Command output:
-{command_output}
+Analyze the diagnostic results in the user's message, which contains the
+initial assessment and the diagnostic command output.
 
 Provide a final diagnosis and specific fix steps.
 
@@ -70,50 +95,106 @@ Format:
 Diagnosis: <clear explanation>
 Fix: <numbered steps>
 """
-    
-    async def query(self, prompt: str) -> str:
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                transport=self._transport,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Seconds to wait before retry number attempt (0-based)."""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    delay = (when - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.backoff_max)
+
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def query(self, prompt: str, timeout: Optional[float] = None) -> str:
         """
         Send query to OpenAI API and return structured response.
-        
-        TODO: Uncomment and complete implementation
-        """
+
+        Args:
+            prompt: The first- or second-turn prompt
+            timeout: Per-call timeout in seconds (defaults to OPENAI_TIMEOUT)
+
+        Returns:
+            The model's reply, or an error message if every attempt failed
         """
-        if "Command output:" in prompt:
+        if "output:" in prompt.lower():
             system_prompt = self.followup_template
         else:
             system_prompt = self.prompt_template
-            
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7
+        }
+        call_timeout = timeout or self.timeout
+        request_timeout = httpx.Timeout(call_timeout, connect=min(call_timeout, 5.0))
+
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user",
-                                "content": prompt
-                            }
-                        ],
-                        "temperature": 0.7
-                    }
-                )
-                
-                response.raise_for_status()
-                return response.json()["choices"][0]["message"]["content"]
-                
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    # Hold a slot per attempt only, not across the backoff sleep
+                    async with self._semaphore:
+                        response = await self.client.post(
+                            "/chat/completions",
+                            json=payload,
+                            timeout=request_timeout
+                        )
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        response.raise_for_status()
+                        return response.json()["choices"][0]["message"]["content"]
+                    if attempt == self.max_retries:
+                        response.raise_for_status()
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+
+                await asyncio.sleep(self._retry_delay(attempt, response))
+
         except Exception as e:
             return f"Error calling OpenAI API: {str(e)}"
-        """
-        raise NotImplementedError(
-            "OpenAI integration is disabled by default. "
-            "Uncomment the code and set OPENAI_API_KEY to enable."
-        )
\ No newline at end of file
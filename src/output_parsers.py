@@ -0,0 +1,448 @@
+"""
+Output Parsers - Compact structured summaries of diagnostic command output
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+
+Raw output of commands such as ps aux or netstat -an runs to thousands of
+lines. Each parser here reduces the output of one whitelisted command to
+a few fields, which go into the second LLM prompt and onto the ticket
+instead of the raw text.
+
+Every summary has a "status" of "ok", "degraded" or "failure (<reason>)";
+failure reasons use words (failure, offline, error) that MockLLM's error
+keywords recognize.
+"""
+
+import re
+import shlex
+from typing import Any, Callable, Dict, List, Optional
+
+# Entries kept for "top N" style fields
+TOP_N = 5
+
+# Lines kept from output no parser understands
+FALLBACK_HEAD_LINES = 20
+FALLBACK_TAIL_LINES = 5
+
+def _lines(text: str) -> List[str]:
+    return [line.rstrip() for line in text.splitlines() if line.strip()]
+
+def _float(value: str) -> Optional[float]:
+    try:
+        return float(value.replace(",", ""))
+    except ValueError:
+        return None
+
+def parse_ping(output: str) -> Optional[Dict[str, Any]]:
+    """Packet loss and round-trip times (Linux, macOS and Windows formats)."""
+    summary: Dict[str, Any] = {}
+    host = re.search(r"^(?:PING|Pinging) (\S+)", output, re.MULTILINE)
+    if host:
+        summary["host"] = host.group(1)
+
+    unix = re.search(
+        r"(\d+) packets transmitted, (\d+) (?:packets )?received.*?([\d.]+)% packet loss", output
+    )
+    windows = re.search(r"Sent = (\d+), Received = (\d+), Lost = \d+ \(([\d.]+)% loss", output)
+    stats = unix or windows
+    if stats is None:
+        return None
+    sent, received, loss = int(stats.group(1)), int(stats.group(2)), float(stats.group(3))
+    summary.update({"sent": sent, "received": received, "packet_loss_pct": loss})
+
+    rtt = re.search(r"min/avg/max\S* = ([\d.]+)/([\d.]+)/([\d.]+)", output)
+    if rtt:
+        summary["rtt_ms"] = f"min {rtt.group(1)} / avg {rtt.group(2)} / max {rtt.group(3)}"
+    else:
+        rtt = re.search(r"Minimum = (\d+)ms, Maximum = (\d+)ms, Average = (\d+)ms", output)
+        if rtt:
+            summary["rtt_ms"] = f"min {rtt.group(1)} / avg {rtt.group(3)} / max {rtt.group(2)}"
+
+    if loss >= 100 or received == 0:
+        summary["status"] = "failure (no replies, 100% packet loss)"
+    elif loss > 0:
+        summary["status"] = f"degraded ({loss:g}% packet loss)"
+    else:
+        summary["status"] = "ok"
+    return summary
+
+def parse_traceroute(output: str) -> Optional[Dict[str, Any]]:
+    """Hop count, unresponsive hops and whether the target answered."""
+    target = re.search(r"(?:traceroute to|Tracing route to) (\S+)(?: [(\[]([\d.]+)[)\]])?", output)
+
+    hops = []
+    for line in _lines(output):
+        match = re.match(r"^\s*(\d+)\s+(.*)$", line)
+        if match:
+            hops.append(match.group(2))
+    if not hops:
+        return None
+
+    silent = [text for text in hops if set(text.replace("Request timed out.", "").split()) <= {"*"}]
+    last = hops[-1]
+    target_ip = target.group(2) or target.group(1) if target else None
+    reached = bool(target_ip and target_ip in last)
+    summary: Dict[str, Any] = {
+        "target": target.group(1) if target else None,
+        "hops": len(hops),
+        "unresponsive_hops": len(silent),
+        "last_hop": " ".join(last.split())[:80],
+    }
+    if reached:
+        summary["status"] = "ok" if not silent else f"degraded ({len(silent)} hops not answering)"
+    else:
+        summary["status"] = "failure (destination not reached)"
+    return summary
+
+def parse_ifconfig(output: str) -> Optional[Dict[str, Any]]:
+    """Interfaces with state, IPv4 address and error counters."""
+    interfaces: List[Dict[str, Any]] = []
+    for line in output.splitlines():
+        header = re.match(r"^(\S+?):? flags=\d+<([^>]*)>", line)
+        if header:
+            flags = header.group(2).split(",")
+            interfaces.append({
+                "name": header.group(1),
+                "up": "UP" in flags and "RUNNING" in flags,
+                "loopback": "LOOPBACK" in flags,
+                "inet": None,
+                "errors": 0,
+            })
+            continue
+        if not interfaces:
+            continue
+        inet = re.match(r"^\s+inet (?:addr:)?([\d.]+)", line)
+        if inet:
+            interfaces[-1]["inet"] = inet.group(1)
+        for count in re.findall(r"[RT]X errors[: ]\s*(\d+)", line):
+            interfaces[-1]["errors"] += int(count)
+        if re.match(r"^\s+status: inactive", line):
+            interfaces[-1]["up"] = False
+    if not interfaces:
+        return None
+
+    described = []
+    for iface in interfaces:
+        text = f"{iface['name']} {'up' if iface['up'] else 'down'}"
+        if iface["inet"]:
+            text += f" {iface['inet']}"
+        if iface["errors"]:
+            text += f" ({iface['errors']} packet errors)"
+        described.append(text)
+
+    active = [i for i in interfaces if i["up"] and i["inet"] and not i["loopback"]]
+    faulty = [i["name"] for i in interfaces if i["errors"]]
+    summary: Dict[str, Any] = {"interfaces": described}
+    if not active:
+        summary["status"] = "failure (no active network interface with an IPv4 address)"
+    elif faulty:
+        summary["status"] = f"degraded (packet errors on {', '.join(faulty)})"
+    else:
+        summary["status"] = "ok"
+    return summary
+
+def parse_ipconfig(output: str) -> Optional[Dict[str, Any]]:
+    """Adapters with IPv4 address, gateway and DNS (Windows ipconfig /all)."""
+    adapters: List[Dict[str, str]] = []
+    host = None
+    for line in output.splitlines():
+        header = re.match(r"^(\S.*adapter .+?):\s*$", line)
+        if header:
+            adapters.append({"name": header.group(1)})
+            continue
+        field = re.match(r"^\s+([A-Za-z][^.:]*?)[ .]*: ?(.*)$", line)
+        if not field:
+            continue
+        key, value = field.group(1).strip(), field.group(2).strip()
+        if not adapters:
+            if key == "Host Name":
+                host = value
+            continue
+        if key.startswith("IPv4 Address"):
+            adapters[-1]["ipv4"] = value.replace("(Preferred)", "")
+        elif key in ("Default Gateway", "DNS Servers", "Media State") and value:
+            adapters[-1][key] = value
+    if not adapters:
+        return None
+
+    described = []
+    connected = 0
+    for adapter in adapters:
+        if adapter.get("Media State", "").lower() == "media disconnected":
+            described.append(f"{adapter['name']}: disconnected")
+            continue
+        parts = [adapter.get("ipv4", "no IPv4")]
+        if "Default Gateway" in adapter:
+            parts.append(f"gw {adapter['Default Gateway']}")
+        if "DNS Servers" in adapter:
+            parts.append(f"dns {adapter['DNS Servers']}")
+        described.append(f"{adapter['name']}: {', '.join(parts)}")
+        if "ipv4" in adapter:
+            connected += 1
+
+    summary: Dict[str, Any] = {"host": host, "adapters": described}
+    summary["status"] = "ok" if connected else "failure (no adapter has an IPv4 address)"
+    return summary
+
+def parse_netstat(output: str) -> Optional[Dict[str, Any]]:
+    """Socket counts by state, listening ports and busiest remote hosts."""
+    states: Dict[str, int] = {}
+    listening = set()
+    remotes: Dict[str, int] = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields or not fields[0].lower().startswith(("tcp", "udp")):
+            continue
+        proto = fields[0].lower()
+        # Linux: proto recv-q send-q local foreign [state]; Windows: proto local foreign [state]
+        local, foreign = (fields[3], fields[4]) if len(fields) >= 5 and fields[1].isdigit() else (fields[1], fields[2])
+        state = fields[-1] if fields[-1].isalpha() and fields[-1].isupper() else "UDP" if proto.startswith("udp") else "UNKNOWN"
+        if state == "LISTENING":
+            state = "LISTEN"
+        states[state] = states.get(state, 0) + 1
+        port = re.split(r"[:.]", local)[-1]
+        if state == "LISTEN":
+            listening.add(port)
+        elif state == "ESTABLISHED":
+            host = foreign.rsplit(":", 1)[0] if ":" in foreign else foreign.rsplit(".", 1)[0]
+            remotes[host] = remotes.get(host, 0) + 1
+    if not states:
+        return None
+
+    ports = sorted(listening, key=lambda p: (not p.isdigit(), int(p) if p.isdigit() else 0, p))
+    busiest = sorted(remotes.items(), key=lambda item: -item[1])[:TOP_N]
+    summary: Dict[str, Any] = {
+        "sockets": sum(states.values()),
+        "by_state": ", ".join(f"{state} {count}" for state, count in sorted(states.items())),
+        "listening_ports": ", ".join(ports[:15]) + (f" (+{len(ports) - 15} more)" if len(ports) > 15 else ""),
+    }
+    if busiest:
+        summary["top_remote_hosts"] = ", ".join(f"{host} x{count}" for host, count in busiest)
+    summary["status"] = "ok"
+    return summary
+
+# systeminfo fields worth sending to the model
+SYSTEMINFO_FIELDS = (
+    "Host Name", "OS Name", "OS Version", "System Type", "Processor(s)",
+    "Total Physical Memory", "Available Physical Memory", "Memory", "System Boot Time"
+)
+
+def parse_systeminfo(output: str) -> Optional[Dict[str, Any]]:
+    """OS, hardware and memory fields of Windows systeminfo."""
+    summary: Dict[str, Any] = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if sep and key.strip() in SYSTEMINFO_FIELDS and key.strip() not in summary:
+            summary[key.strip()] = value.strip()
+    if not summary:
+        return None
+    summary["status"] = "ok"
+    return summary
+
+def parse_hostname(output: str) -> Optional[Dict[str, Any]]:
+    lines = _lines(output)
+    return {"hostname": lines[0].strip(), "status": "ok"} if lines else None
+
+def parse_lpstat(output: str) -> Optional[Dict[str, Any]]:
+    """Printer states (lpstat -p) or device URIs (lpstat -v)."""
+    printers: Dict[str, str] = {}
+    devices: Dict[str, str] = {}
+    for line in output.splitlines():
+        state = re.match(r"^printer (\S+) (?:is )?(idle|disabled|now printing \S+)", line)
+        if state:
+            printers[state.group(1)] = "printing" if state.group(2).startswith("now") else state.group(2)
+            continue
+        if line.startswith(("\t", " ")) and printers and line.strip():
+            # First indented line under a disabled printer is the reason
+            last = next(reversed(printers))
+            if printers[last] == "disabled":
+                printers[last] = f"disabled ({line.strip()})"
+            continue
+        device = re.match(r"^device for (\S+): (\S+)", line)
+        if device:
+            devices[device.group(1)] = device.group(2)
+    if "No destinations added" in output:
+        return {"printers": "none", "status": "failure (no printers configured)"}
+    if not printers and not devices:
+        return None
+
+    summary: Dict[str, Any] = {}
+    if printers:
+        summary["printers"] = [f"{name}: {state}" for name, state in printers.items()]
+        offline = [name for name, state in printers.items() if state.startswith("disabled")]
+        summary["status"] = (
+            f"failure (printer offline: {', '.join(offline)})" if offline else "ok"
+        )
+    else:
+        summary["devices"] = [f"{name}: {uri}" for name, uri in devices.items()]
+        summary["status"] = "ok"
+    return summary
+
+def parse_ps(output: str) -> Optional[Dict[str, Any]]:
+    """Process count and top processes by CPU and memory (ps aux / ps -ef)."""
+    lines = _lines(output)
+    if not lines:
+        return None
+    header = lines[0].split()
+    if "%CPU" in header and "%MEM" in header:
+        columns = len(header)
+        rows = [line.split(None, columns - 1) for line in lines[1:]]
+        rows = [row for row in rows if len(row) == columns]
+        cpu, mem, stat, cmd = (header.index(name) for name in ("%CPU", "%MEM", "STAT", header[-1]))
+    elif "C" in header and ("CMD" in header or "COMMAND" in header):
+        columns = len(header)
+        rows = [line.split(None, columns - 1) for line in lines[1:]]
+        rows = [row for row in rows if len(row) == columns]
+        cpu, mem, stat, cmd = header.index("C"), None, None, columns - 1
+    else:
+        return None
+    if not rows:
+        return None
+
+    def top(index: int) -> List[str]:
+        ranked = sorted(rows, key=lambda row: -(_float(row[index]) or 0))[:TOP_N]
+        return [f"{row[cmd][:60]} ({row[index]}%)" for row in ranked]
+
+    summary: Dict[str, Any] = {"processes": len(rows), "top_cpu": top(cpu)}
+    if mem is not None:
+        summary["top_memory"] = top(mem)
+    zombies = sum(1 for row in rows if stat is not None and "Z" in row[stat])
+    if zombies:
+        summary["zombies"] = zombies
+    busy = sum(_float(row[cpu]) or 0 for row in rows)
+    summary["status"] = f"degraded (processes using {busy:g}% CPU)" if busy >= 90 else "ok"
+    return summary
+
+def parse_top(output: str) -> Optional[Dict[str, Any]]:
+    """Load, task, CPU and memory header lines plus the busiest processes."""
+    summary: Dict[str, Any] = {}
+    lines = output.splitlines()
+    table_start = None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if "load average" in stripped:
+            summary["load_average"] = stripped.split("load average:")[-1].strip()
+        elif stripped.startswith("Tasks:"):
+            summary["tasks"] = stripped[len("Tasks:"):].strip()
+        elif stripped.startswith(("%Cpu", "Cpu(s)")):
+            summary["cpu"] = stripped.split(":", 1)[-1].strip()
+        elif re.match(r"^(?:\w+ )?Mem\s*:", stripped):
+            summary["memory"] = " ".join(stripped.split(":", 1)[-1].split())
+        elif stripped.startswith("PID") and "%CPU" in stripped:
+            table_start = index
+            break
+    if table_start is not None:
+        header = lines[table_start].split()
+        rows = [line.split(None, len(header) - 1) for line in lines[table_start + 1:] if line.strip()]
+        rows = [row for row in rows if len(row) == len(header)]
+        cpu = header.index("%CPU")
+        ranked = sorted(rows, key=lambda row: -(_float(row[cpu]) or 0))[:TOP_N]
+        summary["top_cpu"] = [f"{row[-1][:60]} ({row[cpu]}%)" for row in ranked]
+    if not summary:
+        return None
+
+    idle = re.search(r"([\d.]+)\s*id", summary.get("cpu", ""))
+    if idle and float(idle.group(1)) < 10:
+        summary["status"] = f"degraded (CPU {100 - float(idle.group(1)):g}% busy)"
+    else:
+        summary["status"] = "ok"
+    return summary
+
+# Parser per base command; every ALLOWED_COMMANDS entry has one
+OUTPUT_PARSERS: Dict[str, Callable[[str], Optional[Dict[str, Any]]]] = {
+    "ping": parse_ping,
+    "traceroute": parse_traceroute,
+    "tracert": parse_traceroute,
+    "ipconfig": parse_ipconfig,
+    "ifconfig": parse_ifconfig,
+    "netstat": parse_netstat,
+    "systeminfo": parse_systeminfo,
+    "hostname": parse_hostname,
+    "lpstat": parse_lpstat,
+    "ps": parse_ps,
+    "top": parse_top,
+}
+
+def _head_tail(text: str) -> str:
+    """First and last lines of output no parser understood."""
+    lines = _lines(text)
+    if len(lines) <= FALLBACK_HEAD_LINES + FALLBACK_TAIL_LINES:
+        return "\n".join(lines)
+    omitted = len(lines) - FALLBACK_HEAD_LINES - FALLBACK_TAIL_LINES
+    return "\n".join(
+        lines[:FALLBACK_HEAD_LINES] + [f"... ({omitted} lines omitted)"] + lines[-FALLBACK_TAIL_LINES:]
+    )
+
+def summarize_output(command: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Summarize a run_command result.
+
+    Args:
+        command: The command that ran
+        result: Dict with stdout, stderr and returncode
+
+    Returns:
+        Dict with command, status and the parser's fields; stderr is kept
+        (first lines) and unparsed output falls back to its head and tail
+    """
+    stdout = result.get("stdout") or ""
+    stderr = result.get("stderr") or ""
+    returncode = result.get("returncode", 0)
+    parser = OUTPUT_PARSERS.get(shlex.split(command)[0]) if command.strip() else None
+
+    parsed = None
+    if parser is not None and stdout.strip():
+        try:
+            parsed = parser(stdout)
+        except (ValueError, IndexError):
+            parsed = None
+
+    summary: Dict[str, Any] = {"command": command}
+    if parsed is None:
+        if stdout.strip():
+            summary["output"] = _head_tail(stdout)
+        if returncode == -1:
+            summary["status"] = "failure (timeout)"
+        elif returncode not in (0, None):
+            summary["status"] = f"failure (error, exit code {returncode})"
+        else:
+            summary["status"] = "ok"
+    else:
+        summary.update(parsed)
+
+    if stderr.strip():
+        summary["stderr"] = "\n".join(_lines(stderr)[:3])
+    # Status last so it reads as the conclusion
+    summary["status"] = summary.pop("status")
+    return summary
+
+def combine_summaries(summaries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    One summary for a multi-command plan: the single summary itself, or
+    {"command", "results", "status"} with the worst status of the plan.
+    """
+    if not summaries:
+        return None
+    if len(summaries) == 1:
+        return summaries[0]
+    statuses = [summary["status"] for summary in summaries]
+    worst = next(
+        (status for prefix in ("failure", "degraded") for status in statuses if status.startswith(prefix)),
+        "ok"
+    )
+    return {
+        "command": "; ".join(summary["command"] for summary in summaries),
+        "results": summaries,
+        "status": worst,
+    }
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """Render a summary as compact "key: value" lines for the LLM prompt."""
+    lines = []
+    for key, value in summary.items():
+        if value is None or key == "command":
+            continue
+        if isinstance(value, list):
+            value = "; ".join(str(item) for item in value)
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines)
@@ -0,0 +1,226 @@
+"""
+Simulation Profiles - Latency and fault injection for simulated runs
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+
+A profile is a JSON (or, with PyYAML installed, YAML) document:
+
+    {
+      "seed": 42,
+      "llm": {
+        "default": {"latency_ms": {"dist": "lognormal", "median": 800, "sigma": 0.4},
+                    "token_delay_ms": 15, "error_rate": 0.01,
+                    "rate_limit_rate": 0.02, "retry_after_ms": 1000}
+      },
+      "commands": {
+        "default": {"latency_ms": {"dist": "uniform", "min": 50, "max": 300}},
+        "ping": {"latency_ms": {"dist": "normal", "mean": 3000, "stddev": 150},
+                 "timeout_rate": 0.02}
+      }
+    }
+
+LLM settings are looked up by backend name (mock, openai, bedrock) and
+fall back to "default". Command settings merge "default", the base
+command (e.g. "ping") and the exact command string, in that order.
+"""
+
+import os
+import json
+import random
+import asyncio
+import shlex
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+# Supported latency distributions and their parameters (milliseconds)
+DISTRIBUTIONS = {
+    "fixed": ("value",),
+    "uniform": ("min", "max"),
+    "normal": ("mean", "stddev"),
+    "lognormal": ("median", "sigma"),
+    "exponential": ("mean",),
+}
+
+# Injected faults, rolled once per call in this order
+FAULTS = ("error", "timeout", "rate_limit")
+
+class SimulationProfile:
+    """
+    Samples latencies and faults for LLM calls and simulated commands.
+
+    All draws come from one seeded random.Random, so a profile with a
+    seed produces the same sequence for the same sequence of calls.
+    """
+
+    def __init__(self, config: Dict[str, Any], seed: Optional[int] = None):
+        self.llm: Dict[str, Dict] = config.get("llm", {})
+        self.commands: Dict[str, Dict] = config.get("commands", {})
+        self._rng = random.Random(config.get("seed") if seed is None else seed)
+
+        for settings in [*self.llm.values(), *self.commands.values()]:
+            for key in ("latency_ms", "token_delay_ms"):
+                if key in settings:
+                    self._validate(settings[key])
+
+    @classmethod
+    def from_file(cls, path: str) -> "SimulationProfile":
+        """Load a profile from a .json, .yaml or .yml file."""
+        with open(path) as f:
+            if path.endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError("YAML simulation profiles need PyYAML (pip install pyyaml)")
+                return cls(yaml.safe_load(f) or {})
+            return cls(json.load(f))
+
+    @staticmethod
+    def _validate(spec: Union[float, Dict]) -> None:
+        if isinstance(spec, (int, float)):
+            return
+        dist = spec.get("dist", "fixed")
+        if dist not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {dist}")
+        missing = [name for name in DISTRIBUTIONS[dist] if name not in spec]
+        if missing:
+            raise ValueError(f"{dist} latency needs: {', '.join(missing)}")
+
+    def sample_ms(self, spec: Union[float, Dict, None]) -> float:
+        """Draw one latency in milliseconds (never negative)."""
+        if spec is None:
+            return 0.0
+        if isinstance(spec, (int, float)):
+            return max(0.0, float(spec))
+
+        dist = spec.get("dist", "fixed")
+        if dist == "fixed":
+            value = spec["value"]
+        elif dist == "uniform":
+            value = self._rng.uniform(spec["min"], spec["max"])
+        elif dist == "normal":
+            value = self._rng.gauss(spec["mean"], spec["stddev"])
+        elif dist == "lognormal":
+            value = spec["median"] * self._rng.lognormvariate(0, spec["sigma"])
+        else:
+            value = self._rng.expovariate(1 / spec["mean"]) if spec["mean"] > 0 else 0
+        return max(0.0, float(value))
+
+    def roll_fault(self, settings: Dict) -> Optional[str]:
+        """Return "error", "timeout", "rate_limit" or None for one call."""
+        roll = self._rng.random()
+        for fault in FAULTS:
+            rate = settings.get(f"{fault}_rate", 0)
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def llm_settings(self, backend: str) -> Dict:
+        """Settings for an LLM backend name, or the "default" entry."""
+        return self.llm.get(backend, self.llm.get("default", {}))
+
+    def command_settings(self, command: str) -> Dict:
+        """Merged settings for a command: default, then base command, then exact."""
+        settings = dict(self.commands.get("default", {}))
+        settings.update(self.commands.get(shlex.split(command)[0], {}))
+        settings.update(self.commands.get(command, {}))
+        return settings
+
+    async def apply_command(
+        self,
+        command: str,
+        result: Dict,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """
+        Delay a simulated command result and inject faults.
+
+        A timeout fault, or a sampled latency beyond timeout, waits the
+        full timeout and returns the same result a real timeout would.
+        """
+        settings = self.command_settings(command)
+        fault = self.roll_fault(settings)
+        latency_ms = self.sample_ms(settings.get("latency_ms"))
+
+        if timeout is not None and (fault == "timeout" or latency_ms >= timeout * 1000):
+            await asyncio.sleep(timeout)
+            return {
+                "cmd": command,
+                "stdout": "",
+                "stderr": f"Command timed out after {timeout} seconds",
+                "returncode": -1,
+                "runtime_ms": int(timeout * 1000)
+            }
+
+        await asyncio.sleep(latency_ms / 1000)
+        if fault == "error":
+            return {
+                "cmd": command,
+                "stdout": "",
+                "stderr": f"{shlex.split(command)[0]}: simulated failure",
+                "returncode": 1,
+                "runtime_ms": int(latency_ms)
+            }
+        return {**result, "runtime_ms": int(latency_ms)}
+
+def load_simulation_profile() -> Optional[SimulationProfile]:
+    """
+    Profile from SIMULATION_PROFILE: a file path or inline JSON.
+    Returns None when the variable is not set.
+    """
+    spec = os.getenv("SIMULATION_PROFILE", "").strip()
+    if not spec:
+        return None
+    if spec.startswith("{"):
+        return SimulationProfile(json.loads(spec))
+    return SimulationProfile.from_file(spec)
+
+class SimulatedLLMBackend:
+    """
+    LLMBackend wrapper that adds a profile's latency and faults.
+
+    latency_ms is the time to the first token and token_delay_ms the gap
+    between tokens (whitespace-separated words of the reply). Errors and
+    timeouts come back as "Error calling ..." text like the real
+    adapters; rate-limited calls wait retry_after_ms and then succeed,
+    as the adapters do after honoring Retry-After.
+    """
+
+    def __init__(self, backend: Any, profile: SimulationProfile, name: str):
+        self.backend = backend
+        self.profile = profile
+        self.name = name
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield the reply token by token with the profile's delays."""
+        settings = self.profile.llm_settings(self.name)
+        fault = self.profile.roll_fault(settings)
+
+        if fault == "timeout":
+            timeout = settings.get("timeout_s", 30)
+            await asyncio.sleep(timeout)
+            yield f"Error calling {self.name} LLM: request timed out after {timeout} seconds"
+            return
+        if fault == "rate_limit":
+            await asyncio.sleep(settings.get("retry_after_ms", 1000) / 1000)
+
+        await asyncio.sleep(self.profile.sample_ms(settings.get("latency_ms")) / 1000)
+        if fault == "error":
+            yield f"Error calling {self.name} LLM: simulated server error (500)"
+            return
+
+        reply = await self.backend.query(prompt)
+        token_delay = settings.get("token_delay_ms")
+        for index, token in enumerate(reply.split(" ")):
+            if index and token_delay is not None:
+                await asyncio.sleep(self.profile.sample_ms(token_delay) / 1000)
+            yield token if index == 0 else " " + token
+
+    async def query(self, prompt: str) -> str:
+        """Return the whole reply after the simulated generation time."""
+        return "".join([token async for token in self.stream(prompt)])
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.backend, name)
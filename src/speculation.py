@@ -0,0 +1,42 @@
+"""
+Speculation - Local issue classification to start diagnostics early
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+"""
+
+from typing import Dict, Optional, Tuple
+
+from .mock_llm import MockLLM
+
+def first_command(response: str) -> Optional[str]:
+    """The first COMMAND: line of a first-turn response, if any."""
+    for line in response.split("\n"):
+        line = line.strip()
+        if line.startswith("COMMAND:"):
+            return line.replace("COMMAND:", "").strip() or None
+    return None
+
+class TriggerClassifier:
+    """
+    Predicts (category, command) for an issue from MockLLM trigger words.
+
+    Uses the same templates as MockLLM (including MOCK_LLM_RULES), so a
+    prediction is the command MockLLM would suggest for the issue. The
+    keyword scan takes microseconds, so it can run before the first
+    LLM turn and let the pipeline start the likely command right away.
+    """
+
+    def __init__(self, llm: Optional[MockLLM] = None):
+        self.llm = llm or MockLLM()
+        self.commands: Dict[str, Optional[str]] = {
+            category: first_command(template["responses"][0]["first_turn"])
+            for category, template in self.llm.templates.items()
+        }
+
+    def predict(self, issue: str) -> Optional[Tuple[str, str]]:
+        """Return (category, command) for an issue, or None if unsure."""
+        match = self.llm.classify(issue)
+        if match is None:
+            return None
+        command = self.commands.get(match[0])
+        return (match[0], command) if command else None
@@ -34,66 +34,94 @@ with st.form("helpdesk_form"):
 
 # Handle form submission
 if submitted and username and issue:
-    with st.spinner("Analyzing your issue..."):
-        try:
-            # Call FastAPI backend
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/diagnose",
-                    json={"username": username, "issue": issue},
-                    timeout=30.0
-                )
+    try:
+        # Stream pipeline stages from the FastAPI backend as they complete
+        col1, col2 = st.columns(2)
+        with col1:
+            status = st.status("Analyzing your issue...", expanded=True)
+        with col2:
+            command_placeholder = st.empty()
+            output_placeholder = st.empty()
+
+        data = None
+        output_lines = []
+        with httpx.stream(
+            "POST",
+            "http://localhost:8000/diagnose/stream",
+            json={"username": username, "issue": issue},
+            timeout=30.0
+        ) as response:
+            if response.status_code != 200:
+                response.read()
+                st.error(f"Error: {response.text}")
+            else:
+                for raw_line in response.iter_lines():
+                    if not raw_line:
+                        continue
+                    event = json.loads(raw_line)
+
+                    if event["event"] == "ticket":
+                        status.write(f"Ticket #{event['ticket_id']} created")
+                    elif event["event"] == "analysis":
+                        status.write(f"Category: {event.get('category') or 'Unknown'}")
+                        if event.get("command"):
+                            status.update(label=f"Running {event['command']}...")
+                            command_placeholder.code(event["command"])
+                    elif event["event"] == "output":
+                        output_lines.append(event["line"])
+                        output_placeholder.code("\n".join(output_lines[-200:]), language=None)
+                    elif event["event"] == "diagnosis":
+                        data = event
+                        status.update(label="Diagnosis complete", state="complete", expanded=False)
+                    elif event["event"] == "error":
+                        status.update(label="Diagnosis failed", state="error")
+                        st.error(f"Error: {event['detail']}")
+
+        if data:
+            with col1:
+                st.success(f"Ticket #{data['ticket_id']} Created")
                 
-                if response.status_code != 200:
-                    st.error(f"Error: {response.text}")
-                else:
-                    data = response.json()
-                    
-                    # Display results in expandable sections
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.success(f"Ticket #{data['ticket_id']} Created")
-                        
-                        st.subheader("📋 Diagnosis")
-                        st.write(data["diagnosis"])
-                        
-                        st.subheader("🔧 Suggested Fix")
-                        st.write(data["suggested_fix"])
+                st.subheader("📋 Diagnosis")
+                st.write(data["diagnosis"])
+                
+                st.subheader("🔧 Suggested Fix")
+                st.write(data["suggested_fix"])
+            
+            with col2:
+                if data.get("executed_command"):
+                    with command_placeholder.container():
+                        st.subheader("🖥️ Diagnostic Command")
+                        st.code(data["executed_command"])
                     
-                    with col2:
-                        if data.get("executed_command"):
-                            st.subheader("🖥️ Diagnostic Command")
-                            st.code(data["executed_command"])
-                            
-                            st.subheader("📄 Command Output")
-                            st.text_area(
-                                "Output",
-                                value=data.get("command_output", "No output"),
-                                height=200,
-                                disabled=True
-                            )
-                        
-                        # Download results button
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        results = {
-                            "timestamp": timestamp,
-                            "ticket_id": data["ticket_id"],
-                            "username": username,
-                            "issue": issue,
-                            **data
-                        }
-                        
-                        st.download_button(
-                            "📥 Download Results",
-                            json.dumps(results, indent=2),
-                            f"ticket_{data['ticket_id']}_{timestamp}.json",
-                            "application/json"
+                    with output_placeholder.container():
+                        st.subheader("📄 Command Output")
+                        st.text_area(
+                            "Output",
+                            value=data.get("command_output") or "No output",
+                            height=200,
+                            disabled=True
                         )
+                
+                # Download results button
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                results = {
+                    "timestamp": timestamp,
+                    "ticket_id": data["ticket_id"],
+                    "username": username,
+                    "issue": issue,
+                    **{key: value for key, value in data.items() if key != "event"}
+                }
+                
+                st.download_button(
+                    "📥 Download Results",
+                    json.dumps(results, indent=2),
+                    f"ticket_{data['ticket_id']}_{timestamp}.json",
+                    "application/json"
+                )
                     
-        except Exception as e:
-            st.error(f"Error communicating with backend: {str(e)}")
+    except Exception as e:
+        st.error(f"Error communicating with backend: {str(e)}")
             
 else:
     if submitted:
-        st.warning("Please fill in both your name and issue description.")
\ No newline at end of file
+        st.warning("Please fill in both your name and issue description.")
@@ -0,0 +1,115 @@
+"""
+Diagnostics Worker - Runs queued /diagnose jobs outside the web process
+Copyright (c) 2025 IT Helpdesk Auto-Responder Contributors
+MIT License - See LICENSE file
+
+Start the web tier with DIAGNOSE_QUEUE=true and one or more workers:
+
+    python -m src.worker --processes 4 --concurrency 2
+
+Workers share the ticket database and the job queue (data/jobs.db, or
+JOB_QUEUE_PATH) with the web process, so both tiers scale separately.
+"""
+
+import os
+import socket
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from typing import Dict, List, Optional
+
+from .job_queue import JobQueue
+from . import main as app
+
+logger = logging.getLogger(__name__)
+
+async def process_job(queue: JobQueue, job: Dict) -> None:
+    """Run the diagnose pipeline for one claimed job and record the outcome."""
+    try:
+        request = app.DiagnosisRequest(**job["payload"])
+        async for event in app.diagnose_events(request, ticket_id=job["ticket_id"]):
+            pass
+    except Exception as e:
+        logger.warning("Job %s for ticket %s failed: %s", job["id"], job["ticket_id"], e)
+        await queue.fail(job["id"], str(e))
+    else:
+        await queue.complete(job["id"])
+
+async def run_worker(
+    queue: Optional[JobQueue] = None,
+    concurrency: int = 1,
+    poll_interval: float = 0.5,
+    stop: Optional[asyncio.Event] = None,
+    until_idle: bool = False
+) -> int:
+    """
+    Claim and process jobs with up to concurrency pipelines at once.
+
+    Runs until stop is set, or with until_idle until the queue is empty.
+    Uses the app's JOB_QUEUE_PATH queue unless one is given. Returns the
+    number of jobs processed.
+    """
+    queue = queue or app.job_queue
+    stop = stop or asyncio.Event()
+    processed = 0
+
+    async def slot(index: int) -> None:
+        nonlocal processed
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        while not stop.is_set():
+            job = await queue.claim(worker_id)
+            if job is None:
+                if until_idle:
+                    return
+                try:
+                    await asyncio.wait_for(stop.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await process_job(queue, job)
+            processed += 1
+
+    await app.db.open()
+    try:
+        await asyncio.gather(*(slot(index) for index in range(max(1, concurrency))))
+    finally:
+        await app.llm.aclose()
+        await queue.close()
+        await app.db.close()
+    return processed
+
+def _worker_process(concurrency: int, poll_interval: float) -> None:
+    """Entry point of one worker process."""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_worker(concurrency=concurrency, poll_interval=poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run background diagnose workers")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "2")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")),
+                        help="Pipelines run at once per process")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="Seconds between queue polls when idle")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(args.concurrency, args.poll_interval))
+        for _ in range(max(1, args.processes))
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
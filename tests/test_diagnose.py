@@ -5,6 +5,8 @@ MIT License - See LICENSE file
 """
 
 import os
+import time
+import asyncio
 import pytest
 import json
 from fastapi.testclient import TestClient
@@ -27,6 +29,15 @@ def mock_command_output():
         "runtime_ms": 100
     }
 
+@pytest.fixture
+def honolulu_tz():
+    """Run the test with a local time zone that is not UTC."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("TZ", "Pacific/Honolulu")
+        time.tzset()
+        yield
+    time.tzset()
+
 def test_diagnose_endpoint_success(mock_command_output):
     """Test successful diagnosis request."""
     # Mock the command execution
@@ -73,13 +84,43 @@ def test_command_whitelist():
     assert not dx.is_allowed("sudo reboot")
     assert not dx.is_allowed("ping google.com | grep")
 
+def test_command_argument_grammars():
+    """Test argument grammars validate hosts and counts and normalize argv."""
+    dx = DiagnosticsExecutor()
+
+    assert dx.validate("ping  -c 04 Google.COM") == ("ping", "-c", "4", "google.com")
+    assert dx.validate("traceroute 10.0.0.1") == ("traceroute", "10.0.0.1")
+    # A bare ping gets a count so it always exits
+    assert dx.validate("ping google.com") in [
+        ("ping", "-c", "4", "google.com"), ("ping", "-n", "4", "google.com")
+    ]
+    assert dx.validate("tracert -h 5 ::1") == ("tracert", "-h", "5", "::1")
+    assert dx.validate("ipconfig /all") == ("ipconfig", "/all")
+
+    for command in [
+        "ping -c 11 google.com",     # count out of bounds
+        "ping -c 0 google.com",
+        "ping -c 4 -f",              # option where a host belongs
+        "ping -c 4 google..com",
+        "ping 256.1.1.1",
+        "ping 'google.com'",
+        "ping $(reboot)",
+        "ping google.com; reboot",
+        "lpstat -p printer1",        # no grammar: exact entries only
+        "",
+    ]:
+        assert dx.validate(command) is None, command
+
+    with pytest.raises(ValueError):
+        asyncio.run(dx.run_command("ping -c 4 -f"))
+
 def test_simulation_mode():
     """Test simulation mode functionality."""
     # Enable simulation
     os.environ["FORCE_SIMULATION"] = "true"
     dx = DiagnosticsExecutor()
     
-    result = dx.simulate_command("ping -c 4 google.com")
+    result = asyncio.run(dx.simulate_command("ping -c 4 google.com"))
     assert "packet loss" in result["stdout"]
     assert result["returncode"] == 0
     
@@ -106,27 +147,1273 @@ def test_mock_llm_responses():
     assert "Category: System" in response
     assert "COMMAND:" in response
 
-def test_database_operations():
+def test_mock_llm_routes_internet_issues_to_network():
+    """Test issues mentioning the internet route to the network template."""
+    from src.mock_llm import MockLLM
+    llm = MockLLM()
+
+    for issue in ["My internet is slow", "Internet keeps dropping", "no internet at all"]:
+        response = llm.query(issue)
+        assert "Category: Network" in response
+        assert "COMMAND: ping -c 4 google.com" in response
+
+    # "slow" without "internet" is still a system issue
+    assert "Category: System" in llm.query("My computer is very slow")
+
+def test_database_operations(tmp_path):
     """Test ticket database operations."""
     from src.db import TicketStore
-    db = TicketStore()
-    
-    # Test ticket creation and retrieval
-    ticket_id = db.create_ticket("testuser", "Test issue")
-    assert ticket_id > 0
-    
-    ticket = db.get_ticket(ticket_id)
-    assert ticket["username"] == "testuser"
-    assert ticket["issue"] == "Test issue"
-    
-    # Test ticket update
-    success = db.update_ticket(
-        ticket_id,
-        diagnosis="Test diagnosis",
-        fix="Test fix"
+    db = TicketStore(data_dir=tmp_path)
+
+    async def scenario():
+        # Test ticket creation and retrieval
+        ticket_id = await db.create_ticket("testuser", "Test issue")
+        assert ticket_id > 0
+
+        ticket = await db.get_ticket(ticket_id)
+        assert ticket["username"] == "testuser"
+        assert ticket["issue"] == "Test issue"
+
+        # Test ticket update
+        success = await db.update_ticket(
+            ticket_id,
+            diagnosis="Test diagnosis",
+            fix="Test fix"
+        )
+        assert success
+
+        updated = await db.get_ticket(ticket_id)
+        assert updated["diagnosis"] == "Test diagnosis"
+        assert updated["fix"] == "Test fix"
+        await db.close()
+
+    asyncio.run(scenario())
+
+def test_database_connection_pool(tmp_path, monkeypatch):
+    """Test the pooled connections are long-lived and use WAL mode."""
+    from src.db import TicketStore
+    monkeypatch.setenv("DB_READER_POOL_SIZE", "2")
+    db = TicketStore(data_dir=tmp_path)
+
+    async def scenario():
+        await db.open()
+        writer = db._writer
+        assert db._readers.qsize() == 2
+
+        ids = await asyncio.gather(
+            *(db.create_ticket(f"user{i}", "Concurrent issue") for i in range(10))
+        )
+        assert sorted(ids) == list(range(1, 11))
+        tickets = await asyncio.gather(*(db.get_ticket(i) for i in ids))
+        assert all(t["issue"] == "Concurrent issue" for t in tickets)
+
+        # Same writer reused, readers returned to the pool
+        assert db._writer is writer
+        assert db._readers.qsize() == 2
+        async with db._read_conn() as conn:
+            async with conn.execute("PRAGMA journal_mode") as cursor:
+                assert (await cursor.fetchone())[0] == "wal"
+
+        await db.close()
+        assert db._writer is None and db._readers is None
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("durability", ["flush", "async"])
+def test_database_write_behind(tmp_path, monkeypatch, durability):
+    """Test batched write-behind mode keeps IDs and flushes on shutdown."""
+    from src.db import TicketStore
+    monkeypatch.setenv("DB_WRITE_BEHIND", "true")
+    monkeypatch.setenv("DB_WRITE_DURABILITY", durability)
+    monkeypatch.setenv("DB_FLUSH_MAX_ROWS", "8")
+    db = TicketStore(data_dir=tmp_path)
+
+    async def scenario():
+        await db.open()
+        ids = await asyncio.gather(
+            *(db.create_ticket(f"user{i}", f"Issue {i}") for i in range(20))
+        )
+        assert len(set(ids)) == 20
+        await asyncio.gather(
+            *(db.update_ticket(i, diagnosis=f"Diagnosis {i}") for i in ids)
+        )
+
+        # Reads flush pending writes first
+        ticket = await db.get_ticket(ids[3])
+        assert ticket["username"] == "user3"
+        assert ticket["diagnosis"] == f"Diagnosis {ids[3]}"
+
+        last_id = await db.create_ticket("late", "Queued at shutdown")
+        await db.close()
+        return last_id
+
+    last_id = asyncio.run(scenario())
+
+    # Flush-on-shutdown committed the last queued insert
+    db = TicketStore(data_dir=tmp_path)
+    ticket = asyncio.run(db.get_ticket(last_id))
+    assert ticket["issue"] == "Queued at shutdown"
+    asyncio.run(db.close())
+
+def test_json_journal_fallback(tmp_path):
+    """Test the append-only JSON-lines fallback store."""
+    from src.db import TicketJournal, TicketStore
+    path = tmp_path / "diagnostics_log.jsonl"
+    journal = TicketJournal(path, compact_min_lines=10)
+
+    ids = [journal.create(f"user{i}", f"Issue {i}") for i in range(5)]
+    assert ids == [1, 2, 3, 4, 5]
+    assert journal.update(2, diagnosis="Cable unplugged", fix="Plug it in")
+    assert not journal.update(99, diagnosis="Missing")
+
+    # Index is rebuilt from disk by a fresh instance (e.g. another worker)
+    other = TicketJournal(path, compact_min_lines=10)
+    assert other.get(2)["diagnosis"] == "Cable unplugged"
+    assert other.create("other", "From another worker") == 6
+    assert journal.get(6)["username"] == "other"
+
+    # Superseded lines are compacted away once they pile up
+    for i in range(20):
+        journal.update(1, diagnosis=f"Attempt {i}")
+    assert len(path.read_text().splitlines()) <= 12
+    assert journal.get(1)["diagnosis"] == "Attempt 19"
+    assert other.get(1)["diagnosis"] == "Attempt 19"
+
+    # TicketStore routes to the journal when SQLite is unavailable
+    db = TicketStore(data_dir=tmp_path)
+    db.use_sqlite = False
+    ticket_id = asyncio.run(db.create_ticket("fallback", "SQLite is down"))
+    assert ticket_id == 7
+    assert asyncio.run(db.update_ticket(ticket_id, diagnosis="Recovered"))
+    assert asyncio.run(db.get_ticket(ticket_id))["diagnosis"] == "Recovered"
+
+    # A journal lock held by another worker blocks a thread, not the loop
+    from src.db import _lock_file, _unlock_file
+
+    async def read_while_locked():
+        ticks = 0
+        with open(db.journal.lock_path, "a+b") as lock_file:
+            _lock_file(lock_file)
+            read = asyncio.create_task(db.get_ticket(ticket_id))
+            while ticks < 5:
+                await asyncio.sleep(0.01)
+                ticks += 1
+            assert not read.done()
+            _unlock_file(lock_file)
+        return ticks, await read
+
+    ticks, ticket = asyncio.run(read_while_locked())
+    assert ticks == 5 and ticket["username"] == "fallback"
+
+def test_run_command_is_non_blocking(monkeypatch):
+    """Test commands run concurrently-limited, capped and killed on timeout."""
+    import src.diagnostics as diagnostics_module
+    monkeypatch.setitem(diagnostics_module.ALLOWED_COMMANDS, "sleep", ["sleep 5"])
+    monkeypatch.setitem(diagnostics_module.ALLOWED_COMMANDS, "yes", ["yes"])
+    monkeypatch.setenv("DIAGNOSTICS_MAX_OUTPUT_BYTES", "64")
+    monkeypatch.setenv("DIAGNOSTICS_MAX_CONCURRENCY", "2")
+    monkeypatch.delenv("FORCE_SIMULATION", raising=False)
+    monkeypatch.delenv("CODESPACES", raising=False)
+    dx = DiagnosticsExecutor()
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        result = await dx.run_command("sleep 5", timeout=1)
+        ticking.cancel()
+
+        # The loop kept running while the command was timing out
+        assert ticks >= 10
+        assert result["returncode"] == -1
+        assert "timed out" in result["stderr"]
+
+        result = await dx.run_command("ps aux")
+        assert result["returncode"] == 0
+        assert result["stdout"].endswith("[output truncated at 64 bytes]")
+
+        # Output captured before a timeout is kept
+        result = await dx.run_command("yes", timeout=0.5)
+        assert result["returncode"] == -1
+        assert result["stdout"].startswith("y\ny\n") and len(result["stdout"]) == 64
+
+    asyncio.run(scenario())
+
+def test_command_cache_single_flight(monkeypatch):
+    """Test identical concurrent commands share one execution and are cached."""
+    dx = DiagnosticsExecutor()
+    calls = []
+
+    async def fake_execute(command, timeout, on_output=None):
+        calls.append(command)
+        await asyncio.sleep(0.05)
+        return {"cmd": command, "stdout": "ok", "stderr": "", "returncode": 0, "runtime_ms": 50}
+
+    monkeypatch.setattr(dx, "_execute", fake_execute)
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(dx.run_command("ping -c 4") for _ in range(20))
+        )
+        assert all(r["stdout"] == "ok" for r in results)
+        await dx.run_command("ping -c 4")
+        await dx.run_command("lpstat -p")
+
+    asyncio.run(scenario())
+    assert calls == ["ping -c 4", "lpstat -p"]
+    stats = dx.cache.stats()
+    assert stats["misses"] == 2
+    assert stats["coalesced"] == 19
+    assert stats["hits"] == 1
+
+    # TTL 0 (e.g. via DIAGNOSTICS_CACHE_TTLS) disables caching for a command
+    dx.cache_ttls["ping"] = 0
+    asyncio.run(dx.run_command("ping -c 4"))
+    assert calls.count("ping -c 4") == 2
+
+    # LRU eviction keeps the cache bounded
+    dx.cache.max_entries = 1
+    asyncio.run(dx.run_command("systeminfo"))
+    assert dx.cache.stats()["entries"] == 1
+    assert dx.cache.stats()["evictions"] == 2
+
+def test_mock_llm_keyword_matcher(tmp_path):
+    """Test compiled trigger matching keeps category priority and loads rules."""
+    from src.mock_llm import KeywordMatcher, MockLLM
+
+    matcher = KeywordMatcher([
+        ("network", ["slow connection", "wifi"]),
+        ("performance", ["slow"]),
+    ])
+    assert matcher.match("Everything is SLOW") == ("performance", "slow")
+    assert matcher.match("slow connection at my desk") == ("network", "slow connection")
+    assert matcher.match("it's slow and the wifi drops") == ("network", "wifi")
+    assert matcher.match("printer jam") is None
+
+    llm = MockLLM()
+    assert llm.classify("The printer won't print") == ("printer", "printer")
+
+    rules = {
+        f"category{i}": {
+            "triggers": [f"symptom {i}", f"code e{i:03d}"],
+            "responses": [{
+                "first_turn": f"Category: Rule {i}\nCOMMAND: hostname\nLikely cause: rule {i}",
+                "second_turn": {"success": "Diagnosis: ok\nFix: none", "failure": "Diagnosis: bad\nFix: retry"}
+            }]
+        }
+        for i in range(500)
+    }
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text(json.dumps(rules))
+
+    llm = MockLLM(rules_path=str(rules_path))
+    assert llm.classify("Screen shows CODE E417 after boot") == ("category417", "code e417")
+    assert "Category: Rule 417" in llm.query("Screen shows code e417 after boot")
+
+def test_openai_adapter_retries_with_pooled_client(monkeypatch):
+    """Test the OpenAI adapter against a local fake server."""
+    import httpx
+    from src.openai_adapter import OpenAIAdapter
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BACKOFF_BASE", "0.01")
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(503),
+        httpx.Response(200, json={"choices": [{"message": {"content": "COMMAND: hostname"}}]}),
+    ]
+    seen = []
+
+    def fake_server(request):
+        seen.append(request)
+        return responses.pop(0)
+
+    adapter = OpenAIAdapter(transport=httpx.MockTransport(fake_server))
+
+    async def scenario():
+        client = adapter.client
+        reply = await adapter.query("User reports issue: no wifi")
+        assert adapter.client is client
+        await adapter.aclose()
+        return reply
+
+    assert asyncio.run(scenario()) == "COMMAND: hostname"
+    assert len(seen) == 3
+    assert seen[0].headers["Authorization"] == "Bearer test-key"
+    assert json.loads(seen[0].content)["messages"][1]["content"] == "User reports issue: no wifi"
+
+    # Non-retryable errors are reported without further attempts
+    responses[:] = [httpx.Response(401)]
+    seen.clear()
+    assert asyncio.run(adapter.query("hello")).startswith("Error calling OpenAI API")
+    assert len(seen) == 1
+
+    # A call waiting out a backoff does not hold a concurrency slot
+    monkeypatch.setenv("OPENAI_MAX_CONCURRENCY", "1")
+    responses[:] = [
+        httpx.Response(503, headers={"Retry-After": "0.5"}),
+        httpx.Response(200, json={"choices": [{"message": {"content": "second"}}]}),
+        httpx.Response(200, json={"choices": [{"message": {"content": "first"}}]}),
+    ]
+    adapter = OpenAIAdapter(transport=httpx.MockTransport(fake_server))
+
+    async def backoff_scenario():
+        first = asyncio.create_task(adapter.query("first"))
+        await asyncio.sleep(0.1)
+        second = await asyncio.wait_for(adapter.query("second"), timeout=0.3)
+        replies = [await first, second]
+        await adapter.aclose()
+        return replies
+
+    assert asyncio.run(backoff_scenario()) == ["first", "second"]
+
+def test_bedrock_adapter_streams_off_the_event_loop():
+    """Test the Bedrock adapter streams deltas from a shared client in threads."""
+    import time
+    from src.aws_stubs.bedrock_stub import BedrockAdapter
+
+    class FakeBedrockClient:
+        def __init__(self):
+            self.requests = []
+            self.fail = False
+
+        def converse_stream(self, **request):
+            self.requests.append(request)
+            if self.fail:
+                raise RuntimeError("ThrottlingException: rate exceeded")
+
+            def events():
+                yield {"messageStart": {"role": "assistant"}}
+                for text in ["Category: Network\n", "COMMAND: ping -c 4\n", "Likely cause: DNS"]:
+                    time.sleep(0.1)  # Blocking, like botocore reading the stream
+                    yield {"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 0}}
+                yield {"messageStop": {"stopReason": "end_turn"}}
+            return {"stream": events()}
+
+    fake = FakeBedrockClient()
+    adapter = BedrockAdapter(client=fake)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in adapter.stream("User reports issue: no wifi")]
+        replies = await asyncio.gather(*(adapter.query("no wifi") for _ in range(3)))
+        elapsed = time.perf_counter() - start
+        ticking.cancel()
+
+        assert chunks == ["Category: Network\n", "COMMAND: ping -c 4\n", "Likely cause: DNS"]
+        assert replies == ["".join(chunks)] * 3
+        # Streams ran in pool threads, concurrently, without blocking the loop
+        assert elapsed < 1.0
+        assert ticks >= 10
+        assert adapter.client is fake
+
+        fake.fail = True
+        assert (await adapter.query("no wifi")).startswith("Error calling AWS Bedrock")
+        await adapter.aclose()
+
+    asyncio.run(scenario())
+    first = fake.requests[0]
+    assert first["messages"][0]["content"][0]["text"] == "User reports issue: no wifi"
+    assert "COMMAND:" in first["system"][0]["text"]
+
+def test_llm_backend_factory(monkeypatch):
+    """Test every backend is exposed through the same async interface."""
+    from src.llm_backend import LLMBackend, create_llm_backend
+    from src.openai_adapter import OpenAIAdapter
+
+    monkeypatch.setenv("LLM_BACKEND", "mock")
+    backend = create_llm_backend()
+    assert isinstance(backend, LLMBackend)
+    assert "network" in backend.templates
+    response = asyncio.run(backend.query("No internet since this morning"))
+    assert "COMMAND: ping" in response
+    asyncio.run(backend.aclose())
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    assert isinstance(create_llm_backend("openai"), OpenAIAdapter)
+
+    with pytest.raises(ValueError):
+        create_llm_backend("unknown")
+
+def test_llm_response_cache(tmp_path, monkeypatch):
+    """Test repeated and near-duplicate prompts are answered from the cache."""
+    import src.llm_cache as llm_cache_module
+    from src.llm_backend import as_llm_backend
+    from src.llm_cache import CachedLLMBackend
+    from src.mock_llm import MockLLM
+
+    class CountingLLM(MockLLM):
+        calls = 0
+
+        def query(self, prompt):
+            CountingLLM.calls += 1
+            return super().query(prompt)
+
+    def make_cache(**kwargs):
+        return CachedLLMBackend(
+            as_llm_backend(CountingLLM()), db_path=tmp_path / "llm_cache.db", **kwargs
+        )
+
+    def prompt(username, issue):
+        return (
+            f"User '{username}' reports issue: {issue}\n"
+            "Analyze the issue and suggest ONE safe diagnostic command.\n"
+            "Format: Category: <category>\nCOMMAND: <command>\nLikely cause: <cause>"
+        )
+
+    async def scenario():
+        cache = make_cache(max_entries=2)
+        try:
+            first = await cache.query(prompt("alice", "The printer won't print"))
+            again = await cache.query(prompt("ALICE", "the printer   won't print!"))
+            assert first == again
+            assert CountingLLM.calls == 1
+            await cache.query(prompt("bob", "No internet"))
+            await cache.query(prompt("carol", "Computer is slow"))
+            assert cache.stats()["entries"] == 2
+        finally:
+            await cache.aclose()
+
+        # Persisted entries survive a restart
+        cache = make_cache(max_distance=4)
+        try:
+            await cache.query(prompt("carol", "Computer is slow"))
+            assert CountingLLM.calls == 3
+
+            # The same issue from a different user is an exact match
+            await cache.query(prompt("dave", "Computer is slow"))
+            assert CountingLLM.calls == 3
+            assert cache.stats()["near_hits"] == 0
+
+            # Near-duplicate issue matches by SimHash
+            await cache.query(prompt("dave", "The computer is slow"))
+            assert CountingLLM.calls == 3
+            assert cache.stats()["near_hits"] == 1
+
+            # A different issue is not close enough
+            await cache.query(prompt("dave", "The printer is offline"))
+            assert CountingLLM.calls == 4
+
+            # Prompts quoting command output only match exactly
+            def second_turn(returncode):
+                return (
+                    "Initial analysis: Category: Network\n"
+                    "Command 'ping -c 4 8.8.8.8' output:\n"
+                    f"status: failed, returncode: {returncode}\n"
+                    "Based on this information, provide a final diagnosis and fix:"
+                )
+
+            await cache.query(second_turn(1))
+            await cache.query(second_turn(2))
+            assert CountingLLM.calls == 6
+            await cache.query(second_turn(1))
+            assert CountingLLM.calls == 6
+            assert cache.stats()["near_hits"] == 1
+        finally:
+            await cache.aclose()
+
+    asyncio.run(scenario())
+
+    # Exact-only caches never compute SimHashes
+    def no_simhash(text):
+        raise AssertionError("SimHash computed with near-duplicate matching off")
+
+    monkeypatch.setattr(llm_cache_module, "simhash", no_simhash)
+    import src.main as main_module
+    cache = CachedLLMBackend(as_llm_backend(CountingLLM()), db_path=tmp_path / "exact.db")
+    from src.db import TicketStore
+    monkeypatch.setattr(main_module, "llm", cache)
+    monkeypatch.setattr(main_module, "db", TicketStore(data_dir=tmp_path))
+    monkeypatch.setenv("FORCE_SIMULATION", "true")
+
+    async def two_users():
+        try:
+            # The same issue from different users shares the first-turn entry
+            for username in ("alice", "bob"):
+                request = main_module.DiagnosisRequest(username=username, issue="No internet")
+                async for event in main_module.diagnose_events(request, ticket_id=1):
+                    pass
+        finally:
+            await cache.aclose()
+            await main_module.db.close()
+
+    calls = CountingLLM.calls
+    asyncio.run(two_users())
+    assert CountingLLM.calls == calls + 2
+    assert cache.stats()["hits"] == 2
+
+def test_diagnose_stream_endpoint(monkeypatch):
+    """Test the streaming endpoint emits each pipeline stage in order."""
+    monkeypatch.setenv("FORCE_SIMULATION", "true")
+    import src.main as main_module
+    monkeypatch.setattr(main_module, "diagnostics", DiagnosticsExecutor())
+
+    with client.stream(
+        "POST",
+        "/diagnose/stream",
+        json={"username": "testuser", "issue": "The printer won't print"}
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    kinds = [event["event"] for event in events]
+    assert kinds[0] == "ticket"
+    assert kinds[1] == "analysis"
+    assert events[1]["category"] == "Printing System"
+    assert events[1]["command"] == "lpstat -p"
+    assert "output" in kinds
+    assert kinds[-1] == "diagnosis"
+    assert events[-1]["ticket_id"] == events[0]["ticket_id"]
+    assert "HP_LaserJet" in events[-1]["command_output"]
+
+def test_stream_command_lines(monkeypatch):
+    """Test real command output is streamed line by line."""
+    import src.main as main_module
+    monkeypatch.delenv("FORCE_SIMULATION", raising=False)
+    monkeypatch.delenv("CODESPACES", raising=False)
+    monkeypatch.setattr(main_module, "diagnostics", DiagnosticsExecutor())
+
+    async def scenario():
+        return [item async for item in main_module._stream_command("ps aux")]
+
+    items = asyncio.run(scenario())
+    assert items[-1][0] == "result"
+    lines = [value for kind, value in items if kind == "line"]
+    assert len(lines) > 1
+    assert "\n".join(lines) == items[-1][1]["stdout"].rstrip("\n")
+
+def test_diagnose_batch_endpoint(monkeypatch, tmp_path):
+    """Test batch diagnosis keeps input order and shares identical commands."""
+    import src.main as main_module
+    from src.db import TicketStore
+    store = TicketStore(data_dir=tmp_path)
+    monkeypatch.setattr(main_module, "db", store)
+    calls = []
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        calls.append(command)
+        await asyncio.sleep(0.01)
+        return {"cmd": command, "stdout": f"output of {command}", "stderr": "",
+                "returncode": 0, "runtime_ms": 10}
+
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    issues = ["The printer won't print", "No internet", "Printer offline again", "wifi is down"]
+    batch = {"requests": [{"username": f"user{i}", "issue": issue} for i, issue in enumerate(issues)]}
+
+    # The lifespan opens the store's pool on the client's event loop
+    with TestClient(app) as batch_client:
+        response = batch_client.post("/diagnose/batch", json=batch)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["result"]["executed_command"] for r in results] == [
+            "lpstat -p", "ping -c 4 google.com", "lpstat -p", "ping -c 4 google.com"
+        ]
+        ids = [r["result"]["ticket_id"] for r in results]
+        assert ids == sorted(ids) and len(set(ids)) == 4
+        assert calls.count("lpstat -p") == 1
+
+        with batch_client.stream("POST", "/diagnose/batch?stream=true", json=batch) as response:
+            lines = [json.loads(line) for line in response.iter_lines() if line]
+        assert [line["index"] for line in lines] == [0, 1, 2, 3]
+        assert lines[0]["result"]["executed_command"] == "lpstat -p"
+
+        # Every ticket was persisted and updated in SQLite
+        for result in results + lines:
+            ticket = batch_client.get(f"/tickets/{result['result']['ticket_id']}").json()
+            assert ticket["command"] == result["result"]["executed_command"]
+            assert ticket["diagnosis"] == result["result"]["diagnosis"]
+    assert store.use_sqlite
+    assert not store.json_path.exists()
+
+def test_metrics_endpoint(monkeypatch):
+    """Test /metrics exposes per-stage histograms and counters."""
+    import src.main as main_module
+    from src.metrics import STAGE_SECONDS, Histogram, Registry
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        return {"cmd": command, "stdout": "printer is idle", "stderr": "",
+                "returncode": 0, "runtime_ms": 1}
+
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    before = STAGE_SECONDS.count(stage="llm_turn1")
+    response = client.post(
+        "/diagnose",
+        json={"username": "metrics_user", "issue": "The printer won't print"}
     )
-    assert success
-    
-    updated = db.get_ticket(ticket_id)
-    assert updated["diagnosis"] == "Test diagnosis"
-    assert updated["fix"] == "Test fix"
\ No newline at end of file
+    assert response.status_code == 200
+    assert STAGE_SECONDS.count(stage="llm_turn1") == before + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE helpdesk_stage_duration_seconds histogram" in body
+    for stage in ("ticket_create", "llm_turn1", "command_run", "llm_turn2", "ticket_update"):
+        assert f'helpdesk_stage_duration_seconds_count{{stage="{stage}"}}' in body
+    assert 'helpdesk_command_cache_total{result="hits"}' in body
+    assert "helpdesk_command_executions_total" in body
+
+    # Buckets are cumulative and end at +Inf
+    registry = Registry()
+    histogram = registry.register(Histogram("latency_seconds", "Test.", buckets=[0.1, 1]))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_count 3" in lines
+
+def test_benchmark_harness():
+    """Test the in-process benchmark reports per-stage percentiles and regressions."""
+    from src.benchmark import compare_to_baseline, histogram_quantile, parse_mix, run_benchmark
+
+    assert parse_mix("network=3,unknown=1") == {"network": 0.75, "unknown": 0.25}
+    assert histogram_quantile(0.5, [(0.1, 2), (1, 4), (float("inf"), 4)]) == 0.1
+
+    report = asyncio.run(run_benchmark(
+        requests=20, concurrency=5, llm_latency_ms=5, command_latency_ms=5, command_cache=False,
+        coalesce=False
+    ))
+    assert report["completed"] == 20 and report["errors"] == 0
+    assert report["throughput_rps"] > 0
+    assert report["stages_ms"]["llm_turn1"]["count"] == 20
+    assert report["stages_ms"]["llm_turn1"]["p50"] >= 5
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+
+    assert compare_to_baseline(report, report) == []
+    slower = json.loads(json.dumps(report))
+    slower["throughput_rps"] = report["throughput_rps"] / 2
+    slower["latency_ms"]["p95"] = report["latency_ms"]["p95"] * 2 + 10
+    assert len(compare_to_baseline(slower, report)) == 2
+
+def test_simulation_profile_injects_latency_and_faults(monkeypatch):
+    """Test simulation profiles delay commands and LLM calls and inject faults."""
+    import time
+    from src.llm_backend import create_llm_backend
+    from src.simulation import SimulatedLLMBackend, SimulationProfile
+
+    monkeypatch.setenv("SIMULATION_PROFILE", json.dumps({
+        "seed": 1,
+        "llm": {"mock": {"latency_ms": 30, "token_delay_ms": 1}},
+        "commands": {
+            "default": {"latency_ms": {"dist": "uniform", "min": 40, "max": 60}},
+            "ps": {"error_rate": 1.0},
+            "netstat": {"timeout_rate": 1.0}
+        }
+    }))
+    dx = DiagnosticsExecutor()
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(dx.simulate_command("systeminfo") for _ in range(5)))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(run())
+    # Real sleeps that overlap rather than add up
+    assert 0.04 <= elapsed < 0.2
+    assert all(40 <= r["runtime_ms"] <= 60 for r in results)
+
+    failed = asyncio.run(dx.simulate_command("ps aux", timeout=1))
+    assert failed["returncode"] == 1 and "simulated failure" in failed["stderr"]
+    timed_out = asyncio.run(dx.simulate_command("netstat -an", timeout=0.05))
+    assert timed_out["returncode"] == -1 and "timed out" in timed_out["stderr"]
+
+    llm = create_llm_backend("mock")
+    assert isinstance(llm, SimulatedLLMBackend)
+    start = time.perf_counter()
+    reply = asyncio.run(llm.query("No internet since this morning"))
+    assert time.perf_counter() - start >= 0.03
+    assert "COMMAND: ping -c 4 google.com" in reply
+
+    throttled = SimulatedLLMBackend(llm.backend, SimulationProfile({
+        "llm": {"default": {"rate_limit_rate": 1.0, "retry_after_ms": 20}}
+    }), "mock")
+    start = time.perf_counter()
+    assert "Category: Printing" in asyncio.run(throttled.query("printer jammed"))
+    assert time.perf_counter() - start >= 0.02
+
+    with pytest.raises(ValueError):
+        SimulationProfile({"commands": {"default": {"latency_ms": {"dist": "pareto"}}}})
+
+def test_list_tickets_keyset_pagination(tmp_path, honolulu_tz):
+    """Test ticket listing filters, full-text search, projection and cursors."""
+    from datetime import datetime, timedelta, timezone
+    from src.db import TicketStore
+
+    # Naive filter times mean UTC even where local time is not UTC (honolulu_tz)
+    async def run(db):
+        ids = []
+        for i in range(7):
+            ticket_id = await db.create_ticket(f"user{i % 2}", f"Printer {i} shows paper jam")
+            await db.update_ticket(
+                ticket_id,
+                diagnosis="Printer offline" if i % 3 == 0 else "Paper jam",
+                fix="Open tray B and clear the jam",
+                output="x" * 1000,
+                category="Printing System"
+            )
+            ids.append(ticket_id)
+
+        page, cursor = await db.list_tickets(limit=3)
+        assert [t["id"] for t in page] == ids[:-4:-1]
+        assert "output" not in page[0] and page[0]["category"] == "Printing System"
+        seen = [t["id"] for t in page]
+        while cursor is not None:
+            page, cursor = await db.list_tickets(limit=3, before_id=cursor)
+            seen += [t["id"] for t in page]
+        assert seen == ids[::-1]
+
+        rows, _ = await db.list_tickets(username="user1", diagnosis="Paper jam")
+        assert [t["id"] for t in rows] == [ids[5], ids[1]]
+        rows, _ = await db.list_tickets(text="printer 4 jam")
+        assert [t["id"] for t in rows] == [ids[4]]
+        rows, _ = await db.list_tickets(text="tray", columns=["output"], limit=2)
+        assert set(rows[0]) == {"id", "output"}
+        rows, _ = await db.list_tickets(created_after=datetime.now(timezone.utc) + timedelta(hours=1))
+        assert rows == []
+        utc_now = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows, _ = await db.list_tickets(created_after=utc_now - timedelta(minutes=5))
+        assert len(rows) == 7
+        rows, _ = await db.list_tickets(created_before=utc_now - timedelta(minutes=5))
+        assert rows == []
+        with pytest.raises(ValueError):
+            await db.list_tickets(columns=["id; DROP TABLE tickets"])
+
+        # Search text without words filters nothing and keeps SQLite in use
+        rows, _ = await db.list_tickets(text="!!!")
+        assert len(rows) == 7
+        rows, _ = await db.list_tickets(text="printer")
+        assert len(rows) == 7
+        return ids
+
+    db = TicketStore(data_dir=tmp_path)
+    assert db.fts_enabled
+    try:
+        asyncio.run(run(db))
+        assert db.use_sqlite
+    finally:
+        asyncio.run(db.close())
+
+    # Same behaviour from the JSON journal fallback
+    fallback = TicketStore(data_dir=tmp_path / "json")
+    fallback.use_sqlite = False
+    asyncio.run(run(fallback))
+
+    response = client.get("/tickets", params={"limit": 1, "fields": "id,issue"})
+    assert response.status_code == 200
+    assert client.get("/tickets", params={"fields": "password"}).status_code == 400
+
+def test_command_output_blobs(tmp_path):
+    """Test command output is compressed, deduplicated and read lazily."""
+    import sqlite3
+    from src.db import TicketStore
+
+    # A database from before the side table, with an inline output
+    with sqlite3.connect(tmp_path / "tickets.db") as conn:
+        conn.execute(
+            "CREATE TABLE tickets (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL, "
+            "issue TEXT NOT NULL, diagnosis TEXT, command TEXT, output TEXT, fix TEXT, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute("INSERT INTO tickets (username, issue, output) VALUES ('old', 'slow', 'legacy output')")
+
+    ps_output = "USER PID %CPU %MEM COMMAND\n" + "root 1 0.0 0.1 /sbin/init\n" * 500
+    db = TicketStore(data_dir=tmp_path)
+
+    async def run():
+        ids = [await db.create_ticket(f"user{i}", "Computer is slow") for i in range(3)]
+        for ticket_id in ids:
+            await db.update_ticket(ticket_id, command="ps aux", output=ps_output)
+
+        assert (await db.get_ticket(ids[0]))["output"] == ps_output
+        assert "output" not in await db.get_ticket(ids[0], include_output=False)
+        assert (await db.get_ticket(1))["output"] == "legacy output"
+        rows, _ = await db.list_tickets(columns=["output"])
+        assert [row["output"] for row in rows] == [ps_output] * 3 + ["legacy output"]
+        return ids
+
+    try:
+        ids = asyncio.run(run())
+    finally:
+        asyncio.run(db.close())
+
+    with sqlite3.connect(tmp_path / "tickets.db") as conn:
+        blobs = conn.execute("SELECT size, length(data) FROM command_outputs").fetchall()
+        inline = conn.execute("SELECT COUNT(*) FROM tickets WHERE output IS NOT NULL").fetchone()[0]
+    assert len(blobs) == 2 and inline == 0
+    size, stored = max(blobs)
+    assert size == len(ps_output) and stored < size / 10
+
+    # Blobs are deleted once no ticket references them
+    async def prune():
+        assert await db.prune_outputs() == 0
+        await db.update_ticket(ids[0], output="replaced output")
+        assert await db.prune_outputs() == 0
+        for ticket_id in ids[1:]:
+            await db.update_ticket(ticket_id, output="replaced output")
+        assert await db.prune_outputs() == 1
+        await db.close()
+
+    asyncio.run(prune())
+    with sqlite3.connect(tmp_path / "tickets.db") as conn:
+        conn.execute("DELETE FROM tickets WHERE id = 1")
+    TicketStore(data_dir=tmp_path)
+    with sqlite3.connect(tmp_path / "tickets.db") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM command_outputs").fetchone()[0] == 1
+
+    response = client.get("/tickets/999999999")
+    assert response.status_code == 404
+
+def test_output_parsers_summarize_commands(monkeypatch):
+    """Test command output is reduced to a compact summary for LLM turn two."""
+    import src.main as main_module
+    from src.diagnostics import ALLOWED_COMMANDS
+    from src.output_parsers import OUTPUT_PARSERS, format_summary, summarize_output
+
+    for variants in ALLOWED_COMMANDS.values():
+        for command in variants:
+            assert command.split()[0] in OUTPUT_PARSERS
+
+    ping = summarize_output("ping -c 4 google.com", {
+        "stdout": "4 packets transmitted, 0 received, 100% packet loss, time 3004ms\n",
+        "stderr": "", "returncode": 1
+    })
+    assert ping["packet_loss_pct"] == 100 and ping["status"].startswith("failure")
+
+    printers = summarize_output("lpstat -p", {
+        "stdout": "printer Office disabled since Mon -\n\tPaused\nprinter HP is idle.  enabled since Tue\n",
+        "stderr": "", "returncode": 0
+    })
+    assert printers["printers"] == ["Office: disabled (Paused)", "HP: idle"]
+    assert "offline" in printers["status"]
+
+    ps_output = "USER PID %CPU %MEM VSZ RSS TTY STAT START TIME COMMAND\n" + "".join(
+        f"user {pid} {pid % 7}.0 {pid % 5}.5 1000 200 ? S 09:00 0:01 /usr/bin/worker-{pid} --flag\n"
+        for pid in range(1, 2000)
+    )
+    ps = summarize_output("ps aux", {"stdout": ps_output, "stderr": "", "returncode": 0})
+    assert ps["processes"] == 1999 and len(ps["top_cpu"]) == 5
+    assert len(format_summary(ps)) < len(ps_output) / 50
+
+    unknown = summarize_output("ps aux", {"stdout": "\n".join(map(str, range(100))), "stderr": "", "returncode": 0})
+    assert "75 lines omitted" in unknown["output"]
+
+    prompts = []
+
+    class RecordingLLM:
+        async def query(self, prompt):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                return "Category: Process Check\nCOMMAND: ps aux\nLikely cause: load"
+            return "Diagnosis: Busy\nFix: Close apps"
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        return {"cmd": command, "stdout": ps_output, "stderr": "", "returncode": 0, "runtime_ms": 5}
+
+    monkeypatch.setattr(main_module, "llm", RecordingLLM())
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    response = client.post("/diagnose", json={"username": "ps_user", "issue": "Everything is sluggish"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["command_output"].startswith("USER PID")
+    assert data["output_summary"]["processes"] == 1999
+    assert "processes: 1999" in prompts[1] and "worker-1 " not in prompts[1]
+    assert len(prompts[1]) < 2000
+
+    ticket = client.get(f"/tickets/{data['ticket_id']}").json()
+    assert json.loads(ticket["output_summary"])["processes"] == 1999
+
+def test_multi_command_plan_runs_in_parallel(monkeypatch):
+    """Test a plan's commands run concurrently and a late one yields a partial result."""
+    import time
+    import src.main as main_module
+
+    prompts = []
+
+    class PlanningLLM:
+        async def query(self, prompt):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                return ("Category: Network Connectivity\nCOMMAND: ping -c 4\n"
+                        "COMMAND: ifconfig -a\nCOMMAND: netstat -an\nCOMMAND: hostname\n"
+                        "Likely cause: DNS")
+            return "Diagnosis: Gateway unreachable\nFix: Restart the router"
+
+    delays = {"ping -c 4": 0.1, "ifconfig -a": 0.1, "netstat -an": 5}
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        await asyncio.sleep(delays[command])
+        stdout = {
+            "ping -c 4": "4 packets transmitted, 4 received, 0% packet loss, time 3004ms\n",
+            "ifconfig -a": "eth0: flags=4163<UP,BROADCAST,RUNNING,MULTICAST>  mtu 1500\n        inet 10.0.0.5  netmask 255.0.0.0\n",
+        }[command]
+        return {"cmd": command, "stdout": stdout, "stderr": "", "returncode": 0, "runtime_ms": 100}
+
+    monkeypatch.setattr(main_module, "llm", PlanningLLM())
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    monkeypatch.setattr(main_module, "PLAN_DEADLINE", 0.5)
+
+    start = time.perf_counter()
+    response = client.post("/diagnose", json={"username": "plan_user", "issue": "No internet"})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    assert elapsed < 1.5
+
+    data = response.json()
+    # Capped at DIAGNOSE_MAX_COMMANDS (3)
+    assert data["executed_command"] == "ping -c 4; ifconfig -a; netstat -an"
+    results = data["output_summary"]["results"]
+    assert [r["status"] for r in results][:2] == ["ok", "ok"]
+    assert results[2]["status"] == "failure (timeout)"
+    assert "deadline" in results[2]["stderr"]
+    assert data["output_summary"]["status"] == "failure (timeout)"
+    for command in ("ping -c 4", "ifconfig -a", "netstat -an"):
+        assert f"Command '{command}' output:" in prompts[1]
+    assert "$ ifconfig -a" in data["command_output"]
+
+def test_job_queue_worker(monkeypatch, tmp_path):
+    """Test /diagnose enqueues with DIAGNOSE_QUEUE and a worker completes the job."""
+    import src.main as main_module
+    from src.job_queue import JobQueue
+    from src.worker import run_worker
+
+    class QuickLLM:
+        async def query(self, prompt):
+            if "final diagnosis" in prompt:
+                return "Diagnosis: Printer offline\nFix: Power cycle the printer"
+            return "Category: Printer\nCOMMAND: lpstat -p\nLikely cause: Offline"
+
+        async def aclose(self):
+            pass
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        return {"cmd": command, "stdout": "printer HP is idle.\n", "stderr": "",
+                "returncode": 0, "runtime_ms": 5}
+
+    queue = JobQueue(tmp_path / "jobs.db")
+    monkeypatch.setattr(main_module, "DIAGNOSE_QUEUE", True)
+    monkeypatch.setattr(main_module, "job_queue", queue)
+    monkeypatch.setattr(main_module, "llm", QuickLLM())
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+
+    response = client.post("/diagnose", json={"username": "queued_user", "issue": "Cannot print"})
+    assert response.status_code == 202
+    queued = response.json()
+    assert queued["status"] == "queued"
+
+    ticket = client.get(f"/tickets/{queued['ticket_id']}").json()
+    assert ticket["job"]["status"] == "queued"
+    assert ticket.get("diagnosis") is None
+    assert client.get("/jobs").json()["queued"] == 1
+
+    assert asyncio.run(run_worker(queue, concurrency=2, until_idle=True)) == 1
+
+    ticket = client.get(f"/tickets/{queued['ticket_id']}?wait=5").json()
+    assert ticket["job"] == {"id": queued["job_id"], "status": "done", "attempts": 1, "error": None}
+    assert ticket["diagnosis"] == "Printer offline"
+    assert ticket["command"] == "lpstat -p"
+
+    # The 202 body is declared in the OpenAPI schema
+    responses = client.get("/openapi.json").json()["paths"]["/diagnose"]["post"]["responses"]
+    assert responses["202"]["content"]["application/json"]["schema"]["$ref"].endswith("/DiagnosisQueuedResponse")
+
+def test_job_queue_lease_expiry(tmp_path):
+    """Test a job whose worker died is re-claimed, then failed after max attempts."""
+    from src.job_queue import JobQueue
+
+    async def scenario():
+        queue = JobQueue(tmp_path / "jobs.db", lease_seconds=0, max_attempts=2)
+        job_id = await queue.enqueue(7, {"username": "u", "issue": "i"})
+
+        first = await queue.claim("worker-a")
+        assert first["id"] == job_id and first["attempts"] == 1
+        # Lease already expired: another worker takes over
+        second = await queue.claim("worker-b")
+        assert second["id"] == job_id and second["attempts"] == 2
+        assert await queue.claim("worker-c") is None
+
+        job = await queue.status(7)
+        assert job["status"] == "failed" and "Lease expired" in job["error"]
+        await queue.close()
+
+    asyncio.run(scenario())
+
+def test_commands_start_while_first_turn_streams(monkeypatch):
+    """Test commands start as their COMMAND: line streams in, and a full plan stops generation."""
+    import time
+    import src.main as main_module
+    from src.metrics import LLM_EARLY_STOPS
+
+    events = []
+
+    class StreamingLLM:
+        def __init__(self):
+            self.closed_early = False
+
+        async def stream(self, prompt):
+            finished = False
+            try:
+                for chunk in ["Category: Network\nCOMM", "AND: ping -c 4\n", "COMMAND: hostname\n",
+                              "Likely cause: DNS"]:
+                    yield chunk
+                    await asyncio.sleep(0.3)
+                finished = True
+            finally:
+                events.append(("generation_finished" if finished else "generation_stopped",
+                               time.perf_counter()))
+
+        async def query(self, prompt):
+            return "Diagnosis: DNS failure\nFix: Flush the DNS cache"
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        events.append((f"start {command}", time.perf_counter()))
+        await asyncio.sleep(0.3)
+        return {"cmd": command, "stdout": "4 packets transmitted, 4 received, 0% packet loss\n",
+                "stderr": "", "returncode": 0, "runtime_ms": 300}
+
+    monkeypatch.setattr(main_module, "llm", StreamingLLM())
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+
+    # The first command starts while the rest of the reply is being generated
+    start = time.perf_counter()
+    response = client.post("/diagnose", json={"username": "early", "issue": "No internet"})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    assert response.json()["executed_command"] == "ping -c 4; hostname"
+    names = [name for name, _ in events]
+    assert names == ["start ping -c 4", "start hostname", "generation_finished"]
+    assert elapsed < 1.5  # 4 x 0.3s of generation, commands overlapped
+
+    # With a one-command plan the reply is not needed past its COMMAND: line
+    events.clear()
+    stops = LLM_EARLY_STOPS.value()
+    monkeypatch.setattr(main_module, "MAX_PLAN_COMMANDS", 1)
+    response = client.post("/diagnose", json={"username": "early", "issue": "No internet"})
+    assert response.json()["executed_command"] == "ping -c 4"
+    assert sorted(name for name, _ in events) == ["generation_stopped", "start ping -c 4"]
+    assert LLM_EARLY_STOPS.value() == stops + 1
+
+def test_speculative_command_from_local_classifier(monkeypatch, tmp_path):
+    """Test the predicted command starts before the LLM answers and is kept only on agreement."""
+    import time
+    import src.main as main_module
+    from src.db import TicketStore
+    from src.metrics import SPECULATIONS
+    from src.speculation import TriggerClassifier
+
+    classifier = TriggerClassifier()
+    assert classifier.predict("The printer won't print") == ("printer", "lpstat -p")
+    assert classifier.predict("Strange beeping noise") is None
+
+    replies = {"first": "Category: Printing System\nCOMMAND: lpstat -p\nLikely cause: Queue"}
+
+    class SlowLLM:
+        async def query(self, prompt):
+            if "final diagnosis" in prompt:
+                return "Diagnosis: Printer idle\nFix: Send a test page"
+            await asyncio.sleep(0.3)
+            return replies["first"]
+
+    starts = []
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        starts.append((command, time.perf_counter()))
+        if on_output is not None:
+            on_output(f"{command} is running")
+        await asyncio.sleep(0.3)
+        return {"cmd": command, "stdout": "printer HP is idle.\n", "stderr": "",
+                "returncode": 0, "runtime_ms": 300}
+
+    monkeypatch.setattr(main_module, "llm", SlowLLM())
+    monkeypatch.setattr(main_module, "speculator", classifier)
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    hits, misses = SPECULATIONS.value(result="hit"), SPECULATIONS.value(result="miss")
+
+    # LLM agrees: the command ran during the LLM call, and only once
+    start = time.perf_counter()
+    response = client.post("/diagnose", json={"username": "spec", "issue": "Printer won't print"})
+    assert time.perf_counter() - start < 0.55
+    assert response.json()["executed_command"] == "lpstat -p"
+    assert [command for command, _ in starts] == ["lpstat -p"]
+    assert starts[0][1] - start < 0.2
+    assert SPECULATIONS.value(result="hit") == hits + 1
+
+    # LLM disagrees: the prediction is discarded and the LLM's plan runs
+    starts.clear()
+    replies["first"] = "Category: Printing System\nCOMMAND: lpstat -v\nLikely cause: Driver"
+    response = client.post("/diagnose", json={"username": "spec", "issue": "Printer won't print"})
+    assert response.json()["executed_command"] == "lpstat -v"
+    assert [command for command, _ in starts] == ["lpstat -p", "lpstat -v"]
+    assert SPECULATIONS.value(result="miss") == misses + 1
+    assert "helpdesk_speculation_hit_ratio" in client.get("/metrics").text
+
+    # Streamed output only ever shows commands of the plan
+    monkeypatch.setattr(main_module, "db", TicketStore(data_dir=tmp_path))
+
+    async def streamed_output():
+        request = main_module.DiagnosisRequest(username="spec", issue="Printer won't print")
+        try:
+            return [
+                (event["command"], event["line"])
+                async for event in main_module.diagnose_events(request, stream_output=True)
+                if event["event"] == "output"
+            ]
+        finally:
+            await main_module.db.close()
+
+    assert asyncio.run(streamed_output()) == [("lpstat -v", "lpstat -v is running")]
+    # On a hit the held-back lines are tagged with the plan's command
+    replies["first"] = "Category: Printing System\nCOMMAND: lpstat  -p\nLikely cause: Queue"
+    assert asyncio.run(streamed_output()) == [("lpstat  -p", "lpstat -p is running")]
+
+def test_trained_classifier_skips_first_llm_turn(monkeypatch, tmp_path):
+    """Test the classifier trains from ticket history and replaces confident first turns."""
+    import src.main as main_module
+    from src.classifier import IssueClassifier, training_rows
+    from src.db import TicketStore
+
+    history = {
+        ("Network Connectivity", "ping -c 4 google.com"): [
+            "no internet since this morning", "wifi keeps dropping", "internet is down",
+            "cannot reach any website", "wifi connected but no internet", "network cable unplugged",
+        ],
+        ("Printing System", "lpstat -p"): [
+            "printer is offline", "printer won't print", "print job stuck in queue",
+            "printer shows error light", "cannot print to the office printer", "printing is very slow",
+        ],
+        ("System Performance", "systeminfo; ps aux"): [
+            "laptop is very sluggish", "computer freezing constantly", "apps not responding",
+            "pc takes ages to boot", "fan loud and computer sluggish", "everything freezes after login",
+        ],
+    }
+    store = TicketStore(data_dir=tmp_path)
+
+    async def seed():
+        for (category, command), issues in history.items():
+            for issue in issues:
+                ticket_id = await store.create_ticket("history", issue)
+                await store.update_ticket(ticket_id, category=category, command=command,
+                                          diagnosis="Resolved", fix="Resolved")
+        await store.create_ticket("history", "not diagnosed yet")
+        rows = await training_rows(store, page_size=5)
+        await store.close()
+        return rows
+
+    rows = asyncio.run(seed())
+    assert len(rows) == 18
+    model = IssueClassifier.fit([issue for issue, _ in rows], [label for _, label in rows])
+    model.save(tmp_path / "classifier.json")
+    model = IssueClassifier.load(tmp_path / "classifier.json")
+
+    issues = ["the printer is offline again", "wifi down, no internet", "computer sluggish and freezing"]
+    predictions = model.predict_batch(issues)
+    assert [p.command for p in predictions] == ["lpstat -p", "ping -c 4 google.com", "systeminfo; ps aux"]
+    for batched, issue in zip(predictions, issues):
+        single = model.predict(issue)
+        assert batched[:2] == single[:2]
+        assert batched.confidence == pytest.approx(single.confidence)
+    assert model.predict("quarterly budget spreadsheet").confidence < 0.9
+
+    with pytest.raises(ValueError):
+        IssueClassifier.fit(["only one"] * 3, [("Cat", "hostname")] * 3)
+
+    # A skewed history's prior alone never makes an unrelated issue confident
+    skewed = IssueClassifier.fit(
+        [f"no internet on floor {i}" for i in range(95)] + [f"printer jam {i}" for i in range(5)],
+        [("Network", "ping -c 4 google.com")] * 95 + [("Printing", "lpstat -p")] * 5,
+        min_samples=1
+    )
+    unrelated = ["my monitor flickers", "zzzz qqqq", "monitor"]
+    assert all(p.confidence == 0 for p in skewed.predict_batch(unrelated))
+    assert all(skewed.predict(issue).confidence == 0 for issue in unrelated)
+    assert skewed.predict("no internet again").confidence > 0.9
+
+    prompts = []
+
+    class RecordingLLM:
+        async def query(self, prompt):
+            prompts.append(prompt)
+            return "Diagnosis: Queue stuck\nFix: Clear the print queue"
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        return {"cmd": command, "stdout": "printer HP is idle.\n", "stderr": "",
+                "returncode": 0, "runtime_ms": 5}
+
+    monkeypatch.setattr(main_module, "llm", RecordingLLM())
+    monkeypatch.setattr(main_module, "classifier", model)
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+
+    response = client.post("/diagnose", json={"username": "clf", "issue": "The printer is offline"})
+    data = response.json()
+    assert data["executed_command"] == "lpstat -p"
+    assert data["diagnosis"] == "Queue stuck"
+    assert len(prompts) == 1 and "final diagnosis" in prompts[0]
+    assert "Category: Printing System" in prompts[0]
+
+def test_identical_issues_share_one_pipeline(monkeypatch):
+    """Test concurrent identical issues run one pipeline but each gets a ticket."""
+    import src.main as main_module
+    from src.metrics import PIPELINES_COALESCED
+
+    prompts = []
+    commands = []
+
+    class SlowLLM:
+        async def query(self, prompt):
+            prompts.append(prompt)
+            await asyncio.sleep(0.1)
+            if "final diagnosis" in prompt:
+                return "Diagnosis: ISP outage\nFix: Wait for the provider"
+            return "Category: Network Connectivity\nCOMMAND: ping -c 4 google.com\nLikely cause: Outage"
+
+    async def fake_run_command(command, timeout=10, on_output=None):
+        commands.append(command)
+        await asyncio.sleep(0.1)
+        return {"cmd": command, "stdout": "4 packets transmitted, 0 received, 100% packet loss\n",
+                "stderr": "", "returncode": 1, "runtime_ms": 100}
+
+    monkeypatch.setattr(main_module, "llm", SlowLLM())
+    monkeypatch.setattr(main_module, "COALESCE_PIPELINES", True)
+    monkeypatch.setattr(main_module.diagnostics, "run_command", fake_run_command)
+    coalesced = PIPELINES_COALESCED.value()
+
+    async def scenario():
+        issues = ["No internet!", "no  internet", "NO INTERNET", "No internet.", "Printer jammed"]
+        responses = await asyncio.gather(*(
+            main_module.diagnose_issue(main_module.DiagnosisRequest(username=f"user{i}", issue=issue))
+            for i, issue in enumerate(issues)
+        ))
+        tickets = [await main_module.db.get_ticket(r.ticket_id) for r in responses]
+        await main_module.db.close()
+        return responses, tickets
+
+    responses, tickets = asyncio.run(scenario())
+
+    # Four identical issues ran once; the printer issue ran on its own
+    assert len(prompts) == 4
+    assert len(commands) == 2
+    assert PIPELINES_COALESCED.value() == coalesced + 3
+    assert len({r.ticket_id for r in responses}) == 5
+    for response, ticket in zip(responses[:4], tickets[:4]):
+        assert response.diagnosis == "ISP outage"
+        assert ticket["diagnosis"] == "ISP outage"
+        assert ticket["category"] == "Network Connectivity"
+        assert "100% packet loss" in ticket["output"]
+    assert [t["username"] for t in tickets] == [f"user{i}" for i in range(5)]
+    assert main_module._pipelines == {}